@@ -1,10 +1,6 @@
 import json
 import re
-import anthropic
-import pandas as pd
-from datetime import datetime, timezone
-from sqlalchemy import text
-from aws_utils import get_secret, logger, get_db_session, execute_query
+from aws_utils import get_secret, logger, get_db_session, execute_query, log_invocation_metrics
 
 TAG_LIST = {
   'Price': [
@@ -64,6 +60,17 @@ TAG_LIST = {
   ]
 }
 
+def get_anthropic_client():
+    """
+    Create an Anthropic client using the API key from the cached COAPTAPIKeys secret.
+    anthropic is imported here rather than at module load because it is the heaviest
+    dependency of this function.
+    """
+    import anthropic
+
+    API_KEYS = get_secret(secret_name='COAPTAPIKeys')
+    return anthropic.Anthropic(api_key=API_KEYS["anthropic_api_key"])
+
 def fetch_properties_without_summary(limit=1000):
     """
     Fetches active properties from PostgreSQL that don't have a description_summary yet.
@@ -101,10 +108,6 @@ def create_batch():
     """
     logger.info("Creating Anthropic batch for property descriptions")
     
-    # Get Anthropic API key from secrets
-    API_KEYS = get_secret(secret_name='COAPTAPIKeys')
-    ANTHROPIC_API_KEY = API_KEYS["anthropic_api_key"]
-    
     # Fetch properties that need processing
     properties_list = fetch_properties_without_summary()
     
@@ -114,7 +117,7 @@ def create_batch():
     
     # Create the Anthropic client and batch
     try:
-        client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+        client = get_anthropic_client()
         
         message_batch = client.beta.messages.batches.create(
         requests=[
@@ -336,7 +339,15 @@ def sanitize_additional_fees(additional_fees):
         sanitized.append(sanitized_fee)
     return sanitized
 
-def extract_brokers_fee(property_id, additional_fees, listings_df):
+def extract_brokers_fee(property_id, additional_fees, prices):
+    """
+    Normalize the broker's fee from additional_fees to a fraction of a year's rent.
+
+    Args:
+        property_id (str): Listing id, used to look up its monthly price
+        additional_fees (list[dict]): Sanitized fees from the batch result
+        prices (dict): Monthly price by listing id, needed for fees given in dollars
+    """
     brokers_fee = None
 
     for fee in additional_fees:
@@ -347,9 +358,9 @@ def extract_brokers_fee(property_id, additional_fees, listings_df):
                 if fee_type == 'months':
                     brokers_fee = float(amount) / 12
                 elif fee_type == 'dollars':
-                    price_rows = listings_df[listings_df['fct_id'] == property_id]['price']
-                    if len(price_rows) > 0 and price_rows.values[0]:
-                        brokers_fee = float(amount) * 12 / price_rows.values[0]
+                    price = prices.get(property_id)
+                    if price:
+                        brokers_fee = float(amount) * 12 / float(price)
                 elif fee_type == 'percentage':
                     brokers_fee = float(amount) / 100
 
@@ -372,15 +383,23 @@ def update_rds(property_RDS_data):
         logger.info("No property data to update")
         return
 
+    # Entries without a property_id are never updated
+    property_ids = [p.get('property_id') for p in property_RDS_data if p.get('property_id')]
+    if not property_ids:
+        logger.info("No property ids to update")
+        return
+
     try:
         session = get_db_session()
 
+        # Only the prices of the listings in this batch are needed, not the whole view
         query_text = """
         SELECT fct_id, price
-        FROM real_estate.latest_property_details_view;"""
+        FROM real_estate.latest_property_details_view
+        WHERE fct_id = ANY(CAST(:property_ids AS VARCHAR[]));"""
 
-        listings = execute_query(session, query_text)
-        listings_df = pd.DataFrame(listings)
+        listings = execute_query(session, query_text, {"property_ids": property_ids})
+        prices = {fct_id: price for fct_id, price in listings}
 
         for property_data in property_RDS_data:
             property_id = property_data.get('property_id')
@@ -388,7 +407,7 @@ def update_rds(property_RDS_data):
             tag_list = [str(tag) for tag in tag_list]
             additional_fees = property_data.get('additional_fees', [])
             summary = property_data.get('summary')
-            brokers_fee = extract_brokers_fee(property_id, additional_fees, listings_df)
+            brokers_fee = extract_brokers_fee(property_id, additional_fees, prices)
 
             if property_id and tag_list:
                 query = """
@@ -434,12 +453,8 @@ def process_completed_batch_results(message_batch):
     logger.info(f"Processing completed batch results for batch ID: {message_batch.id}")
     
     try:
-        # Get Anthropic API key from secrets
-        API_KEYS = get_secret(secret_name='COAPTAPIKeys')
-        ANTHROPIC_API_KEY = API_KEYS["anthropic_api_key"]
-        
         # Create the Anthropic client
-        client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+        client = get_anthropic_client()
         
         # Check if batch is complete
         if message_batch.processing_status != "ended":
@@ -517,13 +532,9 @@ def poll_anthropic_batch(batch_id):
     
     logger.info(f"Polling Anthropic batch with ID: {batch_id}")
     
-    # Get Anthropic API key from secrets
-    API_KEYS = get_secret(secret_name='COAPTAPIKeys')
-    ANTHROPIC_API_KEY = API_KEYS["anthropic_api_key"]
-    
     # Create the Anthropic client and retrieve batch
     try:
-        client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+        client = get_anthropic_client()
         message_batch = client.beta.messages.batches.retrieve(batch_id)
         
         # Build response with batch information
@@ -552,6 +563,7 @@ def poll_anthropic_batch(batch_id):
         logger.error(f"Error polling Anthropic batch: {str(e)}")
         raise
 
+@log_invocation_metrics
 def lambda_handler(event, context):
     """
     Lambda handler for AnthropicBatchProcessor.
@@ -1,10 +1,4 @@
-import boto3
-import json
-import os
-from urllib.parse import urljoin
-from sqlalchemy import text
-from typing import Literal
-from aws_utils import get_secret, logger, get_db_session, execute_query
+from aws_utils import logger, get_db_session, execute_query, log_invocation_metrics
 
 def run_checks(check_type):
     # Add logic for each API type
@@ -81,6 +75,7 @@ def check_data_freshness(table_name):
             session.close()
 
 
+@log_invocation_metrics
 def lambda_handler(event, context):
     check_type = event["check_type"]
     try:
@@ -0,0 +1,199 @@
+"""
+Plans the properties search fan-out from last run's listing counts.
+
+The search endpoint returns up to SEARCH_PAGE_LIMIT listings per page for a comma
+separated list of areas, so the number of API calls a message costs is roughly
+ceil(listings / SEARCH_PAGE_LIMIT). Areas are packed first-fit-decreasing into requests
+that fill one page, and areas too heavy for a page are split into their child
+neighborhoods where the hierarchy allows it.
+"""
+
+import math
+import os
+from statistics import median
+from aws_utils import logger, execute_query
+from api_messages import SEARCH_PAGE_LIMIT
+
+# Counts drift between runs, so requests are packed below the page limit to avoid
+# spilling a few listings onto a second page
+PLANNER_FILL_RATIO = float(os.getenv("PLANNER_FILL_RATIO", "0.85"))
+# Keeps the areas query string to a sensible length
+PLANNER_MAX_AREAS_PER_REQUEST = int(os.getenv("PLANNER_MAX_AREAS_PER_REQUEST", "25"))
+# Estimate for areas with no listings in the last snapshot when there is no history at all
+PLANNER_DEFAULT_AREA_ESTIMATE = int(os.getenv("PLANNER_DEFAULT_AREA_ESTIMATE", "50"))
+# Level of the neighborhoods_enhanced_view hierarchy the search is fanned out over
+PLANNER_BASE_LEVEL = 3
+
+
+def area_slug(name):
+    """Area name as the search endpoint expects it, e.g. 'All Upper East Side' -> 'all-upper-east-side'."""
+    return name.lower().replace(' ', '-').replace('.', '')
+
+
+def fetch_neighborhood_tree(session):
+    """
+    Load the neighborhood hierarchy at and below PLANNER_BASE_LEVEL.
+
+    Returns:
+        tuple: (list of base-level slugs, dict of slug -> list of child slugs)
+    """
+    query = """SELECT id, name, parent_id, level
+               FROM real_estate.neighborhoods_enhanced_view
+               WHERE level >= :base_level
+               ORDER BY level, id;"""
+    rows = execute_query(session, query, {"base_level": PLANNER_BASE_LEVEL}).fetchall()
+
+    slugs_by_id = {row[0]: area_slug(row[1]) for row in rows}
+    base_areas = [area_slug(row[1]) for row in rows if row[3] == PLANNER_BASE_LEVEL]
+    children = {}
+    for row in rows:
+        if row[3] > PLANNER_BASE_LEVEL and row[2] in slugs_by_id:
+            children.setdefault(slugs_by_id[row[2]], []).append(area_slug(row[1]))
+    return base_areas, children
+
+
+def fetch_area_listing_counts(session):
+    """
+    Listing counts per neighborhood from the latest fct_properties snapshot, for all
+    listings and for no-fee listings.
+
+    Only listings whose details are loaded carry a neighborhood; the share of the snapshot
+    that has details is logged since low coverage makes the estimates run low.
+
+    Returns:
+        dict: {"all": {slug: count}, "no_fee": {slug: count}}
+    """
+    query = """WITH latest AS (
+                   SELECT id FROM real_estate.fct_properties
+                   WHERE date = (SELECT MAX(date) FROM real_estate.fct_properties)
+               )
+               SELECT d.neighborhood,
+                      COUNT(*) AS listings,
+                      COUNT(*) FILTER (WHERE d.no_fee) AS no_fee_listings,
+                      (SELECT COUNT(*) FROM latest) AS snapshot_size
+               FROM latest l
+               JOIN real_estate.dim_property_details d ON d.id = l.id
+               WHERE d.neighborhood IS NOT NULL
+               GROUP BY d.neighborhood;"""
+    rows = execute_query(session, query).fetchall()
+
+    counts = {"all": {}, "no_fee": {}}
+    if not rows:
+        return counts
+    matched = sum(row[1] for row in rows)
+    coverage = matched / rows[0][3] if rows[0][3] else 1.0
+    for neighborhood, listings, no_fee_listings, _ in rows:
+        slug = area_slug(neighborhood)
+        counts["all"][slug] = counts["all"].get(slug, 0) + listings
+        counts["no_fee"][slug] = counts["no_fee"].get(slug, 0) + no_fee_listings
+    logger.info(f"Loaded listing counts for {len(rows)} neighborhoods ({coverage:.0%} of the latest snapshot has details)")
+    return counts
+
+
+def subtree_count(slug, counts, children):
+    """Listings in an area including all of its descendants."""
+    return counts.get(slug, 0) + sum(subtree_count(child, counts, children) for child in children.get(slug, []))
+
+
+def split_heavy_areas(base_areas, counts, children, capacity):
+    """
+    Replace areas whose subtree does not fit in one request with their children,
+    recursively. An area is only split when no listings are tagged with the area itself,
+    since searching the children would miss those.
+
+    Returns:
+        list: (slug, estimated listings) tuples covering every base area
+    """
+    areas = []
+    pending = list(base_areas)
+    while pending:
+        slug = pending.pop()
+        estimate = subtree_count(slug, counts, children)
+        if estimate > capacity and children.get(slug) and counts.get(slug, 0) == 0:
+            logger.info(f"Splitting {slug} (~{estimate:.0f} listings) into {len(children[slug])} child areas")
+            pending.extend(children[slug])
+        else:
+            areas.append((slug, estimate))
+    return areas
+
+
+def pack_areas(areas, capacity, max_areas=PLANNER_MAX_AREAS_PER_REQUEST):
+    """
+    First-fit-decreasing packing of (slug, estimate) tuples into requests whose estimated
+    listings stay within capacity. Areas larger than capacity get a request of their own.
+
+    Returns:
+        list: dicts with "areas" (list of slugs) and "expected_listings"
+    """
+    requests = []
+    for slug, estimate in sorted(areas, key=lambda area: (-area[1], area[0])):
+        for request in requests:
+            if request["expected_listings"] + estimate <= capacity and len(request["areas"]) < max_areas:
+                request["areas"].append(slug)
+                request["expected_listings"] += estimate
+                break
+        else:
+            requests.append({"areas": [slug], "expected_listings": estimate})
+    return requests
+
+
+def expected_pages(listings, limit=SEARCH_PAGE_LIMIT):
+    """Search calls needed for a request, including the first page when it returns nothing."""
+    return max(1, math.ceil(round(listings) / limit))
+
+
+def plan_neighborhood_requests(base_areas, children, counts, limit=SEARCH_PAGE_LIMIT, fill_ratio=PLANNER_FILL_RATIO):
+    """
+    Build the search plan for one noFee pass.
+
+    Args:
+        base_areas: Base-level area slugs that must be covered
+        children: Dict of slug -> child slugs
+        counts: Dict of slug -> estimated listings for this pass
+        limit: Listings per search page
+        fill_ratio: Fraction of a page each packed request targets
+
+    Returns:
+        list: dicts with "areas" (comma separated), "expected_listings" and "expected_pages",
+        heaviest first
+    """
+    capacity = limit * fill_ratio
+
+    # Areas without history still have to be searched, so give them a typical estimate
+    # rather than zero; otherwise they would all be packed into one request
+    known = [c for c in (subtree_count(slug, counts, children) for slug in base_areas) if c > 0]
+    default_estimate = median(known) if known else PLANNER_DEFAULT_AREA_ESTIMATE
+    counts = dict(counts)
+    for slug in base_areas:
+        if subtree_count(slug, counts, children) == 0:
+            counts[slug] = default_estimate
+
+    areas = split_heavy_areas(base_areas, counts, children, capacity)
+    packed = pack_areas(areas, capacity)
+    return [{
+        "areas": ",".join(request["areas"]),
+        "expected_listings": round(request["expected_listings"]),
+        "expected_pages": expected_pages(request["expected_listings"], limit),
+    } for request in packed]
+
+
+def plan_search_requests(session):
+    """
+    Plan both noFee passes of the properties search from the database.
+
+    Returns:
+        list: dicts with "areas", "noFee", "expected_listings" and "expected_pages"
+    """
+    base_areas, children = fetch_neighborhood_tree(session)
+    counts = fetch_area_listing_counts(session)
+
+    plan = []
+    for no_fee, pass_counts in (("false", counts["all"]), ("true", counts["no_fee"])):
+        pass_plan = plan_neighborhood_requests(base_areas, children, pass_counts)
+        logger.info(
+            f"noFee={no_fee}: {len(base_areas)} areas packed into {len(pass_plan)} requests, "
+            f"~{sum(r['expected_listings'] for r in pass_plan)} listings, "
+            f"{sum(r['expected_pages'] for r in pass_plan)} expected pages"
+        )
+        plan.extend({**request, "noFee": no_fee} for request in pass_plan)
+    return plan
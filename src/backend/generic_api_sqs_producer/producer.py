@@ -1,67 +1,81 @@
-import boto3
 import json
 import os
-from urllib.parse import urljoin
-from sqlalchemy import text
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Literal
-from aws_utils import get_secret, logger, get_db_session, execute_query
+from aws_utils import logger, get_db_session, log_invocation_metrics
+from api_messages import search_message, details_message
+from detail_work_queue import (DETAIL_QUEUE_LEASE_SECONDS, ensure_detail_queue_table, refresh_detail_queue,
+                               claim_detail_ids)
+from refresh_scheduler import schedule_detail_refreshes
+from snapshot_diff import diff_latest_snapshot
+from neighborhood_planner import plan_search_requests
+from unsent_messages import ensure_unsent_messages_table, take_unsent_payloads, save_unsent_bodies
 
-def fetch_api_payloads(api_type, listing_type: Literal['sales', 'rentals'] = 'rentals'):
+# Work units per SQS message. A search unit costs about one page (see neighborhood_planner);
+# a details unit is one call. Consumers take 10 messages at a time, so these scale the
+# work per invocation.
+SEARCH_UNITS_PER_MESSAGE = int(os.getenv("SEARCH_UNITS_PER_MESSAGE", "2"))
+DETAIL_IDS_PER_MESSAGE = int(os.getenv("DETAIL_IDS_PER_MESSAGE", "20"))
+
+# Property ids leased from the detail work queue per producer run
+DETAIL_BATCH_LIMIT = int(os.getenv("DETAIL_BATCH_LIMIT", "2000"))
+# DynamoDB table behind the frontend's shared listings; empty disables the lookup
+SHARED_LISTINGS_TABLE = os.getenv("SHARED_LISTINGS_TABLE", "SharedListings")
 
-    base_url = "https://nyc-real-estate-api.p.rapidapi.com"
-    headers = get_secret(secret_name='RapidAPIKey')
+# SQS caps send_message_batch at 10 entries and 256 KB per call
+SQS_BATCH_MAX_ENTRIES = 10
+SQS_BATCH_MAX_BYTES = 256 * 1024
+SQS_SEND_WORKERS = int(os.getenv("SQS_SEND_WORKERS", "8"))
+SQS_SEND_MAX_ATTEMPTS = 4
 
-    # Checks to make sure that the listing_type makes for a valid endpoint
-    if listing_type not in ['sales', 'rentals']:
-        raise ValueError(f"Unsupported listing type: {listing_type}")
-    listing_type_url = urljoin(base_url, f"{listing_type}/")
+# How long messages left unsent by a failed run are resent by its retry; a search plan is
+# rebuilt daily, and detail ids are claimed again once their lease expires
+UNSENT_MAX_AGE_SECONDS = {
+    'properties': int(os.getenv("UNSENT_SEARCH_MAX_AGE_HOURS", "12")) * 3600,
+    'property_details': DETAIL_QUEUE_LEASE_SECONDS,
+}
 
+def fetch_api_payloads(api_type, listing_type: Literal['sales', 'rentals'] = 'rentals'):
+    """
+    Build the message bodies for an API type. Messages carry only the work units (search
+    areas or property ids), several per message; consumers resolve endpoints and
+    credentials themselves.
+    """
     # Add logic for each API type
     if api_type == "properties":
-        neighborhoods_list = fetch_api_neighorhood_strings()
-        properties_url = urljoin(listing_type_url, 'search')
-        
-        return [{"endpoint": properties_url, 
-                "headers": headers,
-                "params": {"areas":neighborhoods, 
-                            "noFee":fees,
-                            "limit":"500"}}
-                for fees in ['false', 'true']
-                for neighborhoods in neighborhoods_list]
+        search_plan = fetch_api_search_plan()
+        units = [{"areas": request["areas"],
+                  "noFee": request["noFee"],
+                  "expected_pages": request["expected_pages"]}
+                 for request in search_plan]
+        return [search_message(units[i:i + SEARCH_UNITS_PER_MESSAGE], listing_type)
+                for i in range(0, len(units), SEARCH_UNITS_PER_MESSAGE)]
     elif api_type == "property_details":
         property_ids = fetch_api_property_ids()
 
-        return [{"endpoint": urljoin(listing_type_url, id), 
-                 "headers":headers}
-                 for id in property_ids]
+        return [details_message(property_ids[i:i + DETAIL_IDS_PER_MESSAGE], listing_type)
+                for i in range(0, len(property_ids), DETAIL_IDS_PER_MESSAGE)]
     else:
         raise ValueError(f"Unsupported API type: {api_type}")
     
 
-def fetch_api_neighorhood_strings():
+def fetch_api_search_plan():
     """
-    Establishes a connection to the RDS table, and selects all neighborhoods that are just one level below
-    the borough using SQLAlchemy.
+    Establishes a connection to the RDS table, and plans the properties search over the neighborhoods
+    one level below the borough, packing them into requests from last run's listing counts.
     """
     try:
         # Get a SQLAlchemy session
         logger.info("Creating SQLAlchemy session")
         session = get_db_session()
-        
-        # Query the neighborhoods table
-        logger.info("Querying neighborhoods data")
-        query = "SELECT name FROM real_estate.neighborhoods_enhanced_view WHERE level=3;"
-        result = execute_query(session, query)
-        rows = result.fetchall()
-
-        # Splits into large and small groups
-        neighborhoods_list = [n[0].lower().replace(' ', '-').replace('.', '') for n in rows]
-
-        large_neighborhoods_list = [n for n in neighborhoods_list if 'all-' in n or '-all' in n]
-        small_neighborhoods_list = [n for n in neighborhoods_list if 'all-' not in n and '-all' not in n]
-        api_neighborhoods_list = large_neighborhoods_list + [','.join(small_neighborhoods_list[i:i+10]) for i in range(0, len(small_neighborhoods_list), 10)]
-        logger.info(f"fetchd {len(api_neighborhoods_list)} neighborhood batches")
-        return api_neighborhoods_list
+
+        logger.info("Planning neighborhood search requests")
+        search_plan = plan_search_requests(session)
+        logger.info(f"Planned {len(search_plan)} search requests, "
+                    f"{sum(r['expected_pages'] for r in search_plan)} expected pages")
+        return search_plan
 
     except Exception as e:
         raise Exception(f"Error fetching neighborhood data from RDS: {e}")
@@ -71,27 +85,58 @@ def fetch_api_neighorhood_strings():
             session.close()
 
 
+def fetch_shared_property_ids():
+    """
+    Collect the listing ids in users' shared collections from DynamoDB, so those
+    listings get their details ahead of others seen on the same day. Best effort:
+    returns an empty set if the table cannot be read.
+    """
+    if not SHARED_LISTINGS_TABLE:
+        return set()
+    try:
+        import boto3
+
+        paginator = boto3.client('dynamodb').get_paginator('scan')
+        shared_ids = set()
+        for page in paginator.paginate(
+            TableName=SHARED_LISTINGS_TABLE,
+            ProjectionExpression='propertyIds',
+            FilterExpression='sk = :meta',
+            ExpressionAttributeValues={':meta': {'S': 'META'}},
+        ):
+            for item in page.get('Items', []):
+                shared_ids.update(value['S'] for value in item.get('propertyIds', {}).get('L', []))
+        logger.info(f"Found {len(shared_ids)} shared listing ids")
+        return shared_ids
+    except Exception as e:
+        logger.warning(f"Could not read shared listings from {SHARED_LISTINGS_TABLE}: {e}")
+        return set()
+
+
 def fetch_api_property_ids():
     """
-    Establishes a connection to the RDS table, then fetches property ids from fct_properties
-    that are missing details using SQLAlchemy.
+    Establishes a connection to the RDS table, syncs the property detail work queue with
+    the listings in fct_properties that are missing details, closes the listings that left
+    the latest snapshot and adds the day's detail refreshes, then leases the next batch of
+    ids from it (newest listings first, then shared ones) using SQLAlchemy.
     """
     try:
         # Get a SQLAlchemy session
         logger.info("Creating SQLAlchemy session")
         session = get_db_session()
 
-        # Query the properties table - fetch only properties missing details
-        logger.info("Querying property IDs that need details")
-        query = """SELECT
-                    fct_id
-                    FROM real_estate.latest_property_details_view
-                    WHERE id IS NULL
-                    LIMIT 2000;"""
-        result = execute_query(session, query)
-        rows = result.fetchall()
+        ensure_detail_queue_table(session)
+        refresh_detail_queue(session, fetch_shared_property_ids())
+        # Once per snapshot day, listings that changed in the search feed are refreshed and
+        # the ones that left it are closed; the refresh budget then goes to stale details
+        diff_latest_snapshot(session)
+        schedule_detail_refreshes(session)
+        session.commit()
 
-        return [n[0] for n in rows]
+        # Leased ids are not handed out again until their lease expires, so overlapping
+        # runs do not re-enqueue ids that are still in flight
+        logger.info("Claiming property IDs that need details")
+        return claim_detail_ids(session, DETAIL_BATCH_LIMIT)
 
     except Exception as e:
         raise Exception(f"Error fetching IDs with old or without details data from RDS: {e}")
@@ -101,20 +146,145 @@ def fetch_api_property_ids():
             session.close()
 
 
+def chunk_sqs_entries(bodies):
+    """
+    Split message bodies into send_message_batch entry lists that respect the SQS
+    entry-count and payload-size limits. Entry ids are the bodies' positions.
+    """
+    batches = []
+    batch, batch_bytes = [], 0
+    for i, body in enumerate(bodies):
+        size = len(body.encode("utf-8"))
+        if batch and (len(batch) >= SQS_BATCH_MAX_ENTRIES or batch_bytes + size > SQS_BATCH_MAX_BYTES):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append({"Id": str(i), "MessageBody": body})
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def send_entries(sqs, queue_url, entries, max_attempts=SQS_SEND_MAX_ATTEMPTS):
+    """
+    Send one batch of entries, retrying only the entries SQS reports as failed.
+    Entries rejected as sender faults (e.g. malformed) are not retried.
+
+    Returns:
+        tuple: (number of entries sent, list of entries that could not be sent)
+    """
+    pending = entries
+    sent = 0
+    for attempt in range(1, max_attempts + 1):
+        try:
+            response = sqs.send_message_batch(QueueUrl=queue_url, Entries=pending)
+        except Exception as e:
+            if attempt == max_attempts:
+                logger.error(f"send_message_batch failed after {attempt} attempts: {e}")
+                return sent, pending
+            logger.warning(f"send_message_batch failed (attempt {attempt}/{max_attempts}), retrying: {e}")
+            time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+            continue
+
+        sent += len(response.get("Successful", []))
+        failed = response.get("Failed", [])
+        if not failed:
+            return sent, []
+
+        failed_ids = {f["Id"] for f in failed if not f.get("SenderFault")}
+        rejected = [f for f in failed if f.get("SenderFault")]
+        if rejected:
+            logger.error(f"SQS rejected {len(rejected)} entries: {rejected}")
+        retryable = [entry for entry in pending if entry["Id"] in failed_ids]
+        if not retryable or attempt == max_attempts:
+            rejected_ids = {f["Id"] for f in failed}
+            return sent, [entry for entry in pending if entry["Id"] in rejected_ids]
+        logger.warning(f"Retrying {len(retryable)} failed SQS entries (attempt {attempt}/{max_attempts})")
+        time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+        pending = retryable
+    return sent, pending
+
+
+def send_message_batches(sqs, queue_url, payloads, max_workers=SQS_SEND_WORKERS):
+    """
+    Enqueue payloads with send_message_batch, 10 entries per call, spread over a bounded
+    thread pool (boto3 clients are thread-safe).
+
+    Returns:
+        dict: sent, failed, failed_bodies (message bodies that could not be sent), calls,
+        seconds and messages_per_sec
+    """
+    start = time.perf_counter()
+    batches = chunk_sqs_entries([json.dumps(payload) for payload in payloads])
+    sent = 0
+    failed_bodies = []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as executor:
+        for batch_sent, batch_failed in executor.map(lambda batch: send_entries(sqs, queue_url, batch), batches):
+            sent += batch_sent
+            failed_bodies.extend(entry["MessageBody"] for entry in batch_failed)
+    failed = len(failed_bodies)
+
+    seconds = time.perf_counter() - start
+    messages_per_sec = sent / seconds if seconds > 0 else 0.0
+    logger.info(
+        f"Enqueued {sent}/{len(payloads)} messages in {len(batches)} batches "
+        f"in {seconds:.2f}s ({messages_per_sec:.0f} messages/sec, {failed} failed)"
+    )
+    return {
+        "sent": sent,
+        "failed": failed,
+        "failed_bodies": failed_bodies,
+        "calls": len(batches),
+        "seconds": seconds,
+        "messages_per_sec": messages_per_sec,
+    }
+
+
+@log_invocation_metrics
 def lambda_handler(event, context):
     api_type = event["api_type"]
     try:
-        payloads = fetch_api_payloads(api_type)
+        import boto3
 
         sqs = boto3.client('sqs')
         queue_endpoints_dict = {
             'properties': os.getenv("PROPERTIES_API_URL"),
             'property_details': os.getenv("PROPERTY_DETAILS_API_URL"),
         }
-        
-        for payload in payloads:
-            sqs.send_message(QueueUrl=queue_endpoints_dict[api_type], MessageBody=json.dumps(payload))
-        return {"statusCode": 200, "body": f"Processed API type {api_type}"}
+
+        # Get a SQLAlchemy session
+        logger.info("Creating SQLAlchemy session")
+        session = get_db_session()
+        ensure_unsent_messages_table(session)
+
+        # A retry of a run that failed part of the way resends only what that run could not
+        payloads = take_unsent_payloads(session, api_type, UNSENT_MAX_AGE_SECONDS[api_type])
+        if payloads:
+            logger.info(f"Resending {len(payloads)} messages left unsent by the previous run")
+        else:
+            payloads = fetch_api_payloads(api_type)
+
+        result = send_message_batches(sqs, queue_endpoints_dict[api_type], payloads)
+        save_unsent_bodies(session, api_type, result["failed_bodies"])
+        session.commit()
+
+        # Fail the run so it is retried; the retry sends only the saved messages
+        if result["failed"]:
+            raise Exception(f"Failed to enqueue {result['failed']} of {len(payloads)} messages; "
+                            "saved them for the retry to resend")
+
+        return {
+            "statusCode": 200,
+            "body": json.dumps({
+                "message": f"Processed API type {api_type}",
+                "sent": result["sent"],
+                "failed": result["failed"],
+            })
+        }
     except Exception as e:
         logger.error(f"Error processing API type {api_type}: {e}")
-        raise
\ No newline at end of file
+        raise
+    finally:
+        if 'session' in locals():
+            logger.info("Closing SQLAlchemy session")
+            session.close()
@@ -0,0 +1,181 @@
+"""
+Schedules re-fetches of listing details that are likely to be out of date.
+
+Details are fetched once, when a listing first shows up without them; after that only the
+thin search feed (id, price, location) is refreshed daily, so price cuts, status changes
+and closings never reach dim_property_details. Once a day the scheduler scores every
+listing in the latest snapshot that already has details and enqueues the
+DETAIL_REFRESH_DAILY_BUDGET best into the detail work queue as refreshes:
+
+    price mismatch   the latest search price differs from the stored details price
+    price moves      distinct search prices over the last DETAIL_REFRESH_WINDOW_DAYS
+    detail age       days since the details were last fetched (checked_at from the details
+                     hash table, which loaded_datetime stands in for until it has a row)
+    market time      days on market at the last fetch plus the age; long-listed units are
+                     the ones that get cut or close
+
+Listings fetched less than DETAIL_REFRESH_MIN_AGE_DAYS ago are only refreshed on a price
+mismatch. The day's run is recorded in real_estate.detail_refresh_runs, so overlapping
+producer runs schedule one set per day; refreshes left unclaimed from earlier days are
+dropped and rescored.
+"""
+
+import os
+from aws_utils import logger, execute_query
+from detail_work_queue import DETAIL_QUEUE_TABLE
+from details_hashes import DETAILS_HASH_TABLE, ensure_details_hash_table
+
+# Detail API calls a day spent on refreshes; 0 disables the scheduler
+DETAIL_REFRESH_DAILY_BUDGET = int(os.getenv("DETAIL_REFRESH_DAILY_BUDGET", "500"))
+DETAIL_REFRESH_MIN_AGE_DAYS = float(os.getenv("DETAIL_REFRESH_MIN_AGE_DAYS", "3"))
+# Age at which the age score stops growing
+DETAIL_REFRESH_MAX_AGE_DAYS = float(os.getenv("DETAIL_REFRESH_MAX_AGE_DAYS", "30"))
+DETAIL_REFRESH_WINDOW_DAYS = int(os.getenv("DETAIL_REFRESH_WINDOW_DAYS", "7"))
+# Days on market at which the market score stops growing
+DETAIL_REFRESH_MARKET_DAYS = 90
+DETAIL_REFRESH_RUNS_TABLE = "real_estate.detail_refresh_runs"
+
+# A search price that disagrees with the details means they are stale for certain, so it
+# outweighs every other signal combined
+SCORE_WEIGHTS = {"price_mismatch": 4.0, "price_moves": 2.0, "age": 1.0, "market": 0.5}
+
+
+def ensure_refresh_runs_table(session):
+    """
+    Create real_estate.detail_refresh_runs if it does not exist yet.
+    """
+    execute_query(session, f"""
+        CREATE TABLE IF NOT EXISTS {DETAIL_REFRESH_RUNS_TABLE} (
+            day DATE PRIMARY KEY,
+            budget INTEGER NOT NULL,
+            scheduled INTEGER,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+
+
+def claim_refresh_day(session, budget):
+    """
+    Record today's scheduling run. A concurrent run waits on the row lock and then finds
+    the day taken.
+
+    Returns:
+        bool: True if this run should schedule today's refreshes
+    """
+    return execute_query(session, f"""
+        INSERT INTO {DETAIL_REFRESH_RUNS_TABLE} (day, budget)
+        VALUES (CURRENT_DATE, :budget)
+        ON CONFLICT (day) DO NOTHING
+        RETURNING day
+    """, {"budget": budget}).fetchone() is not None
+
+
+def drop_unclaimed_refreshes(session):
+    """
+    Remove refreshes enqueued before today that are not leased, so they are rescored.
+
+    Returns:
+        int: Number of queue rows removed
+    """
+    return execute_query(session, f"""
+        DELETE FROM {DETAIL_QUEUE_TABLE}
+        WHERE refresh
+          AND enqueued_at < CURRENT_DATE
+          AND (lease_expires_at IS NULL OR lease_expires_at < now())
+    """).rowcount
+
+
+def enqueue_refreshes(session, budget):
+    """
+    Score the listings of the latest snapshot that have details and enqueue the best
+    budget of them as refreshes.
+
+    Returns:
+        dict: Counts of "scheduled" ids and of those with a "price_mismatch"
+    """
+    row = execute_query(session, f"""
+        WITH latest AS (
+            SELECT MAX(date) AS day FROM real_estate.fct_properties
+        ), search AS (
+            SELECT f.id,
+                   (ARRAY_AGG(f.price ORDER BY f.date DESC))[1] AS price,
+                   COUNT(DISTINCT f.price) - 1 AS price_moves,
+                   MAX(f.date) AS last_seen
+            FROM real_estate.fct_properties f, latest
+            WHERE f.date > latest.day - :window_days
+            GROUP BY f.id
+        ), candidates AS (
+            SELECT d.id,
+                   COALESCE(d.listed_at, latest.day) AS first_seen,
+                   s.price IS DISTINCT FROM d.price AS price_mismatch,
+                   s.price_moves,
+                   EXTRACT(EPOCH FROM now() - COALESCE(h.checked_at, d.loaded_datetime)) / 86400 AS age_days,
+                   COALESCE(d.days_on_market, 0) AS days_on_market
+            FROM search s
+            CROSS JOIN latest
+            JOIN real_estate.dim_property_details d ON d.id = s.id
+            LEFT JOIN {DETAILS_HASH_TABLE} h ON h.id = d.id
+            WHERE s.last_seen = latest.day
+              AND NOT EXISTS (SELECT 1 FROM {DETAIL_QUEUE_TABLE} q WHERE q.id = d.id)
+        ), scored AS (
+            SELECT id, first_seen, price_mismatch,
+                   :w_price_mismatch * CAST(price_mismatch AS INTEGER)
+                   + :w_price_moves * LEAST(price_moves, 3) / 3.0
+                   + :w_age * LEAST(COALESCE(age_days, :max_age_days) / :max_age_days, 1)
+                   + :w_market * LEAST((days_on_market + COALESCE(age_days, 0)) / :market_days, 1) AS score
+            FROM candidates
+            WHERE price_mismatch OR COALESCE(age_days, :min_age_days) >= :min_age_days
+        ), inserted AS (
+            INSERT INTO {DETAIL_QUEUE_TABLE} (id, first_seen, refresh)
+            SELECT id, first_seen, true
+            FROM scored
+            ORDER BY score DESC, id
+            LIMIT :budget
+            ON CONFLICT (id) DO NOTHING
+            RETURNING id
+        )
+        SELECT COUNT(*), COUNT(*) FILTER (WHERE scored.price_mismatch)
+        FROM inserted
+        JOIN scored ON scored.id = inserted.id
+    """, {
+        "budget": budget,
+        "window_days": DETAIL_REFRESH_WINDOW_DAYS,
+        "min_age_days": DETAIL_REFRESH_MIN_AGE_DAYS,
+        "max_age_days": DETAIL_REFRESH_MAX_AGE_DAYS,
+        "market_days": DETAIL_REFRESH_MARKET_DAYS,
+        **{f"w_{signal}": weight for signal, weight in SCORE_WEIGHTS.items()},
+    }).fetchone()
+    return {"scheduled": row[0], "price_mismatch": row[1]}
+
+
+def schedule_detail_refreshes(session, budget=DETAIL_REFRESH_DAILY_BUDGET):
+    """
+    Enqueue today's detail refreshes, once per day. The caller commits, normally before
+    claiming from the queue.
+
+    Args:
+        session: A SQLAlchemy session object
+        budget: Detail API calls to spend on refreshes today
+
+    Returns:
+        dict: Counts of "scheduled", "price_mismatch" and "dropped" (unclaimed refreshes
+        from earlier days); all 0 when today's set was already scheduled
+    """
+    counts = {"scheduled": 0, "price_mismatch": 0, "dropped": 0}
+    if budget <= 0:
+        return counts
+    ensure_refresh_runs_table(session)
+    ensure_details_hash_table(session)
+    if not claim_refresh_day(session, budget):
+        logger.info("Detail refreshes already scheduled today")
+        return counts
+
+    counts["dropped"] = drop_unclaimed_refreshes(session)
+    counts.update(enqueue_refreshes(session, budget))
+    execute_query(session, f"UPDATE {DETAIL_REFRESH_RUNS_TABLE} SET scheduled = :scheduled WHERE day = CURRENT_DATE",
+                  {"scheduled": counts["scheduled"]})
+    logger.info(
+        f"Scheduled {counts['scheduled']} of {budget} detail refreshes ({counts['price_mismatch']} with a "
+        f"search price mismatch, {counts['dropped']} unclaimed from earlier days dropped)"
+    )
+    return counts
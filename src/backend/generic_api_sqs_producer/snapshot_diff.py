@@ -0,0 +1,217 @@
+"""
+Turns the day-over-day change in the search snapshot into detail work.
+
+fct_properties holds one (id, price, latitude, longitude, url) row per listing per day.
+The search fan-out writes a day in chunks over the course of the run, so the latest day is
+only complete once a newer day has started: each complete day is compared with the day
+before it in one set-based query, once, and every listing is classified:
+
+    new            only in the complete day; missing details are enqueued by
+                   refresh_detail_queue, listings that already have details (relisted)
+                   are enqueued as refreshes
+    price_changed  in both days at a different price: refresh
+    moved          in both days with a different location or url: refresh
+    unchanged      nothing to do
+    disappeared    only in the previous day: marked closed in dim_property_details without
+                   an API call, unless it is back in a later day
+
+so the detail calls spent on listings that already have details follow the churn rather
+than the inventory. A search run that failed part of the way leaves a snapshot with whole
+areas missing, which would look like a wave of closings; when more than
+SNAPSHOT_MAX_CLOSE_FRACTION of the previous day disappears the closings are skipped and
+only the refreshes are enqueued. Each diff is recorded in real_estate.snapshot_diffs.
+"""
+
+import os
+from aws_utils import logger, execute_query
+from detail_work_queue import DETAIL_QUEUE_TABLE
+from details_hashes import DETAILS_HASH_TABLE, ensure_details_hash_table
+
+SNAPSHOT_DIFF_ENABLED = os.getenv("SNAPSHOT_DIFF", "true").lower() == "true"
+# Share of the previous day's listings that may be closed by one diff
+SNAPSHOT_MAX_CLOSE_FRACTION = float(os.getenv("SNAPSHOT_MAX_CLOSE_FRACTION", "0.2"))
+# Coordinate change, in degrees, that counts as a move (about 10 m); smaller changes are
+# rounding in the feed
+SNAPSHOT_MOVE_TOLERANCE = float(os.getenv("SNAPSHOT_MOVE_TOLERANCE", "0.0001"))
+SNAPSHOT_DIFFS_TABLE = "real_estate.snapshot_diffs"
+
+CHANGE_CLASSES = ("new", "price_changed", "moved", "unchanged", "disappeared")
+# Classes whose listings are re-fetched when they already have details
+REFRESH_CLASSES = ("new", "price_changed", "moved")
+
+
+def ensure_snapshot_diffs_table(session):
+    """
+    Create real_estate.snapshot_diffs if it does not exist yet.
+    """
+    execute_query(session, f"""
+        CREATE TABLE IF NOT EXISTS {SNAPSHOT_DIFFS_TABLE} (
+            day DATE PRIMARY KEY,
+            previous_day DATE,
+            new INTEGER,
+            price_changed INTEGER,
+            moved INTEGER,
+            unchanged INTEGER,
+            disappeared INTEGER,
+            closed INTEGER,
+            refreshes INTEGER,
+            closes_skipped BOOLEAN NOT NULL DEFAULT false,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+
+
+def claim_snapshot_day(session):
+    """
+    Record the diff of the latest complete snapshot day: the last day before the latest
+    one, which may still be loading. Days without a previous day are not claimed. A
+    concurrent run waits on the row lock and then finds the day taken.
+
+    Returns:
+        tuple or None: (day, previous day), or None if the day was already diffed or
+        there are not yet two complete days
+    """
+    return execute_query(session, f"""
+        WITH latest AS (
+            SELECT MAX(date) AS day FROM real_estate.fct_properties
+        ), complete AS (
+            SELECT MAX(f.date) AS day
+            FROM real_estate.fct_properties f, latest
+            WHERE f.date < latest.day
+        )
+        INSERT INTO {SNAPSHOT_DIFFS_TABLE} (day, previous_day)
+        SELECT complete.day,
+               (SELECT MAX(date) FROM real_estate.fct_properties WHERE date < complete.day)
+        FROM complete
+        WHERE EXISTS (SELECT 1 FROM real_estate.fct_properties WHERE date < complete.day)
+        ON CONFLICT (day) DO NOTHING
+        RETURNING day, previous_day
+    """).fetchone()
+
+
+def classify_snapshot(session, day, previous_day):
+    """
+    Classify every listing of the two days into the temporary table snapshot_diff, which
+    is dropped at commit.
+
+    Returns:
+        dict: Listings per change class
+    """
+    execute_query(session, """
+        CREATE TEMPORARY TABLE snapshot_diff ON COMMIT DROP AS
+        SELECT COALESCE(t.id, y.id) AS id,
+               CASE WHEN y.id IS NULL THEN 'new'
+                    WHEN t.id IS NULL THEN 'disappeared'
+                    WHEN t.price IS DISTINCT FROM y.price THEN 'price_changed'
+                    WHEN ABS(COALESCE(t.latitude - y.latitude, 0)) > :tolerance
+                      OR ABS(COALESCE(t.longitude - y.longitude, 0)) > :tolerance
+                      OR t.url IS DISTINCT FROM y.url THEN 'moved'
+                    ELSE 'unchanged'
+               END AS change
+        FROM (SELECT id, price, latitude, longitude, url
+              FROM real_estate.fct_properties WHERE date = :day) t
+        FULL JOIN (SELECT id, price, latitude, longitude, url
+                   FROM real_estate.fct_properties WHERE date = :previous_day) y ON y.id = t.id
+    """, {"day": day, "previous_day": previous_day, "tolerance": SNAPSHOT_MOVE_TOLERANCE})
+    counts = dict.fromkeys(CHANGE_CLASSES, 0)
+    counts.update(execute_query(session, "SELECT change, COUNT(*) FROM snapshot_diff GROUP BY change").fetchall())
+    return counts
+
+
+def close_disappeared(session, day):
+    """
+    Mark listings that left the snapshot on day as closed, and forget their detail hashes
+    so a relisting is written in full rather than matched against the open version.
+    Listings already back in a later (possibly still loading) day are left open.
+
+    Returns:
+        int: Number of listings closed
+    """
+    gone = """
+        s.change = 'disappeared'
+        AND NOT EXISTS (SELECT 1 FROM real_estate.fct_properties f WHERE f.id = s.id AND f.date > :day)
+    """
+    closed = execute_query(session, f"""
+        UPDATE real_estate.dim_property_details d
+        SET status = 'closed', closed_at = COALESCE(d.closed_at, :day)
+        FROM snapshot_diff s
+        WHERE s.id = d.id
+          AND d.status IS DISTINCT FROM 'closed'
+          AND {gone}
+    """, {"day": day}).rowcount
+    execute_query(session, f"""
+        DELETE FROM {DETAILS_HASH_TABLE} h
+        USING snapshot_diff s
+        WHERE s.id = h.id AND {gone}
+    """, {"day": day})
+    return closed
+
+
+def enqueue_changed(session, day):
+    """
+    Enqueue refreshes for changed listings that already have details; listings without
+    details are left to refresh_detail_queue.
+
+    Returns:
+        int: Number of refreshes enqueued
+    """
+    return execute_query(session, f"""
+        INSERT INTO {DETAIL_QUEUE_TABLE} (id, first_seen, refresh)
+        SELECT s.id, COALESCE(d.listed_at, :day), true
+        FROM snapshot_diff s
+        JOIN real_estate.dim_property_details d ON d.id = s.id
+        WHERE s.change = ANY(CAST(:classes AS TEXT[]))
+        ON CONFLICT (id) DO NOTHING
+    """, {"day": day, "classes": list(REFRESH_CLASSES)}).rowcount
+
+
+def diff_latest_snapshot(session, max_close_fraction=SNAPSHOT_MAX_CLOSE_FRACTION):
+    """
+    Diff the latest complete snapshot day against the one before it, once per day: close
+    the listings that disappeared and enqueue refreshes for the ones that changed. The
+    caller commits.
+
+    Args:
+        session: A SQLAlchemy session object
+        max_close_fraction: Share of the previous day's listings above which closings
+            are skipped
+
+    Returns:
+        dict or None: Listings per change class plus "closed" and "refreshes", or None if
+        the latest complete day was already diffed or there is none to diff yet
+    """
+    if not SNAPSHOT_DIFF_ENABLED:
+        return None
+    ensure_snapshot_diffs_table(session)
+    ensure_details_hash_table(session)
+    claimed = claim_snapshot_day(session)
+    if claimed is None:
+        logger.info("No complete snapshot day left to diff")
+        return None
+    day, previous_day = claimed
+
+    counts = classify_snapshot(session, day, previous_day)
+    previous_total = counts["price_changed"] + counts["moved"] + counts["unchanged"] + counts["disappeared"]
+    closes_skipped = counts["disappeared"] > max_close_fraction * previous_total
+    if closes_skipped:
+        logger.warning(
+            f"{counts['disappeared']} of {previous_total} listings disappeared between {previous_day} and {day}, "
+            f"more than {max_close_fraction:.0%}; the snapshot looks incomplete, not closing them"
+        )
+        counts["closed"] = 0
+    else:
+        counts["closed"] = close_disappeared(session, day)
+    counts["refreshes"] = enqueue_changed(session, day)
+
+    execute_query(session, f"""
+        UPDATE {SNAPSHOT_DIFFS_TABLE}
+        SET new = :new, price_changed = :price_changed, moved = :moved, unchanged = :unchanged,
+            disappeared = :disappeared, closed = :closed, refreshes = :refreshes,
+            closes_skipped = :closes_skipped
+        WHERE day = :day
+    """, {**counts, "closes_skipped": closes_skipped, "day": day})
+    logger.info(
+        f"Snapshot {day} vs {previous_day}: " + ", ".join(f"{counts[change]} {change}" for change in CHANGE_CLASSES)
+        + f"; closed {counts['closed']}, enqueued {counts['refreshes']} refreshes"
+    )
+    return counts
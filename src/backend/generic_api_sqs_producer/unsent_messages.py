@@ -0,0 +1,62 @@
+"""
+Messages the producer could not enqueue, kept for the retry of the run.
+
+When some send_message_batch entries still fail after their retries, the producer saves
+their bodies in real_estate.unsent_sqs_messages and fails the run. The retried run finds
+them and sends only those, instead of rebuilding every payload and duplicating the
+messages that already went out. Saved messages go stale: a search plan is rebuilt by the
+next daily run, and detail ids come back to the queue once their lease expires, so rows
+older than their API type's max age are dropped rather than resent.
+"""
+
+import json
+from aws_utils import logger, execute_query
+
+UNSENT_MESSAGES_TABLE = "real_estate.unsent_sqs_messages"
+
+
+def ensure_unsent_messages_table(session):
+    """
+    Create real_estate.unsent_sqs_messages if it does not exist yet.
+    """
+    execute_query(session, f"""
+        CREATE TABLE IF NOT EXISTS {UNSENT_MESSAGES_TABLE} (
+            id BIGSERIAL PRIMARY KEY,
+            api_type VARCHAR(50) NOT NULL,
+            body TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+
+
+def take_unsent_payloads(session, api_type, max_age_seconds):
+    """
+    Remove and return the payloads a previous run of api_type could not send; stale ones
+    are removed without being returned. The caller commits once the payloads are sent
+    (or saved again), so a run that dies in between leaves them in place.
+
+    Returns:
+        list: Message payloads, oldest first
+    """
+    rows = execute_query(session, f"""
+        DELETE FROM {UNSENT_MESSAGES_TABLE}
+        WHERE api_type = :api_type
+        RETURNING id, body, created_at > now() - make_interval(secs => :max_age_seconds) AS fresh
+    """, {"api_type": api_type, "max_age_seconds": max_age_seconds}).fetchall()
+    stale = sum(1 for row in rows if not row[2])
+    if stale:
+        logger.warning(f"Dropped {stale} unsent {api_type} messages older than {max_age_seconds}s")
+    return [json.loads(row[1]) for row in sorted(rows, key=lambda row: row[0]) if row[2]]
+
+
+def save_unsent_bodies(session, api_type, bodies):
+    """
+    Save message bodies that could not be sent, for the retry to resend. The caller
+    commits.
+    """
+    if not bodies:
+        return
+    execute_query(session, f"""
+        INSERT INTO {UNSENT_MESSAGES_TABLE} (api_type, body)
+        VALUES (:api_type, :body)
+    """, [{"api_type": api_type, "body": body} for body in bodies])
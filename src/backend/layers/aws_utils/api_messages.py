@@ -0,0 +1,128 @@
+import asyncio
+import os
+from urllib.parse import urljoin, urlsplit
+from aws_utils import logger, get_secret, refresh_secret
+
+# RapidAPI messages carry only the work; endpoints and credentials are resolved by the
+# consumer. Version 0 is the legacy format with a full "endpoint" and "headers".
+MESSAGE_VERSION = 1
+SEARCH_KIND = "search"
+DETAILS_KIND = "details"
+LISTING_TYPES = ("rentals", "sales")
+
+# Overridable so the pipeline can run against a local stand-in (scripts/perf_harness.py)
+RAPIDAPI_BASE_URL = os.getenv("RAPIDAPI_BASE_URL", "https://nyc-real-estate-api.p.rapidapi.com")
+RAPIDAPI_SECRET_NAME = "RapidAPIKey"
+# Listings per search page, the most the endpoint returns
+SEARCH_PAGE_LIMIT = 500
+
+
+def _check_listing_type(listing_type):
+    if listing_type not in LISTING_TYPES:
+        raise ValueError(f"Unsupported listing type: {listing_type}")
+
+
+def search_message(units, listing_type="rentals"):
+    """
+    Build a search message for one or more search units.
+
+    Args:
+        units: Dicts with "areas" (comma separated slugs), "noFee" ('true'/'false') and
+            optionally "expected_pages" from the planner
+        listing_type: 'rentals' or 'sales'
+
+    Returns:
+        dict: The message body
+    """
+    _check_listing_type(listing_type)
+    return {"v": MESSAGE_VERSION, "kind": SEARCH_KIND, "listing_type": listing_type, "units": list(units)}
+
+
+def details_message(property_ids, listing_type="rentals"):
+    """
+    Build a details message for one or more property ids.
+
+    Returns:
+        dict: The message body
+    """
+    _check_listing_type(listing_type)
+    return {"v": MESSAGE_VERSION, "kind": DETAILS_KIND, "listing_type": listing_type, "ids": list(property_ids)}
+
+
+def _legacy_listing_type(endpoint):
+    """Listing type from a legacy endpoint such as https://host/rentals/search."""
+    return urlsplit(endpoint).path.strip("/").split("/")[0]
+
+
+def parse_message(message):
+    """
+    Expand a message body into its work units, accepting both the current and the legacy
+    format so messages enqueued before a deploy are still processed.
+
+    Returns:
+        tuple: (kind, listing_type, list of units); search units are dicts with "areas",
+        "noFee" and "expected_pages" (None when unknown), details units are property ids
+    """
+    if "endpoint" in message:
+        listing_type = _legacy_listing_type(message["endpoint"])
+        if "params" in message:
+            params = message["params"]
+            unit = {"areas": params["areas"], "noFee": params.get("noFee", "false"),
+                    "expected_pages": message.get("plan", {}).get("expected_pages")}
+            return SEARCH_KIND, listing_type, [unit]
+        return DETAILS_KIND, listing_type, [message["endpoint"].rstrip("/").rsplit("/", 1)[-1]]
+
+    version = message.get("v")
+    if version != MESSAGE_VERSION:
+        raise ValueError(f"Unsupported message version: {version}")
+    kind = message["kind"]
+    listing_type = message.get("listing_type", "rentals")
+    _check_listing_type(listing_type)
+    if kind == SEARCH_KIND:
+        units = [{"areas": unit["areas"], "noFee": unit.get("noFee", "false"),
+                  "expected_pages": unit.get("expected_pages")} for unit in message["units"]]
+        return kind, listing_type, units
+    if kind == DETAILS_KIND:
+        return kind, listing_type, list(message["ids"])
+    raise ValueError(f"Unsupported message kind: {kind}")
+
+
+def search_endpoint(listing_type="rentals"):
+    """RapidAPI search URL for a listing type."""
+    return urljoin(RAPIDAPI_BASE_URL, f"{listing_type}/search")
+
+
+def details_endpoint(property_id, listing_type="rentals"):
+    """RapidAPI details URL for a property id."""
+    return urljoin(RAPIDAPI_BASE_URL, f"{listing_type}/{property_id}")
+
+
+def rapidapi_get(http, url, rate_limiter=None, **kwargs):
+    """
+    GET a RapidAPI URL with the cached credentials. If they are rejected (401/403), for
+    example after a key rotation, the secret is re-fetched and the request retried once.
+
+    Returns:
+        HttpResponse: The response of the last attempt
+    """
+    response = http.get(url, headers=get_secret(secret_name=RAPIDAPI_SECRET_NAME), rate_limiter=rate_limiter, **kwargs)
+    if response.status_code in (401, 403):
+        logger.warning(f"RapidAPI rejected credentials ({response.status_code}), refreshing secret")
+        response = http.get(url, headers=refresh_secret(RAPIDAPI_SECRET_NAME), rate_limiter=rate_limiter, **kwargs)
+    return response
+
+
+async def rapidapi_get_async(http, url, rate_limiter=None, **kwargs):
+    """
+    Async version of rapidapi_get for an AsyncHttpClient; the secret refresh runs in a
+    worker thread.
+
+    Returns:
+        HttpResponse: The response of the last attempt
+    """
+    response = await http.get(url, headers=get_secret(secret_name=RAPIDAPI_SECRET_NAME), rate_limiter=rate_limiter, **kwargs)
+    if response.status_code in (401, 403):
+        logger.warning(f"RapidAPI rejected credentials ({response.status_code}), refreshing secret")
+        headers = await asyncio.to_thread(refresh_secret, RAPIDAPI_SECRET_NAME)
+        response = await http.get(url, headers=headers, rate_limiter=rate_limiter, **kwargs)
+    return response
@@ -0,0 +1,142 @@
+import asyncio
+import time
+import asyncpg
+from aws_utils import get_secret, logger, record_query_stats
+from bulk_upsert import build_merge_sql, quote_ident, staging_table_name
+
+# asyncpg pools are bound to the event loop that created them, and each asyncio.run() call
+# gets a new loop, so pools are cached per (loop, database)
+_pools = {}
+
+
+async def get_async_pool(db_name='coapt', min_size=1, max_size=5):
+    """
+    Get an asyncpg connection pool for the RDS database, configured from the same
+    COAPTRDSConfig secret as the synchronous engine.
+
+    Args:
+        db_name: Name of the database to connect to
+        min_size: Connections opened up front
+        max_size: Maximum connections in the pool
+
+    Returns:
+        Pool: An asyncpg pool bound to the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    key = (id(loop), db_name)
+    pool = _pools.get(key)
+    if pool is not None and not pool._closed:
+        return pool
+
+    # Pools left behind by earlier, already closed loops cannot be awaited any more
+    for stale_key in [k for k in _pools if k[0] != id(loop)]:
+        _pools.pop(stale_key).terminate()
+
+    aws_rds_config = get_secret(secret_name='COAPTRDSConfig')
+    logger.info("Creating asyncpg pool")
+    pool = await asyncpg.create_pool(
+        host=aws_rds_config.get('db_host'),
+        user=aws_rds_config.get('db_user'),
+        password=aws_rds_config.get('db_password'),
+        port=aws_rds_config.get('db_port', 5432),
+        database=db_name,
+        ssl=aws_rds_config.get('db_sslmode', 'require'),
+        timeout=5,
+        min_size=min_size,
+        max_size=max_size,
+    )
+    _pools[key] = pool
+    return pool
+
+
+async def close_async_pools():
+    """
+    Close every pool created on the running event loop. Call before asyncio.run() returns.
+    """
+    loop_id = id(asyncio.get_running_loop())
+    for key in [k for k in _pools if k[0] == loop_id]:
+        await _pools.pop(key).close()
+
+
+async def async_execute_query(query, *args, db_name='coapt'):
+    """
+    Execute a statement that returns no rows, e.g. UPDATE or DELETE.
+    Uses asyncpg's positional $1, $2 ... parameters.
+
+    Returns:
+        str: The command status, e.g. 'UPDATE 3'
+    """
+    pool = await get_async_pool(db_name)
+    start = time.perf_counter()
+    try:
+        return await pool.execute(query, *args)
+    except Exception as e:
+        logger.error(f"Error executing async query: {e}")
+        raise
+    finally:
+        record_query_stats(query, time.perf_counter() - start)
+
+
+async def async_fetch(query, *args, db_name='coapt'):
+    """
+    Run a query and return all rows as asyncpg Records.
+    Uses asyncpg's positional $1, $2 ... parameters.
+    """
+    pool = await get_async_pool(db_name)
+    start = time.perf_counter()
+    try:
+        rows = await pool.fetch(query, *args)
+    except Exception as e:
+        logger.error(f"Error executing async query: {e}")
+        raise
+    record_query_stats(query, time.perf_counter() - start, rows_returned=len(rows))
+    return rows
+
+
+async def async_bulk_upsert(table, columns, records, conflict_target=None, update_columns=None,
+                            extra_values=None, db_name='coapt'):
+    """
+    Async counterpart of bulk_upsert.bulk_upsert: binary COPY of records into a temporary
+    staging table, then one INSERT ... SELECT ... ON CONFLICT merge, in its own transaction.
+
+    Args:
+        records: Sequence of tuples in columns order
+        Other arguments are as for bulk_upsert.bulk_upsert.
+
+    Returns:
+        dict: rows_staged, rows_written, seconds and rows_per_sec
+    """
+    start = time.perf_counter()
+    columns = list(columns)
+    extra_values = dict(extra_values or {})
+    staging = staging_table_name(table)
+    column_list = ", ".join(quote_ident(c) for c in columns)
+
+    pool = await get_async_pool(db_name)
+    async with pool.acquire() as connection:
+        async with connection.transaction():
+            await connection.execute(
+                f"CREATE TEMP TABLE {quote_ident(staging)} ON COMMIT DROP AS "
+                f"SELECT {column_list} FROM {quote_ident(table)} WITH NO DATA"
+            )
+            await connection.execute(f"ALTER TABLE {quote_ident(staging)} ADD COLUMN _bulk_seq BIGSERIAL")
+            await connection.copy_records_to_table(staging, records=records, columns=columns)
+            status = await connection.execute(
+                build_merge_sql(table, staging, columns, conflict_target, update_columns, extra_values)
+            )
+
+    rows_staged = len(records)
+    rows_written = int(status.split()[-1])
+    seconds = time.perf_counter() - start
+    rows_per_sec = rows_staged / seconds if seconds > 0 else 0.0
+    record_query_stats(f"async bulk upsert into {table}", seconds, rows_affected=rows_written)
+    logger.info(
+        f"Bulk upserted {rows_staged} rows into {table} ({rows_written} written) "
+        f"in {seconds:.2f}s ({rows_per_sec:.0f} rows/sec, async binary COPY)"
+    )
+    return {
+        "rows_staged": rows_staged,
+        "rows_written": rows_written,
+        "seconds": seconds,
+        "rows_per_sec": rows_per_sec,
+    }
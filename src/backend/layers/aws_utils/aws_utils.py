@@ -1,63 +1,421 @@
-import boto3
+import functools
+import hashlib
 import json
-import psycopg2
+import os
+import re
+import threading
 import time
-from psycopg2 import pool
 from aws_lambda_powertools import Logger
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
 logger = Logger(service="coapt_lambda_functions")
 
-def get_secret(secret_name, region_name="us-east-2"):
+# Secrets handling
+SECRETS_CACHE_TTL_SECONDS = float(os.getenv("SECRETS_CACHE_TTL_SECONDS", "900"))
+SECRETS_CACHE_DIR = os.getenv("SECRETS_CACHE_DIR", "/tmp/coapt_secrets")
+
+
+class SecretsManagerBackend:
     """
-    Retrieve a secret from AWS Secrets Manager.
+    Fetches secrets from AWS Secrets Manager, reusing one client per region.
     """
-    client = boto3.client("secretsmanager", region_name=region_name)
 
-    try:
+    def __init__(self):
+        self._clients = {}
+
+    def fetch(self, secret_name, region_name):
+        client = self._clients.get(region_name)
+        if client is None:
+            # boto3 takes a few hundred ms to import and is only needed on a cache miss
+            import boto3
+            client = boto3.client("secretsmanager", region_name=region_name)
+            self._clients[region_name] = client
+
         response = client.get_secret_value(SecretId=secret_name)
         if "SecretString" in response:
-            return json.loads(response["SecretString"])
+            value = json.loads(response["SecretString"])
         else:
-            return json.loads(response["SecretBinary"].decode("utf-8"))
+            value = json.loads(response["SecretBinary"].decode("utf-8"))
+        return value, response.get("VersionId")
+
+
+class LocalSecretsBackend:
+    """
+    Serves secrets from a local JSON file of {secret_name: {...}} so the cache and every
+    handler can be exercised offline. latency_seconds simulates the Secrets Manager round-trip.
+    """
+
+    def __init__(self, path=None, latency_seconds=0.0):
+        self.path = path or os.getenv("LOCAL_SECRETS_PATH", "local_secrets.json")
+        self.latency_seconds = latency_seconds
+
+    def fetch(self, secret_name, region_name):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        with open(self.path) as f:
+            secrets = json.load(f)
+        if secret_name not in secrets:
+            raise KeyError(f"Secret {secret_name} not found in {self.path}")
+        value = secrets[secret_name]
+        return value, hashlib.sha1(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+
+class SecretsCache:
+    """
+    Two-level secrets cache: an in-process dict for warm invocations, backed by files in /tmp
+    that survive a runtime restart within the same sandbox.
+
+    Entries expire after a per-secret TTL. refresh() bypasses both levels, which callers use
+    after an authentication failure so a rotated secret is picked up immediately.
+    """
+
+    def __init__(self, backend, default_ttl=SECRETS_CACHE_TTL_SECONDS, ttls=None, cache_dir=SECRETS_CACHE_DIR):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self.ttls = dict(ttls or {})
+        self.cache_dir = cache_dir
+        self._memory = {}
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "tmp_hits": 0, "misses": 0, "refreshes": 0, "rotations": 0}
+
+    def get(self, secret_name, region_name, ttl=None):
+        if ttl is not None:
+            self.ttls[secret_name] = ttl
+
+        with self._lock:
+            key = (region_name, secret_name)
+            entry = self._memory.get(key)
+            if entry and entry["expires_at"] > time.time():
+                self.stats["memory_hits"] += 1
+                return entry["value"]
+
+            entry = self._read_tmp(key)
+            if entry and entry["expires_at"] > time.time():
+                self.stats["tmp_hits"] += 1
+                self._memory[key] = entry
+                return entry["value"]
+
+            self.stats["misses"] += 1
+            return self._fetch(key, previous=entry)
+
+    def refresh(self, secret_name, region_name):
+        with self._lock:
+            key = (region_name, secret_name)
+            self.stats["refreshes"] += 1
+            return self._fetch(key, previous=self._memory.get(key))
+
+    def invalidate(self, secret_name=None):
+        with self._lock:
+            for key in list(self._memory):
+                if secret_name is None or key[1] == secret_name:
+                    del self._memory[key]
+                    try:
+                        os.remove(self._tmp_path(key))
+                    except OSError:
+                        pass
+
+    def _fetch(self, key, previous=None):
+        region_name, secret_name = key
+        value, version_id = self.backend.fetch(secret_name, region_name)
+        if previous and previous.get("version_id") and previous["version_id"] != version_id:
+            self.stats["rotations"] += 1
+            logger.info(f"Secret {secret_name} was rotated (version {previous['version_id']} -> {version_id})")
+
+        ttl = self.ttls.get(secret_name, self.default_ttl)
+        entry = {"value": value, "version_id": version_id, "expires_at": time.time() + ttl}
+        self._memory[key] = entry
+        self._write_tmp(key, entry)
+        return value
+
+    def _tmp_path(self, key):
+        region_name, secret_name = key
+        return os.path.join(self.cache_dir, f"{region_name}.{secret_name}.json")
+
+    def _read_tmp(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._tmp_path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_tmp(self, key, entry):
+        if not self.cache_dir:
+            return
+        try:
+            os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+            fd = os.open(self._tmp_path(key), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry, f)
+        except OSError as e:
+            logger.warning(f"Could not write secret cache file: {e}")
+
+
+def _secrets_backend_from_env():
+    if os.getenv("SECRETS_BACKEND", "secretsmanager") == "local":
+        latency_ms = float(os.getenv("LOCAL_SECRETS_LATENCY_MS", "0"))
+        return LocalSecretsBackend(latency_seconds=latency_ms / 1000)
+    return SecretsManagerBackend()
+
+
+_secrets_cache = SecretsCache(_secrets_backend_from_env())
+
+
+def get_secret(secret_name, region_name="us-east-2", ttl=None, force_refresh=False):
+    """
+    Retrieve a secret from AWS Secrets Manager.
+    Results are cached in memory and in /tmp for ttl seconds (SECRETS_CACHE_TTL_SECONDS by
+    default); pass force_refresh=True after an authentication failure to re-fetch.
+    """
+    try:
+        if force_refresh:
+            return _secrets_cache.refresh(secret_name, region_name)
+        return _secrets_cache.get(secret_name, region_name, ttl=ttl)
     except Exception as e:
         logger.error(f"Error retrieving secret: {e}")
         raise
 
 
+def refresh_secret(secret_name, region_name="us-east-2"):
+    """
+    Re-fetch a secret, bypassing the cache. Use after the secret's credentials were rejected.
+    """
+    return get_secret(secret_name, region_name, force_refresh=True)
+
+
+def get_secret_cache_stats():
+    """
+    Get secrets cache hit/miss counters: memory_hits, tmp_hits, misses, refreshes and rotations.
+    """
+    return dict(_secrets_cache.stats)
+
+
 # SQLAlchemy connection handling
+DB_ENGINE_IDLE_TTL_SECONDS = float(os.getenv("DB_ENGINE_IDLE_TTL_SECONDS", "240"))
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that records how long each checkout waited for a connection.
+    The wait is stashed on the connection record and picked up by the checkout listener.
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        record = super()._do_get()
+        record.info["pool_wait_seconds"] = time.perf_counter() - start
+        return record
+
+
+class EngineManager:
+    """
+    Owns one SQLAlchemy engine and one sessionmaker per database for the lifetime of the
+    Lambda container.
+
+    Instead of running SELECT 1 on every call, liveness is only re-checked when the engine
+    has been idle for longer than idle_ttl seconds, or after a disconnect error was seen.
+
+    Handlers call it from worker threads, so creating, validating and disposing engines
+    happen under one lock: concurrent cold calls wait for the first engine instead of each
+    building their own pool. The pool counters have a lock of their own, because the pool
+    listeners that update them run on checkout, which may happen while another thread
+    holds the manager lock and waits for a pooled connection.
+    """
+
+    def __init__(self, idle_ttl=DB_ENGINE_IDLE_TTL_SECONDS, max_retries=3, backoff_base=2):
+        self.idle_ttl = idle_ttl
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self._engines = {}
+        self._sessionmakers = {}
+        self._last_used = {}
+        self._needs_validation = set()
+        self._stats = {}
+        # Reentrant: a failed validation disposes and recreates while holding it
+        self._lock = threading.RLock()
+        self._stats_lock = threading.Lock()
+
+    def get_engine(self, db_name='coapt', max_retries=None, backoff_base=None):
+        """
+        Return the engine for db_name, creating it on first use and validating it only when
+        it is stale.
+
+        Args:
+            db_name: Name of the database to connect to
+            max_retries: Connection attempts if an engine has to be created; defaults to
+                the manager's
+            backoff_base: Base of the exponential backoff between those attempts
+        """
+        with self._lock:
+            engine = self._engines.get(db_name)
+            if engine is None:
+                logger.info("Creating new SQLAlchemy engine")
+                engine = self._create_engine(db_name, max_retries, backoff_base)
+            elif self._is_stale(db_name):
+                engine = self._validate_engine(db_name, engine, max_retries, backoff_base)
+
+            self._last_used[db_name] = time.monotonic()
+            return engine
+
+    def get_session(self, db_name='coapt'):
+        """
+        Return a new session from the cached sessionmaker for db_name.
+        """
+        with self._lock:
+            engine = self.get_engine(db_name)
+            factory = self._sessionmakers.get(db_name)
+            if factory is None or factory.kw.get("bind") is not engine:
+                factory = sessionmaker(bind=engine)
+                self._sessionmakers[db_name] = factory
+        return factory()
+
+    def pool_stats(self, db_name='coapt'):
+        """
+        Return cumulative pool statistics for db_name along with the live pool state.
+        """
+        with self._lock:
+            engine = self._engines.get(db_name)
+        with self._stats_lock:
+            stats = dict(self._stats.get(db_name) or self._new_stats())
+        if engine is not None:
+            pool = engine.pool
+            stats.update({
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+            })
+        return stats
+
+    def dispose(self, db_name=None):
+        """
+        Dispose of one engine, or all of them if db_name is None.
+        """
+        with self._lock:
+            names = [db_name] if db_name else list(self._engines)
+            for name in names:
+                engine = self._engines.pop(name, None)
+                self._sessionmakers.pop(name, None)
+                self._last_used.pop(name, None)
+                self._needs_validation.discard(name)
+                if engine is not None:
+                    engine.dispose()
+
+    def _is_stale(self, db_name):
+        if db_name in self._needs_validation:
+            return True
+        last_used = self._last_used.get(db_name)
+        return last_used is None or time.monotonic() - last_used > self.idle_ttl
+
+    def _validate_engine(self, db_name, engine, max_retries=None, backoff_base=None):
+        with self._stats_lock:
+            self._stats[db_name]["validations"] += 1
+        self._needs_validation.discard(db_name)
+
+        logger.debug("Validating idle SQLAlchemy engine")
+        if _ping_engine(engine):
+            return engine
+
+        # Drop every pooled connection and try once more before paying for a new engine
+        logger.warning("SQLAlchemy engine failed validation, disposing pooled connections")
+        engine.dispose()
+        if _ping_engine(engine):
+            return engine
+
+        logger.warning("SQLAlchemy engine is invalid, recreating")
+        self.dispose(db_name)
+        return self._create_engine(db_name, max_retries, backoff_base)
+
+    def _create_engine(self, db_name, max_retries=None, backoff_base=None):
+        engine = init_sqlalchemy_engine(
+            db_name,
+            self.max_retries if max_retries is None else max_retries,
+            self.backoff_base if backoff_base is None else backoff_base,
+        )
+        with self._stats_lock:
+            self._stats.setdefault(db_name, self._new_stats())["engines_created"] += 1
+        self._attach_listeners(db_name, engine)
+        instrument_engine(engine)
+        self._engines[db_name] = engine
+        return engine
+
+    def _attach_listeners(self, db_name, engine):
+        stats = self._stats[db_name]
+
+        @event.listens_for(engine.pool, "checkout")
+        def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+            wait = connection_record.info.pop("pool_wait_seconds", 0.0)
+            # Reported with the first statement run on this checkout by the query instrumentation
+            connection_record.info["unreported_pool_wait"] = wait
+            with self._stats_lock:
+                stats["checkouts"] += 1
+                stats["wait_time_seconds"] += wait
+                stats["max_wait_seconds"] = max(stats["max_wait_seconds"], wait)
+
+        @event.listens_for(engine.pool, "invalidate")
+        def _on_invalidate(dbapi_connection, connection_record, exception):
+            with self._stats_lock:
+                stats["invalidations"] += 1
+            self._needs_validation.add(db_name)
+
+        @event.listens_for(engine, "handle_error")
+        def _on_error(exception_context):
+            if exception_context.is_disconnect:
+                self._needs_validation.add(db_name)
+
+    @staticmethod
+    def _new_stats():
+        return {
+            "checkouts": 0,
+            "wait_time_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "invalidations": 0,
+            "validations": 0,
+            "engines_created": 0,
+        }
+
+
+def _ping_engine(engine):
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        return True
+    except Exception as e:
+        logger.warning(f"SQLAlchemy engine ping failed: {e}")
+        return False
+
+
+_engine_manager = EngineManager()
+
+
 def get_sqlalchemy_engine(db_name='coapt', max_retries=3, backoff_base=2):
     """
     Get a SQLAlchemy engine for the RDS database.
-    Implements a singleton pattern to ensure only one engine is created and reused.
-    
+    The engine is created once per container and reused; see EngineManager for when it is
+    re-validated.
+
     Args:
         db_name: Name of the database to connect to
         max_retries: Maximum number of retry attempts
         backoff_base: Base for exponential backoff calculation
-        
+
     Returns:
         Engine: A SQLAlchemy engine object
     """
-    # Singleton-like pattern, ensures one engine is created and reused
-    if not hasattr(get_sqlalchemy_engine, "_engine"):
-        logger.info("Creating new SQLAlchemy engine")
-        get_sqlalchemy_engine._engine = init_sqlalchemy_engine(db_name, max_retries, backoff_base)
-    else:
-        # Test if the engine is still valid with a simple query
-        try:
-            logger.debug("Testing existing SQLAlchemy engine")
-            connection = get_sqlalchemy_engine._engine.connect()
-            connection.execute(text("SELECT 1"))
-            connection.close()
-            logger.debug("SQLAlchemy engine is valid")
-        except Exception as e:
-            logger.warning(f"SQLAlchemy engine is invalid, recreating: {e}")
-            # Create a new engine
-            get_sqlalchemy_engine._engine = init_sqlalchemy_engine(db_name, max_retries, backoff_base)
-    
-    return get_sqlalchemy_engine._engine
+    return _engine_manager.get_engine(db_name, max_retries, backoff_base)
+
+
+def get_pool_stats(db_name='coapt'):
+    """
+    Get connection pool statistics for the RDS database: checkouts, overflow, total and max
+    pool wait time, and invalidations.
+
+    Returns:
+        dict: Cumulative pool counters plus the current pool size, checked out and overflow
+    """
+    return _engine_manager.pool_stats(db_name)
 
 
 def init_sqlalchemy_engine(db_name='coapt', max_retries=3, backoff_base=2):
@@ -75,11 +433,14 @@ def init_sqlalchemy_engine(db_name='coapt', max_retries=3, backoff_base=2):
     for attempt in range(max_retries):
         try:
             logger.info(f"Fetching RDS Config details from Secrets Manager (attempt {attempt + 1}/{max_retries})")
-            aws_rds_config = get_secret(secret_name='COAPTRDSConfig')
+            # A failed attempt may be a rotated password, so later attempts bypass the cache
+            aws_rds_config = get_secret(secret_name='COAPTRDSConfig', force_refresh=attempt > 0)
             db_host = aws_rds_config.get('db_host')
             db_user = aws_rds_config.get('db_user')
             db_password = aws_rds_config.get('db_password')  # Get password from secrets
-            port = 5432
+            port = aws_rds_config.get('db_port', 5432)
+            # Local databases (e.g. scripts/perf_harness.py) set db_sslmode to 'disable'
+            sslmode = aws_rds_config.get('db_sslmode', 'require')
 
             logger.info(f"Creating SQLAlchemy engine with password authentication (attempt {attempt + 1}/{max_retries})")
             # Format connection string with password instead of token
@@ -87,12 +448,15 @@ def init_sqlalchemy_engine(db_name='coapt', max_retries=3, backoff_base=2):
             engine = create_engine(
                 connection_string,
                 connect_args={
-                    'sslmode': 'require',
+                    'sslmode': sslmode,
                     'connect_timeout': 5  # Reduced timeout for faster failure
                 },
-                pool_pre_ping=True,  # Verify connections before use
+                poolclass=TimedQueuePool,  # Records checkout wait time for get_pool_stats
                 pool_size=5,
                 max_overflow=5,
+                # A connection RDS dropped while the container was frozen is replaced on
+                # checkout instead of failing the first statement run on it
+                pool_pre_ping=True,
                 pool_recycle=300  # Recycle connections after 5 minutes
             )
             
@@ -126,14 +490,12 @@ def init_sqlalchemy_engine(db_name='coapt', max_retries=3, backoff_base=2):
 def get_db_session(db_name='coapt'):
     """
     Get a SQLAlchemy session for the RDS database.
-    
+    Sessions come from a single sessionmaker that is reused across calls and warm invocations.
+
     Returns:
         Session: A SQLAlchemy session object
     """
-    engine = get_sqlalchemy_engine(db_name)
-    session_factory = sessionmaker(bind=engine)
-    Session = scoped_session(session_factory)
-    return Session()
+    return _engine_manager.get_session(db_name)
 
 
 def execute_query(session, query, params=None):
@@ -156,4 +518,269 @@ def execute_query(session, query, params=None):
         return result
     except Exception as e:
         logger.error(f"Error executing query: {e}")
-        raise
\ No newline at end of file
+        raise
+
+
+def stream_query(session, query, params=None, chunk_size=5000, as_dataframe=True):
+    """
+    Execute a query with a server-side cursor and yield its result in chunks of at most
+    chunk_size rows, so large result sets never have to fit in memory at once.
+
+    The cursor lives inside the session's transaction: the caller may write through the same
+    session while iterating, but must not commit until the generator is exhausted.
+
+    Args:
+        session: A SQLAlchemy session object
+        query: A SQL query as a string
+        params: Optional parameters for the query
+        chunk_size: Maximum number of rows per chunk
+        as_dataframe: Yield pandas DataFrames if True, otherwise dicts of column name -> list
+
+    Yields:
+        DataFrame or dict: One chunk of rows
+    """
+    statement = text(query).execution_options(stream_results=True, max_row_buffer=chunk_size)
+    try:
+        result = session.execute(statement, params or {})
+    except Exception as e:
+        logger.error(f"Error executing streaming query: {e}")
+        raise
+
+    columns = list(result.keys())
+    if as_dataframe:
+        import pandas as pd
+
+    try:
+        for rows in result.partitions(chunk_size):
+            if as_dataframe:
+                yield pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+            else:
+                yield {column: list(values) for column, values in zip(columns, zip(*rows))}
+    finally:
+        result.close()
+
+
+# Query instrumentation
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "1000"))
+EXPLAIN_SLOW_QUERIES = os.getenv("EXPLAIN_SLOW_QUERIES", "false").lower() == "true"
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_BIND_PARAM = re.compile(r"%\(\w+\)s|%s|(?<!:):\w+")
+_VALUE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+_WRITE_KEYWORDS = re.compile(r"\b(insert|update|delete|merge|create|alter|drop|truncate|copy)\b")
+
+
+def fingerprint_statement(statement):
+    """
+    Normalize a SQL statement by replacing literals and bind parameters with ? and collapsing
+    IN (...) lists, so executions of the same query share one fingerprint.
+
+    Returns:
+        tuple: (12-character fingerprint, normalized statement)
+    """
+    normalized = _STRING_LITERAL.sub("?", statement)
+    normalized = _BIND_PARAM.sub("?", normalized)
+    normalized = _NUMBER_LITERAL.sub("?", normalized)
+    normalized = _VALUE_LIST.sub("(?)", normalized)
+    normalized = _WHITESPACE.sub(" ", normalized).strip().lower()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:12], normalized
+
+
+class QueryStats:
+    """
+    Per-invocation aggregate of statement executions keyed by fingerprint.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._queries = {}
+            self.explained = set()
+
+    def record(self, statement, seconds, rows_returned=0, rows_affected=0, pool_wait=0.0):
+        fingerprint, normalized = fingerprint_statement(statement)
+        with self._lock:
+            entry = self._queries.get(fingerprint)
+            if entry is None:
+                entry = self._queries[fingerprint] = {
+                    "fingerprint": fingerprint,
+                    "statement": normalized[:200],
+                    "calls": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "rows_returned": 0,
+                    "rows_affected": 0,
+                    "pool_wait_ms": 0.0,
+                }
+            elapsed_ms = seconds * 1000
+            entry["calls"] += 1
+            entry["total_ms"] += elapsed_ms
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+            entry["rows_returned"] += rows_returned
+            entry["rows_affected"] += rows_affected
+            entry["pool_wait_ms"] += pool_wait * 1000
+        return fingerprint
+
+    def summary(self):
+        with self._lock:
+            queries = sorted(self._queries.values(), key=lambda q: q["total_ms"], reverse=True)
+            return [dict(q, total_ms=round(q["total_ms"], 2), max_ms=round(q["max_ms"], 2),
+                         pool_wait_ms=round(q["pool_wait_ms"], 2)) for q in queries]
+
+
+_query_stats = QueryStats()
+
+
+def instrument_engine(engine):
+    """
+    Attach cursor execution listeners that record per-statement latency, rows and pool wait
+    time, log slow statements and optionally capture their EXPLAIN (ANALYZE, BUFFERS) plan.
+    """
+
+    # The start time lives on the statement's execution context, so a statement that raises
+    # takes its start time with it instead of leaving it on the pooled connection
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.query_start_time = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start_time = getattr(context, "query_start_time", None)
+        if start_time is None:
+            return
+        seconds = time.perf_counter() - start_time
+
+        # Server-side cursors report -1 until rows are fetched
+        rowcount = max(cursor.rowcount, 0)
+        returns_rows = cursor.description is not None
+        pool_wait = conn.info.pop("unreported_pool_wait", 0.0)
+        fingerprint = _query_stats.record(
+            statement,
+            seconds,
+            rows_returned=rowcount if returns_rows else 0,
+            rows_affected=0 if returns_rows else rowcount,
+            pool_wait=pool_wait,
+        )
+
+        elapsed_ms = round(seconds * 1000, 2)
+        log_fields = {
+            "fingerprint": fingerprint,
+            "elapsed_ms": elapsed_ms,
+            "rows": rowcount,
+            "pool_wait_ms": round(pool_wait * 1000, 2),
+            "executemany": executemany,
+        }
+        if elapsed_ms < SLOW_QUERY_THRESHOLD_MS:
+            logger.debug("query", extra=log_fields)
+            return
+
+        logger.warning("slow_query", extra=dict(log_fields, statement=statement[:1000]))
+        if EXPLAIN_SLOW_QUERIES and not executemany and fingerprint not in _query_stats.explained:
+            _query_stats.explained.add(fingerprint)
+            _explain_statement(conn, statement, parameters, fingerprint)
+
+
+def _explain_statement(conn, statement, parameters, fingerprint):
+    # EXPLAIN ANALYZE executes the statement again, so only read-only statements are explained
+    if _WRITE_KEYWORDS.search(statement.lower()):
+        return
+    try:
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        finally:
+            cursor.close()
+        logger.warning("slow_query_plan", extra={"fingerprint": fingerprint, "plan": plan})
+    except Exception as e:
+        logger.warning(f"Could not capture plan for slow query {fingerprint}: {e}")
+
+
+def record_query_stats(statement, seconds, rows_returned=0, rows_affected=0):
+    """
+    Record a statement that bypassed the engine's cursor events, such as COPY on a raw cursor.
+    """
+    return _query_stats.record(statement, seconds, rows_returned=rows_returned, rows_affected=rows_affected)
+
+
+def get_query_summary():
+    """
+    Get the per-fingerprint query summary for the current invocation, slowest first.
+    """
+    return _query_stats.summary()
+
+
+# Invocation metrics
+_metrics_providers = {
+    "pool": get_pool_stats,
+    "secrets": get_secret_cache_stats,
+}
+_metrics_resets = {}
+# time.time() at which the running invocation times out, from its Lambda context
+_invocation_deadline = None
+
+
+def remaining_invocation_seconds():
+    """
+    Seconds left before the running Lambda invocation times out.
+
+    Returns:
+        float or None: None outside a handler decorated with log_invocation_metrics
+    """
+    if _invocation_deadline is None:
+        return None
+    return _invocation_deadline - time.time()
+
+
+def register_metrics_provider(name, provider, reset=None):
+    """
+    Register a zero-argument callable whose dict result is included in the invocation summary.
+    If reset is given it is called at the start of every invocation, like the query stats.
+    """
+    _metrics_providers[name] = provider
+    if reset is not None:
+        _metrics_resets[name] = reset
+
+
+def log_invocation_summary():
+    """
+    Log one structured line with the query summary and every registered metrics provider.
+    """
+    summary = {"queries": get_query_summary()}
+    for name, provider in _metrics_providers.items():
+        try:
+            summary[name] = provider()
+        except Exception as e:
+            logger.warning(f"Could not collect {name} metrics: {e}")
+    logger.info("invocation_summary", extra=summary)
+    return summary
+
+
+def log_invocation_metrics(handler):
+    """
+    Decorator for Lambda handlers: resets per-invocation stats on entry and logs the
+    invocation summary on exit, whether or not the handler raised. The invocation's
+    deadline is kept for remaining_invocation_seconds().
+    """
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global _invocation_deadline
+        _query_stats.reset()
+        for reset in _metrics_resets.values():
+            reset()
+        get_remaining = getattr(context, "get_remaining_time_in_millis", None)
+        _invocation_deadline = time.time() + get_remaining() / 1000 if get_remaining else None
+        try:
+            return handler(event, context)
+        finally:
+            _invocation_deadline = None
+            log_invocation_summary()
+
+    return wrapper
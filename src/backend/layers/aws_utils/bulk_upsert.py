@@ -0,0 +1,525 @@
+import io
+import itertools
+import json
+import math
+import struct
+import time
+from collections.abc import Mapping
+from datetime import date, datetime, timezone
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy import text
+from aws_utils import logger, record_query_stats
+
+COPY_CHUNK_ROWS = 1000
+PG_EPOCH_DATE = date(2000, 1, 1)
+PG_EPOCH_DATETIME = datetime(2000, 1, 1)
+PG_EPOCH_DATETIME_UTC = datetime(2000, 1, 1, tzinfo=timezone.utc)
+BINARY_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+BINARY_COPY_TRAILER = struct.pack(">h", -1)
+_pack_int4 = struct.Struct(">i").pack
+
+_staging_counter = itertools.count()
+_column_types_cache = {}
+
+
+def quote_ident(name):
+    """
+    Double-quote an identifier, or each part of a schema-qualified name.
+    """
+    return ".".join('"' + part.strip('"').replace('"', '""') + '"' for part in name.split("."))
+
+
+def bulk_upsert(session, table, columns, records, conflict_target=None, update_columns=None,
+                extra_values=None, copy_format="csv"):
+    """
+    Stream records into a temporary staging table with COPY FROM STDIN, then merge them into
+    the target table with a single INSERT ... SELECT ... ON CONFLICT statement.
+
+    Rows that share a conflict key are collapsed before the merge, with the last one written
+    winning. The caller owns the transaction and is responsible for commit/rollback.
+
+    Args:
+        session: A SQLAlchemy session object
+        table: Schema-qualified target table, e.g. 'real_estate.fct_properties'
+        columns: Column names supplied by each record
+        records: Iterable of dicts keyed by column, or sequences in columns order
+        conflict_target: Columns of the unique constraint to merge on, or None for a plain insert
+        update_columns: Columns to overwrite on conflict. None updates every staged column that
+            is not part of the conflict target; an empty list means DO NOTHING. Columns that are
+            not staged take the target's default through EXCLUDED.
+        extra_values: Optional {column: sql_expression} evaluated during the merge,
+            e.g. {'date': 'CURRENT_DATE'}
+        copy_format: 'csv' or 'binary'. Both take array columns (text[], int4[], ...) as
+            Python lists; CSV values are written for the target column's type, so floats
+            into integer columns are rounded the way an INSERT would cast them
+
+    Returns:
+        dict: rows_staged, rows_written, seconds and rows_per_sec
+    """
+    if copy_format not in ("csv", "binary"):
+        raise ValueError(f"Unsupported COPY format: {copy_format}")
+
+    start = time.perf_counter()
+    columns = list(columns)
+    extra_values = dict(extra_values or {})
+    staging = staging_table_name(table)
+    column_list = ", ".join(quote_ident(c) for c in columns)
+
+    session.execute(text(
+        f"CREATE TEMP TABLE {quote_ident(staging)} ON COMMIT DROP AS "
+        f"SELECT {column_list} FROM {quote_ident(table)} WITH NO DATA"
+    ))
+    # Sequence column records arrival order so the merge can apply last-write-wins
+    session.execute(text(f"ALTER TABLE {quote_ident(staging)} ADD COLUMN _bulk_seq BIGSERIAL"))
+
+    rows_staged = _copy_records(session, table, staging, columns, records, copy_format)
+
+    merge_sql = build_merge_sql(table, staging, columns, conflict_target, update_columns, extra_values)
+    result = session.execute(text(merge_sql))
+    rows_written = result.rowcount
+    session.execute(text(f"DROP TABLE {quote_ident(staging)}"))
+
+    seconds = time.perf_counter() - start
+    rows_per_sec = rows_staged / seconds if seconds > 0 else 0.0
+    logger.info(
+        f"Bulk upserted {rows_staged} rows into {table} ({rows_written} written) "
+        f"in {seconds:.2f}s ({rows_per_sec:.0f} rows/sec, {copy_format} COPY)"
+    )
+    return {
+        "rows_staged": rows_staged,
+        "rows_written": rows_written,
+        "seconds": seconds,
+        "rows_per_sec": rows_per_sec,
+    }
+
+
+def staging_table_name(table):
+    """
+    Unique temporary table name for staging rows bound for table.
+    """
+    return f"_stg_{table.split('.')[-1]}_{next(_staging_counter)}"
+
+
+def build_merge_sql(table, staging, columns, conflict_target, update_columns, extra_values):
+    """
+    Build the INSERT ... SELECT ... ON CONFLICT statement that merges a staging table into
+    table. See bulk_upsert for the meaning of the arguments.
+    """
+    insert_columns = columns + list(extra_values)
+    insert_list = ", ".join(quote_ident(c) for c in insert_columns)
+    select_list = ", ".join([quote_ident(c) for c in columns] + list(extra_values.values()))
+
+    # Only staged conflict columns can be deduplicated; extra_values are constant per merge
+    dedupe_keys = [c for c in (conflict_target or []) if c in columns]
+    if dedupe_keys:
+        key_list = ", ".join(quote_ident(c) for c in dedupe_keys)
+        source = (
+            f"SELECT DISTINCT ON ({key_list}) {select_list} FROM {quote_ident(staging)} "
+            f"ORDER BY {key_list}, _bulk_seq DESC"
+        )
+    else:
+        source = f"SELECT {select_list} FROM {quote_ident(staging)} ORDER BY _bulk_seq"
+
+    sql = f"INSERT INTO {quote_ident(table)} ({insert_list}) {source}"
+    if not conflict_target:
+        return sql
+
+    target_list = ", ".join(quote_ident(c) for c in conflict_target)
+    if update_columns is None:
+        update_columns = [c for c in insert_columns if c not in conflict_target]
+    if not update_columns:
+        return f"{sql} ON CONFLICT ({target_list}) DO NOTHING"
+
+    assignments = ", ".join(f"{quote_ident(c)} = EXCLUDED.{quote_ident(c)}" for c in update_columns)
+    return f"{sql} ON CONFLICT ({target_list}) DO UPDATE SET {assignments}"
+
+
+def _copy_records(session, table, staging, columns, records, copy_format):
+    """
+    COPY records into the staging table over the session's own connection, so the load is
+    part of the caller's transaction. Returns the number of rows sent.
+    """
+    rows_sent = 0
+
+    def rows():
+        nonlocal rows_sent
+        for record in records:
+            rows_sent += 1
+            yield _row_values(record, columns)
+
+    if copy_format == "binary":
+        encoders = [_binary_encoder(t) for t in get_column_types(session, table, columns)]
+        chunks = _binary_chunks(rows(), encoders)
+        options = "FORMAT binary"
+    else:
+        encoders = [_csv_encoder(t) for t in get_column_types(session, table, columns)]
+        chunks = _csv_chunks(rows(), encoders)
+        options = "FORMAT csv"
+
+    column_list = ", ".join(quote_ident(c) for c in columns)
+    copy_sql = f"COPY {quote_ident(staging)} ({column_list}) FROM STDIN WITH ({options})"
+    start = time.perf_counter()
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(copy_sql, _ChunkStream(chunks))
+    finally:
+        cursor.close()
+    # COPY runs on the raw cursor, so it is recorded here rather than by the engine events
+    record_query_stats(copy_sql, time.perf_counter() - start, rows_affected=rows_sent)
+    return rows_sent
+
+
+def _row_values(record, columns):
+    if isinstance(record, Mapping):
+        values = [record.get(c) for c in columns]
+    else:
+        values = list(record)
+        if len(values) != len(columns):
+            raise ValueError(f"Expected {len(columns)} values per record, got {len(values)}")
+    # pandas hands missing values over as float NaN
+    return [None if isinstance(v, float) and math.isnan(v) else v for v in values]
+
+
+class _ChunkStream(io.RawIOBase):
+    """
+    Read-only file object over an iterator of byte chunks, so COPY can stream records without
+    materializing the whole payload.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = bytearray()
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0 or size >= len(self._buffer):
+            data = bytes(self._buffer)
+            self._buffer.clear()
+        else:
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+        return data
+
+
+def _to_int(value):
+    """
+    Coerce a value for an integer column the way a numeric literal cast to one rounds: half
+    away from zero, not truncated. Shared by the CSV and binary encoders so both formats
+    store the same integer.
+    """
+    if isinstance(value, float) and not value.is_integer():
+        return int(Decimal(repr(value)).to_integral_value(ROUND_HALF_UP))
+    if isinstance(value, Decimal):
+        return int(value.to_integral_value(ROUND_HALF_UP))
+    return int(value)
+
+
+# CSV encoding
+def _csv_field(value):
+    # Unquoted empty is NULL in CSV COPY; every string is quoted so '' stays an empty string
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, float) and value.is_integer():
+        # pandas turns integer columns with gaps into floats; "12.0" is not valid bigint input
+        return str(int(value))
+    if isinstance(value, (int, float, Decimal)):
+        return str(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, dict):
+        value = json.dumps(value)
+    elif isinstance(value, (list, tuple)):
+        raise TypeError(f"Cannot write list {value!r} to a non-array column in CSV COPY")
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _csv_int_field(value):
+    # COPY would reject "3500.5" outright, so fractions are rounded as in binary COPY
+    if value is None:
+        return ""
+    return str(_to_int(value))
+
+
+def _csv_json_field(value):
+    if value is None:
+        return ""
+    return _csv_field(value if isinstance(value, str) else json.dumps(value))
+
+
+def _array_literal(values):
+    items = []
+    for item in values:
+        if item is None:
+            items.append("NULL")
+        elif isinstance(item, (list, tuple)):
+            items.append(_array_literal(item))
+        else:
+            if isinstance(item, bool):
+                item = "t" if item else "f"
+            elif isinstance(item, (date, datetime)):
+                item = item.isoformat()
+            items.append('"' + str(item).replace("\\", "\\\\").replace('"', '\\"') + '"')
+    return "{" + ",".join(items) + "}"
+
+
+def _csv_array_field(value):
+    if value is None:
+        return ""
+    if not isinstance(value, (list, tuple)):
+        raise TypeError(f"Array column value must be a list, got {type(value).__name__}")
+    return '"' + _array_literal(value).replace('"', '""') + '"'
+
+
+def _csv_encoder(typname):
+    if typname in ("int2", "int4", "int8"):
+        return _csv_int_field
+    if typname in ("json", "jsonb"):
+        return _csv_json_field
+    if typname.startswith("_"):
+        return _csv_array_field
+    return _csv_field
+
+
+def _csv_chunks(rows, encoders):
+    lines = []
+    for row in rows:
+        lines.append(",".join([encode(v) for v, encode in zip(row, encoders)]))
+        if len(lines) >= COPY_CHUNK_ROWS:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+# Binary encoding
+def get_column_types(session, table, columns):
+    """
+    Look up the Postgres type name of each column, cached per table for the container lifetime.
+    """
+    types = _column_types_cache.get(table)
+    if types is None:
+        result = session.execute(text("""
+            SELECT a.attname, t.typname
+            FROM pg_attribute a
+            JOIN pg_type t ON t.oid = a.atttypid
+            WHERE a.attrelid = CAST(:table AS regclass)
+              AND a.attnum > 0 AND NOT a.attisdropped
+        """), {"table": table})
+        types = {name: typname for name, typname in result}
+        _column_types_cache[table] = types
+
+    missing = [c for c in columns if c not in types]
+    if missing:
+        raise ValueError(f"Columns {missing} do not exist on {table}")
+    return [types[c] for c in columns]
+
+
+def _binary_chunks(rows, encoders):
+    field_count = struct.pack(">h", len(encoders))
+    null = _pack_int4(-1)
+    buffer = bytearray(BINARY_COPY_HEADER)
+    pending = 0
+    for row in rows:
+        buffer += field_count
+        for value, encode in zip(row, encoders):
+            if value is None:
+                buffer += null
+            else:
+                data = encode(value)
+                buffer += _pack_int4(len(data))
+                buffer += data
+        pending += 1
+        if pending >= COPY_CHUNK_ROWS:
+            yield bytes(buffer)
+            buffer = bytearray()
+            pending = 0
+    buffer += BINARY_COPY_TRAILER
+    yield bytes(buffer)
+
+
+def _encode_text(value):
+    return (value if isinstance(value, str) else str(value)).encode("utf-8")
+
+
+def _encode_bool(value):
+    return b"\x01" if value else b"\x00"
+
+
+def _numeric_parts(value):
+    """
+    Split a number into (negative, integer digits, fraction digits) as written, so 12.50
+    keeps its display scale. ints and floats are read from their repr, which is what
+    Decimal(str(value)) would parse, without building a Decimal.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        text = repr(value)
+        if "e" not in text and "n" not in text:
+            negative = text.startswith("-")
+            int_part, _, frac_part = text.lstrip("-").partition(".")
+            return negative, int_part.lstrip("0"), frac_part
+
+    d = value if isinstance(value, Decimal) else Decimal(str(value))
+    if d.is_infinite():
+        raise ValueError(f"Cannot encode {value} as numeric")
+    sign, digits, exponent = d.as_tuple()
+    digit_str = "".join(map(str, digits))
+    if exponent > 0:
+        digit_str += "0" * exponent
+        exponent = 0
+    int_len = len(digit_str) + exponent
+    if int_len > 0:
+        return bool(sign), digit_str[:int_len], digit_str[int_len:]
+    return bool(sign), "", "0" * -int_len + digit_str
+
+
+def _encode_numeric(value):
+    """
+    Encode a number in Postgres' binary numeric format: base-10000 digit groups with a
+    weight, sign and display scale.
+    """
+    if isinstance(value, Decimal) and value.is_nan() or isinstance(value, float) and math.isnan(value):
+        return struct.pack(">hhHH", 0, 0, 0xC000, 0)
+
+    negative, int_part, frac_part = _numeric_parts(value)
+    dscale = len(frac_part)
+    frac_groups = -(-dscale // 4)
+    # All digits as one integer with the fraction padded to whole groups, split from the
+    # right; leading zero groups never appear and the weight counts the integer groups
+    digits = int(int_part + frac_part + "0" * (frac_groups * 4 - dscale) or "0")
+    groups = []
+    while digits:
+        digits, group = divmod(digits, 10000)
+        groups.append(group)
+    groups.reverse()
+    weight = len(groups) - frac_groups - 1
+    while groups and groups[-1] == 0:
+        groups.pop()
+    if not groups:
+        weight = 0
+
+    header = struct.pack(">hhHH", len(groups), weight, 0x4000 if negative and groups else 0, dscale)
+    return header + struct.pack(f">{len(groups)}H", *groups)
+
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _to_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return datetime.fromisoformat(str(value))
+
+
+def _encode_date(value):
+    return struct.pack(">i", (_to_date(value) - PG_EPOCH_DATE).days)
+
+
+def _microseconds(delta):
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def _encode_timestamp(value):
+    value = _to_datetime(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return struct.pack(">q", _microseconds(value - PG_EPOCH_DATETIME))
+
+
+def _encode_timestamptz(value):
+    value = _to_datetime(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return struct.pack(">q", _microseconds(value - PG_EPOCH_DATETIME_UTC))
+
+
+def _encode_json(value):
+    return (value if isinstance(value, str) else json.dumps(value)).encode("utf-8")
+
+
+BINARY_ENCODERS = {
+    "bool": _encode_bool,
+    "int2": lambda v: struct.pack(">h", _to_int(v)),
+    "int4": lambda v: struct.pack(">i", _to_int(v)),
+    "int8": lambda v: struct.pack(">q", _to_int(v)),
+    "float4": lambda v: struct.pack(">f", float(v)),
+    "float8": lambda v: struct.pack(">d", float(v)),
+    "numeric": _encode_numeric,
+    "text": _encode_text,
+    "varchar": _encode_text,
+    "bpchar": _encode_text,
+    "name": _encode_text,
+    "date": _encode_date,
+    "timestamp": _encode_timestamp,
+    "timestamptz": _encode_timestamptz,
+    "json": _encode_json,
+    "jsonb": lambda v: b"\x01" + _encode_json(v),
+}
+
+
+# Element type OIDs of the supported one-dimensional arrays, keyed by array type name;
+# binary array input checks that the OID matches the column's element type
+ARRAY_ELEMENT_OIDS = {
+    "_bool": 16,
+    "_int2": 21,
+    "_int4": 23,
+    "_int8": 20,
+    "_float4": 700,
+    "_float8": 701,
+    "_numeric": 1700,
+    "_text": 25,
+    "_varchar": 1043,
+}
+
+
+def _array_encoder(typname):
+    """
+    Encoder for a one-dimensional array column: the Python list is sent element by element
+    in binary, so values with quotes, commas or braces need no escaping.
+    """
+    element_oid = ARRAY_ELEMENT_OIDS[typname]
+    encode_element = BINARY_ENCODERS[typname[1:]]
+    null = _pack_int4(-1)
+    empty = struct.pack(">iiI", 0, 0, element_oid)
+
+    def encode(values):
+        if isinstance(values, (str, bytes)):
+            raise ValueError(f"Expected a list for {typname[1:]}[] column, got {type(values).__name__}")
+        if not values:
+            return empty
+        elements = [None if value is None else encode_element(value) for value in values]
+        has_null = None in elements
+        parts = [struct.pack(">iiIii", 1, has_null, element_oid, len(elements), 1)]
+        for data in elements:
+            if data is None:
+                parts.append(null)
+            else:
+                parts.append(_pack_int4(len(data)))
+                parts.append(data)
+        return b"".join(parts)
+
+    return encode
+
+
+def _binary_encoder(typname):
+    encoder = BINARY_ENCODERS.get(typname)
+    if encoder is None and typname in ARRAY_ELEMENT_OIDS:
+        encoder = _array_encoder(typname)
+    if encoder is None:
+        raise ValueError(f"Binary COPY does not support column type {typname}; use copy_format='csv'")
+    return encoder
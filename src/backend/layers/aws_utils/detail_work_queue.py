@@ -0,0 +1,184 @@
+import os
+from aws_utils import logger, execute_query
+
+# Work queue settings
+DETAIL_QUEUE_TABLE = "real_estate.property_detail_queue"
+# How long a claimed id stays invisible to other producer runs; long enough for the SQS
+# message to be consumed, retried and land in the DLQ
+DETAIL_QUEUE_LEASE_SECONDS = int(os.getenv("DETAIL_QUEUE_LEASE_SECONDS", "1800"))
+# Ids whose details keep failing are left in the queue but no longer claimed
+DETAIL_QUEUE_MAX_ATTEMPTS = int(os.getenv("DETAIL_QUEUE_MAX_ATTEMPTS", "5"))
+DETAIL_QUEUE_PAGE_SIZE = int(os.getenv("DETAIL_QUEUE_PAGE_SIZE", "500"))
+
+
+def ensure_detail_queue_table(session):
+    """
+    Create real_estate.property_detail_queue if it does not exist yet.
+
+    Rows are claimed newest listing first, then shared listings first, in
+    (first_seen, shared, id) descending order; the index serves both the ordering and
+    the keyset predicate. refresh marks listings that already have details and were
+    scheduled for a re-fetch.
+    """
+    execute_query(session, f"""
+        CREATE TABLE IF NOT EXISTS {DETAIL_QUEUE_TABLE} (
+            id VARCHAR(100) PRIMARY KEY,
+            first_seen DATE NOT NULL,
+            shared BOOLEAN NOT NULL DEFAULT false,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            lease_expires_at TIMESTAMPTZ,
+            enqueued_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            refresh BOOLEAN NOT NULL DEFAULT false
+        )
+    """)
+    # Queues created before refreshes were scheduled
+    execute_query(session, f"ALTER TABLE {DETAIL_QUEUE_TABLE} ADD COLUMN IF NOT EXISTS refresh BOOLEAN NOT NULL DEFAULT false")
+    execute_query(session, f"""
+        CREATE INDEX IF NOT EXISTS property_detail_queue_priority_idx
+        ON {DETAIL_QUEUE_TABLE} (first_seen DESC, shared DESC, id DESC)
+    """)
+
+
+def refresh_detail_queue(session, shared_ids=()):
+    """
+    Sync the queue with the latest snapshot: enqueue listings that are still missing
+    details, flag the ones users have shared, and drop ids that got their details or
+    left the snapshot. Scheduled refreshes stay while their listing is in the snapshot.
+
+    Args:
+        session: A SQLAlchemy session object
+        shared_ids: Listing ids that appear in user shares
+
+    Returns:
+        dict: Counts of "enqueued" (new) and "removed" ids
+    """
+    enqueued = execute_query(session, f"""
+        WITH missing AS (
+            SELECT fct_id AS id
+            FROM real_estate.latest_property_details_view
+            WHERE id IS NULL
+        )
+        INSERT INTO {DETAIL_QUEUE_TABLE} (id, first_seen, shared)
+        SELECT f.id, MIN(f.date), f.id = ANY(CAST(:shared_ids AS VARCHAR[]))
+        FROM real_estate.fct_properties f
+        JOIN missing m ON m.id = f.id
+        GROUP BY f.id
+        ON CONFLICT (id) DO UPDATE SET shared = EXCLUDED.shared
+        WHERE {DETAIL_QUEUE_TABLE}.shared IS DISTINCT FROM EXCLUDED.shared
+        RETURNING (xmax = 0) AS inserted
+    """, {"shared_ids": list(shared_ids)}).fetchall()
+
+    removed = execute_query(session, f"""
+        DELETE FROM {DETAIL_QUEUE_TABLE} q
+        WHERE NOT EXISTS (
+            SELECT 1 FROM real_estate.latest_property_details_view v
+            WHERE v.fct_id = q.id AND (v.id IS NULL OR q.refresh)
+        )
+    """).rowcount
+
+    counts = {"enqueued": sum(1 for row in enqueued if row[0]), "removed": removed}
+    logger.info(f"Detail queue refreshed: {counts['enqueued']} enqueued, {counts['removed']} removed")
+    return counts
+
+
+def claim_detail_page(session, limit, cursor=None,
+                      lease_seconds=DETAIL_QUEUE_LEASE_SECONDS, max_attempts=DETAIL_QUEUE_MAX_ATTEMPTS):
+    """
+    Lease up to limit unleased ids in priority order, starting after cursor.
+
+    Rows locked by a concurrent claim are skipped rather than waited on, and leased rows
+    stay invisible until their lease expires, so overlapping producer runs never hand out
+    the same id twice.
+
+    Args:
+        session: A SQLAlchemy session object
+        limit: Maximum number of ids to claim
+        cursor: (first_seen, shared, id) of the last row of the previous page, or None
+        lease_seconds: How long the claimed ids stay leased
+        max_attempts: Ids claimed this many times are skipped
+
+    Returns:
+        tuple: (list of claimed ids in priority order, cursor for the next page or None)
+    """
+    params = {"max_attempts": max_attempts, "limit": limit, "lease_seconds": lease_seconds}
+    keyset = ""
+    if cursor:
+        keyset = "AND (first_seen, shared, id) < (:first_seen, :shared, :id)"
+        params.update(zip(("first_seen", "shared", "id"), cursor))
+    rows = execute_query(session, f"""
+        WITH picked AS (
+            SELECT id
+            FROM {DETAIL_QUEUE_TABLE}
+            WHERE (lease_expires_at IS NULL OR lease_expires_at < now())
+              AND attempts < :max_attempts
+              {keyset}
+            ORDER BY first_seen DESC, shared DESC, id DESC
+            LIMIT :limit
+            FOR UPDATE SKIP LOCKED
+        ), claimed AS (
+            UPDATE {DETAIL_QUEUE_TABLE} q
+            SET lease_expires_at = now() + make_interval(secs => :lease_seconds),
+                attempts = q.attempts + 1
+            FROM picked
+            WHERE q.id = picked.id
+            RETURNING q.first_seen, q.shared, q.id
+        )
+        SELECT first_seen, shared, id
+        FROM claimed
+        ORDER BY first_seen DESC, shared DESC, id DESC
+    """, params).fetchall()
+
+    next_cursor = tuple(rows[-1]) if len(rows) == limit else None
+    return [row[2] for row in rows], next_cursor
+
+
+def claim_detail_ids(session, max_ids, page_size=DETAIL_QUEUE_PAGE_SIZE):
+    """
+    Lease up to max_ids ids in priority order, one keyset page per transaction so locks
+    are held briefly and later pages never rescan the rows already leased.
+
+    Returns:
+        list: Claimed listing ids, highest priority first
+    """
+    claimed = []
+    cursor = None
+    while len(claimed) < max_ids:
+        ids, cursor = claim_detail_page(session, min(page_size, max_ids - len(claimed)), cursor)
+        session.commit()
+        claimed.extend(ids)
+        if cursor is None:
+            break
+    logger.info(f"Claimed {len(claimed)} ids from the detail queue")
+    return claimed
+
+
+def complete_detail_ids(session, ids):
+    """
+    Remove ids whose details were stored. The caller commits, normally in the same
+    transaction as the details upsert.
+
+    Returns:
+        int: Number of queue rows removed
+    """
+    if not ids:
+        return 0
+    return execute_query(session, f"DELETE FROM {DETAIL_QUEUE_TABLE} WHERE id = ANY(CAST(:ids AS VARCHAR[]))",
+                         {"ids": list(ids)}).rowcount
+
+
+def park_empty_detail_ids(session, ids, max_attempts=DETAIL_QUEUE_MAX_ATTEMPTS):
+    """
+    Stop claiming ids whose details came back empty: they are left in the queue with their
+    attempts used up, so they are neither re-fetched nor re-enqueued as missing. The
+    caller commits.
+
+    Returns:
+        int: Number of queue rows parked
+    """
+    if not ids:
+        return 0
+    return execute_query(session, f"""
+        UPDATE {DETAIL_QUEUE_TABLE}
+        SET attempts = GREATEST(attempts, :max_attempts), lease_expires_at = NULL
+        WHERE id = ANY(CAST(:ids AS VARCHAR[]))
+    """, {"ids": list(ids), "max_attempts": max_attempts}).rowcount
@@ -0,0 +1,154 @@
+"""
+Content hashes for change detection on dim_property_details.
+
+Each stored listing has one 64-bit hash per column group in
+real_estate.dim_property_details_hashes. Before a chunk is written, the incoming rows are
+hashed and compared with the stored hashes:
+
+    unchanged   every group matches: the row is not rewritten, only checked_at moves
+    partial     some groups changed: only those groups' columns are staged and updated,
+                so an unchanged description or image list is not copied into a new row
+                version (and its TOAST data is left alone)
+    full        no stored hash (new listing, or the hash row is missing): every column
+
+checked_at records when the details were last fetched, changed_at when they last
+differed; a scheduled re-fetch can order by either.
+"""
+
+import hashlib
+import os
+import msgspec
+from aws_utils import execute_query
+
+DETAILS_CHANGE_DETECTION_ENABLED = os.getenv("DETAILS_CHANGE_DETECTION", "true").lower() == "true"
+DETAILS_HASH_TABLE = "real_estate.dim_property_details_hashes"
+
+# Column groups of dim_property_details (besides id) that are hashed and updated together
+DETAIL_COLUMN_GROUPS = {
+    "core": [
+        'status', 'listed_at', 'closed_at', 'days_on_market', 'available_from', 'address', 'price',
+        'borough', 'neighborhood', 'zipcode', 'property_type', 'sqft', 'bedrooms', 'bathrooms', 'type',
+        'latitude', 'longitude', 'amenities', 'built_in', 'building_id', 'agents', 'no_fee',
+    ],
+    "description": ['description'],
+    "media": ['thumbnail_image', 'images', 'videos', 'floorplans'],
+}
+HASH_COLUMNS = {group: f"{group}_hash" for group in DETAIL_COLUMN_GROUPS}
+
+_encoder = msgspec.json.Encoder()
+
+
+def ensure_details_hash_table(session):
+    """
+    Create real_estate.dim_property_details_hashes if it does not exist yet.
+    """
+    execute_query(session, f"""
+        CREATE TABLE IF NOT EXISTS {DETAILS_HASH_TABLE} (
+            id VARCHAR(20) PRIMARY KEY,
+            core_hash BIGINT NOT NULL,
+            description_hash BIGINT NOT NULL,
+            media_hash BIGINT NOT NULL,
+            checked_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+
+
+def group_hashes(row, columns):
+    """
+    Hash each column group of a row.
+
+    Args:
+        row: Values in columns order
+        columns: The column names of row
+
+    Returns:
+        dict: group -> signed 64-bit hash
+    """
+    values = dict(zip(columns, row))
+    hashes = {}
+    for group, group_columns in DETAIL_COLUMN_GROUPS.items():
+        payload = _encoder.encode([values.get(column) for column in group_columns])
+        hashes[group] = int.from_bytes(hashlib.blake2b(payload, digest_size=8).digest(), "big", signed=True)
+    return hashes
+
+
+def load_details_hashes(session, ids):
+    """
+    Get the stored hashes of listings that still have a dim_property_details row.
+
+    Returns:
+        dict: id -> {group: hash}
+    """
+    if not ids:
+        return {}
+    hash_columns = ", ".join(f"h.{column}" for column in HASH_COLUMNS.values())
+    rows = execute_query(session, f"""
+        SELECT h.id, {hash_columns}
+        FROM {DETAILS_HASH_TABLE} h
+        JOIN real_estate.dim_property_details d ON d.id = h.id
+        WHERE h.id = ANY(CAST(:ids AS VARCHAR[]))
+    """, {"ids": list(ids)}).fetchall()
+    return {row[0]: dict(zip(HASH_COLUMNS, row[1:])) for row in rows}
+
+
+def plan_detail_writes(rows, columns, stored):
+    """
+    Split rows by what has to be written.
+
+    Args:
+        rows: Row tuples in columns order, id first
+        columns: The column names
+        stored: Stored hashes from load_details_hashes
+
+    Returns:
+        tuple: (full rows, {tuple of changed groups: rows}, unchanged ids, {id: group hashes})
+    """
+    full = []
+    partial = {}
+    unchanged = []
+    hashes = {}
+    for row in rows:
+        row_id = row[0]
+        new = group_hashes(row, columns)
+        old = stored.get(row_id)
+        if old is None:
+            full.append(row)
+            hashes[row_id] = new
+            continue
+        changed = tuple(group for group in DETAIL_COLUMN_GROUPS if new[group] != old[group])
+        if changed:
+            partial.setdefault(changed, []).append(row)
+        else:
+            unchanged.append(row_id)
+        hashes[row_id] = new
+    return full, partial, unchanged, hashes
+
+
+def save_details_hashes(session, hashes):
+    """
+    Upsert the hashes of a written chunk in one statement; changed_at only moves for rows
+    that differed. The caller commits.
+
+    Args:
+        hashes: id -> group hashes from plan_detail_writes
+    """
+    if not hashes:
+        return
+    hash_columns = list(HASH_COLUMNS.values())
+    params = {"ids": list(hashes)}
+    for group, column in HASH_COLUMNS.items():
+        params[column] = [group_hashes[group] for group_hashes in hashes.values()]
+    execute_query(session, f"""
+        INSERT INTO {DETAILS_HASH_TABLE} AS h (id, {", ".join(hash_columns)}, checked_at, changed_at)
+        SELECT id, {", ".join(hash_columns)}, now(), now()
+        FROM unnest(CAST(:ids AS VARCHAR[]), {", ".join(f"CAST(:{column} AS BIGINT[])" for column in hash_columns)})
+            AS t(id, {", ".join(hash_columns)})
+        ON CONFLICT (id) DO UPDATE
+        SET {", ".join(f"{column} = EXCLUDED.{column}" for column in hash_columns)},
+            checked_at = now(),
+            changed_at = CASE WHEN EXCLUDED.core_hash <> h.core_hash
+                                OR EXCLUDED.description_hash <> h.description_hash
+                                OR EXCLUDED.media_hash <> h.media_hash
+                              THEN now() ELSE h.changed_at END
+    """, params)
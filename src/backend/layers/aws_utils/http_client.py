@@ -0,0 +1,406 @@
+import asyncio
+import bisect
+import json
+import os
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from aws_utils import logger, register_metrics_provider
+
+# HTTP client settings
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "3.05"))
+HTTP_READ_TIMEOUT_SECONDS = float(os.getenv("HTTP_READ_TIMEOUT_SECONDS", "30"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_BASE_SECONDS = float(os.getenv("HTTP_BACKOFF_BASE_SECONDS", "0.5"))
+HTTP_BACKOFF_MAX_SECONDS = float(os.getenv("HTTP_BACKOFF_MAX_SECONDS", "20"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "20"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() == "true"
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+LATENCY_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+_NUMERIC_SEGMENT = re.compile(r"^\d+$")
+
+
+def endpoint_key(method, url):
+    """
+    Group a request by method, host and path, with numeric path segments replaced by {id}
+    so that e.g. every listing detail fetch lands in the same histogram.
+    """
+    parts = urlsplit(url)
+    path = "/".join("{id}" if _NUMERIC_SEGMENT.match(segment) else segment for segment in parts.path.split("/"))
+    return f"{method.upper()} {parts.netloc}{path}"
+
+
+def retry_delay(attempt, retry_after=None, base=HTTP_BACKOFF_BASE_SECONDS, cap=HTTP_BACKOFF_MAX_SECONDS):
+    """
+    Seconds to wait before retry number attempt (1-based): full-jitter exponential backoff,
+    or the server's Retry-After when it asks for longer.
+    """
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, cap))
+    return delay
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header given either as seconds or as an HTTP date.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HttpStats:
+    """
+    Per-endpoint latency histograms, status counts and retry counts.
+    """
+
+    def __init__(self, buckets_ms=LATENCY_BUCKETS_MS):
+        self.buckets_ms = tuple(buckets_ms)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+    def record(self, key, seconds, status=None, retries=0, error=None):
+        elapsed_ms = seconds * 1000
+        with self._lock:
+            entry = self._endpoints.get(key)
+            if entry is None:
+                entry = self._endpoints[key] = {
+                    "calls": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "retries": 0,
+                    "errors": 0,
+                    "statuses": {},
+                    "histogram": [0] * (len(self.buckets_ms) + 1),
+                }
+            entry["calls"] += 1
+            entry["total_ms"] += elapsed_ms
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+            entry["retries"] += retries
+            entry["histogram"][bisect.bisect_left(self.buckets_ms, elapsed_ms)] += 1
+            if status is not None:
+                entry["statuses"][str(status)] = entry["statuses"].get(str(status), 0) + 1
+            if error is not None:
+                entry["errors"] += 1
+
+    def _percentile(self, histogram, calls, q):
+        # Upper bound of the bucket holding the q-th call; the overflow bucket reports the max
+        threshold = q * calls
+        seen = 0
+        for i, count in enumerate(histogram):
+            seen += count
+            if seen >= threshold and count:
+                return self.buckets_ms[i] if i < len(self.buckets_ms) else None
+        return None
+
+    def summary(self):
+        with self._lock:
+            endpoints = {}
+            for key, entry in self._endpoints.items():
+                calls = entry["calls"]
+                endpoints[key] = {
+                    "calls": calls,
+                    "avg_ms": round(entry["total_ms"] / calls, 2) if calls else 0.0,
+                    "max_ms": round(entry["max_ms"], 2),
+                    "p50_ms": self._percentile(entry["histogram"], calls, 0.5) or round(entry["max_ms"], 2),
+                    "p99_ms": self._percentile(entry["histogram"], calls, 0.99) or round(entry["max_ms"], 2),
+                    "retries": entry["retries"],
+                    "errors": entry["errors"],
+                    "statuses": dict(entry["statuses"]),
+                    "histogram": {
+                        f"le_{bound}" if bound is not None else "inf": count
+                        for bound, count in zip(self.buckets_ms + (None,), entry["histogram"])
+                        if count
+                    },
+                }
+            return endpoints
+
+
+_http_stats = HttpStats()
+
+
+class HttpResponse:
+    """
+    Fully read response returned by AsyncHttpClient, mirroring the parts of
+    requests.Response the pipeline uses.
+    """
+
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error for url: {urlsplit(self.url).path}", response=self)
+
+
+class HttpClient:
+    """
+    Shared synchronous HTTP client: one keep-alive connection pool per host, default
+    timeouts, and jittered retries on connection errors and retryable status codes that
+    honor Retry-After. Latency is recorded per endpoint in the invocation summary.
+
+    With http2=True the client uses httpx when it is installed and falls back to requests
+    (HTTP/1.1 keep-alive) otherwise.
+    """
+
+    def __init__(self, connect_timeout=HTTP_CONNECT_TIMEOUT_SECONDS, read_timeout=HTTP_READ_TIMEOUT_SECONDS,
+                 max_retries=HTTP_MAX_RETRIES, pool_maxsize=HTTP_POOL_MAXSIZE, http2=HTTP2_ENABLED,
+                 stats=_http_stats):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.stats = stats
+        self.http2 = False
+        self._session = None
+        if http2:
+            try:
+                import httpx
+                self._session = httpx.Client(
+                    http2=True,
+                    timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                    limits=httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize),
+                )
+                self.http2 = True
+            except ImportError:
+                logger.warning("HTTP/2 requested but httpx[http2] is not installed; using HTTP/1.1")
+        if self._session is None:
+            self._session = requests.Session()
+            # Retries are handled in request() so they can be jittered, logged and counted
+            adapter = HTTPAdapter(pool_connections=10, pool_maxsize=pool_maxsize, max_retries=0)
+            self._session.mount("https://", adapter)
+            self._session.mount("http://", adapter)
+
+    def request(self, method, url, max_retries=None, rate_limiter=None, **kwargs):
+        """
+        Send a request, retrying connection errors, timeouts and retryable statuses.
+
+        Args:
+            method: HTTP method
+            url: Request URL
+            max_retries: Override the client's retry count for this call
+            rate_limiter: Optional rate_limiter.RateLimiter, acquired before every attempt
+            **kwargs: Passed to the underlying session (params, headers, json, ...)
+
+        Returns:
+            The final response; callers still decide whether to raise_for_status()
+        """
+        method = method.upper()
+        retries_allowed = self.max_retries if max_retries is None else max_retries
+        if method not in IDEMPOTENT_METHODS:
+            retries_allowed = 0
+        if not self.http2:
+            # httpx clients carry their timeouts; requests needs them on every call
+            kwargs.setdefault("timeout", self.timeout)
+        key = endpoint_key(method, url)
+
+        attempt = 0
+        start = time.perf_counter()
+        while True:
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            try:
+                response = self._session.request(method, url, **kwargs)
+            except Exception as e:
+                if attempt >= retries_allowed or not _is_retryable_error(e):
+                    self.stats.record(key, time.perf_counter() - start, retries=attempt, error=e)
+                    raise
+                attempt += 1
+                delay = retry_delay(attempt)
+                logger.warning(f"{key} failed ({e}), retrying in {delay:.2f}s (attempt {attempt}/{retries_allowed})")
+                time.sleep(delay)
+                continue
+
+            if response.status_code in RETRY_STATUSES and attempt < retries_allowed:
+                attempt += 1
+                delay = retry_delay(attempt, parse_retry_after(response.headers.get("Retry-After")))
+                logger.warning(
+                    f"{key} returned {response.status_code}, retrying in {delay:.2f}s "
+                    f"(attempt {attempt}/{retries_allowed})"
+                )
+                response.close()
+                time.sleep(delay)
+                continue
+
+            self.stats.record(key, time.perf_counter() - start, status=response.status_code, retries=attempt)
+            return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        self._session.close()
+
+
+class AsyncHttpClient:
+    """
+    aiohttp counterpart of HttpClient with the same timeouts, retry policy and stats.
+    The aiohttp session is bound to the event loop it is first used on.
+    """
+
+    def __init__(self, connect_timeout=HTTP_CONNECT_TIMEOUT_SECONDS, read_timeout=HTTP_READ_TIMEOUT_SECONDS,
+                 max_retries=HTTP_MAX_RETRIES, pool_maxsize=HTTP_POOL_MAXSIZE, stats=_http_stats):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.pool_maxsize = pool_maxsize
+        self.stats = stats
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            import aiohttp
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_maxsize, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout),
+            )
+        return self._session
+
+    async def request(self, method, url, max_retries=None, rate_limiter=None, **kwargs):
+        """
+        Send a request and read the whole body, retrying like HttpClient.request.
+
+        Returns:
+            HttpResponse
+        """
+        method = method.upper()
+        retries_allowed = self.max_retries if max_retries is None else max_retries
+        if method not in IDEMPOTENT_METHODS:
+            retries_allowed = 0
+        session = self._get_session()
+        key = endpoint_key(method, url)
+
+        attempt = 0
+        start = time.perf_counter()
+        while True:
+            if rate_limiter is not None:
+                await rate_limiter.acquire_async()
+            try:
+                async with session.request(method, url, **kwargs) as response:
+                    content = await response.read()
+                    result = HttpResponse(str(response.url), response.status, response.headers, content)
+            except Exception as e:
+                if attempt >= retries_allowed or not _is_retryable_error(e):
+                    self.stats.record(key, time.perf_counter() - start, retries=attempt, error=e)
+                    raise
+                attempt += 1
+                delay = retry_delay(attempt)
+                logger.warning(f"{key} failed ({e!r}), retrying in {delay:.2f}s (attempt {attempt}/{retries_allowed})")
+                await asyncio.sleep(delay)
+                continue
+
+            if result.status_code in RETRY_STATUSES and attempt < retries_allowed:
+                attempt += 1
+                delay = retry_delay(attempt, parse_retry_after(result.headers.get("Retry-After")))
+                logger.warning(
+                    f"{key} returned {result.status_code}, retrying in {delay:.2f}s "
+                    f"(attempt {attempt}/{retries_allowed})"
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            self.stats.record(key, time.perf_counter() - start, status=result.status_code, retries=attempt)
+            return result
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+def _is_retryable_error(error):
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, asyncio.TimeoutError, ConnectionError)):
+        return True
+    # aiohttp and httpx are imported lazily, so match their transport errors by name
+    return type(error).__name__ in {
+        "ClientConnectionError", "ClientConnectorError", "ServerDisconnectedError", "ClientOSError",
+        "ServerTimeoutError", "ClientPayloadError", "ConnectError", "ReadTimeout", "ConnectTimeout",
+        "RemoteProtocolError", "ReadError",
+    }
+
+
+_http_client = None
+_http_client_lock = threading.Lock()
+# aiohttp sessions are bound to the loop that created them, so clients are cached per loop
+_async_http_clients = {}
+
+
+def get_http_client():
+    """
+    Get the container-wide HttpClient, creating it on first use so connections stay warm
+    across invocations.
+    """
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                _http_client = HttpClient()
+    return _http_client
+
+
+def get_async_http_client():
+    """
+    Get the AsyncHttpClient for the running event loop.
+    """
+    loop_id = id(asyncio.get_running_loop())
+    client = _async_http_clients.get(loop_id)
+    if client is None:
+        # Clients left behind by earlier, already closed loops cannot be reused
+        _async_http_clients.clear()
+        client = _async_http_clients[loop_id] = AsyncHttpClient()
+    return client
+
+
+async def close_async_http_clients():
+    """
+    Close the AsyncHttpClient of the running event loop. Call before asyncio.run() returns.
+    """
+    client = _async_http_clients.pop(id(asyncio.get_running_loop()), None)
+    if client is not None:
+        await client.close()
+
+
+def get_http_stats():
+    """
+    Get per-endpoint HTTP latency histograms, statuses and retries for the current invocation.
+    """
+    return _http_stats.summary()
+
+
+register_metrics_provider("http", get_http_stats, reset=_http_stats.reset)
@@ -0,0 +1,223 @@
+import math
+from typing import Any, Optional
+import msgspec
+
+# Typed records for RapidAPI responses. Only the fields the consumers persist are
+# declared; msgspec decodes them straight from the response bytes and skips everything
+# else (descriptions of unrelated objects, agent profiles, ...) without building dicts
+# for it. Records hold no references to other objects, so they are kept out of the
+# cyclic GC (gc=False).
+#
+# The API is loose about types (numbers as strings, nulls inside lists, a scalar where a
+# list is expected), and one strictly typed field would fail the whole page or response.
+# Stored fields are therefore declared as Any and normalized in __post_init__: values
+# that cannot be read as the column's type become None rather than errors.
+
+
+def as_str(value):
+    """A string, numbers as their text; anything else None."""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return None
+
+
+def as_number(value):
+    """An int or float, parsing numeric strings; anything else (or NaN/inf) None."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, str):
+        text = value.strip().replace(",", "")
+        try:
+            return int(text)
+        except ValueError:
+            pass
+        try:
+            number = float(text)
+        except ValueError:
+            return None
+        return number if math.isfinite(number) else None
+    return None
+
+
+def as_int(value):
+    """as_number rounded to an int, for INTEGER columns."""
+    number = as_number(value)
+    return number if number is None or isinstance(number, int) else round(number)
+
+
+def as_bool(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    return None
+
+
+def as_str_list(value):
+    """A list of strings, dropping nulls and other non-scalar items; a lone string is a one-item list."""
+    if isinstance(value, str):
+        return [value]
+    if not isinstance(value, list):
+        return None
+    return [item for item in map(as_str, value) if item is not None]
+
+
+class SearchListing(msgspec.Struct, gc=False):
+    """One listing of a search page, with the fct_properties columns."""
+    id: Any = None
+    price: Any = None
+    longitude: Any = None
+    latitude: Any = None
+    url: Any = None
+
+    def __post_init__(self):
+        if self.id is not None and self.id.__class__ is not str:
+            self.id = as_str(self.id)
+        for field in ("price", "longitude", "latitude"):
+            value = getattr(self, field)
+            if value is not None and value.__class__ is not int and value.__class__ is not float:
+                setattr(self, field, as_number(value))
+        if self.url is not None and self.url.__class__ is not str:
+            self.url = as_str(self.url)
+
+
+class Pagination(msgspec.Struct, rename="camel", gc=False):
+    total: Any = None
+    next_offset: Any = None
+
+    def __post_init__(self):
+        self.total = as_int(self.total)
+        self.next_offset = as_int(self.next_offset)
+
+
+class SearchPage(msgspec.Struct, gc=False):
+    listings: Optional[list[Optional[SearchListing]]] = []
+    pagination: Optional[Pagination] = None
+
+    def __post_init__(self):
+        self.listings = [listing for listing in self.listings or [] if listing is not None]
+        if self.pagination is None:
+            self.pagination = Pagination()
+
+
+class Building(msgspec.Struct, gc=False):
+    id: Any = None
+
+    def __post_init__(self):
+        self.id = as_str(self.id)
+
+
+class PropertyDetails(msgspec.Struct, rename="camel", gc=False):
+    """A listing details response, with the dim_property_details columns."""
+    id: Any = None
+    status: Any = None
+    listed_at: Any = None
+    closed_at: Any = None
+    days_on_market: Any = None
+    available_from: Any = None
+    address: Any = None
+    price: Any = None
+    borough: Any = None
+    neighborhood: Any = None
+    zipcode: Any = None
+    property_type: Any = None
+    sqft: Any = None
+    bedrooms: Any = None
+    bathrooms: Any = None
+    type: Any = None
+    latitude: Any = None
+    longitude: Any = None
+    amenities: Any = None
+    built_in: Any = None
+    building: Any = None
+    agents: Any = None
+    no_fee: Any = None
+    description: Any = None
+    images: Any = None
+    videos: Any = None
+    floorplans: Any = None
+
+    def __post_init__(self):
+        # Fast path: values that already have the column's type are left alone, so a
+        # well-formed response costs one type check per field
+        if self.id is not None and self.id.__class__ is not str:
+            self.id = as_str(self.id)
+        for field in _DETAIL_TEXT_FIELDS:
+            value = getattr(self, field)
+            if value is not None and value.__class__ is not str:
+                setattr(self, field, as_str(value))
+        for field in _DETAIL_INT_FIELDS:
+            value = getattr(self, field)
+            if value is not None and value.__class__ is not int:
+                setattr(self, field, as_int(value))
+        for field in _DETAIL_NUMBER_FIELDS:
+            value = getattr(self, field)
+            if value is not None and value.__class__ is not int and value.__class__ is not float:
+                setattr(self, field, as_number(value))
+        for field in _DETAIL_LIST_FIELDS:
+            value = getattr(self, field)
+            if value is not None and not _is_str_list(value):
+                setattr(self, field, as_str_list(value))
+        if self.no_fee is not None and self.no_fee.__class__ is not bool:
+            self.no_fee = as_bool(self.no_fee)
+        building = self.building
+        if building is not None:
+            self.building = Building(id=building.get("id")) if building.__class__ is dict else None
+
+
+_DETAIL_TEXT_FIELDS = ("status", "listed_at", "closed_at", "available_from", "address", "borough",
+                       "neighborhood", "zipcode", "property_type", "type", "description")
+_DETAIL_INT_FIELDS = ("days_on_market", "sqft", "bedrooms", "built_in")
+_DETAIL_NUMBER_FIELDS = ("price", "bathrooms", "latitude", "longitude")
+_DETAIL_LIST_FIELDS = ("amenities", "agents", "images", "videos", "floorplans")
+
+
+def _is_str_list(value):
+    if value.__class__ is not list:
+        return False
+    for item in value:
+        if item.__class__ is not str:
+            return False
+    return True
+
+
+# Stored fields are normalized by the records; strict=False keeps the containers loose too
+_search_page_decoder = msgspec.json.Decoder(SearchPage, strict=False)
+_property_details_decoder = msgspec.json.Decoder(Optional[PropertyDetails], strict=False)
+
+
+def decode_search_page(content):
+    """
+    Decode a search response body.
+
+    Args:
+        content: Response body bytes
+
+    Returns:
+        SearchPage: The listings and pagination of the page
+
+    Raises:
+        msgspec.DecodeError: If the body is not JSON or not a search page object
+    """
+    return _search_page_decoder.decode(content)
+
+
+def decode_property_details(content):
+    """
+    Decode a listing details response body.
+
+    Returns:
+        PropertyDetails or None: None for an empty response (null, {} or no id)
+    """
+    if not content or not content.strip():
+        return None
+    details = _property_details_decoder.decode(content)
+    if details is None or details.id is None:
+        return None
+    return details
@@ -0,0 +1,436 @@
+import asyncio
+import collections
+import fcntl
+import json
+import os
+import threading
+import time
+from aws_utils import logger, get_sqlalchemy_engine, register_metrics_provider, remaining_invocation_seconds
+
+# Rate limiter settings
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "postgres").lower()
+RATE_LIMIT_FILE_PATH = os.getenv("RATE_LIMIT_FILE_PATH", "/tmp/coapt_rate_limits.json")
+RATE_LIMIT_RESERVE_BATCH = int(os.getenv("RATE_LIMIT_RESERVE_BATCH", "1"))
+RATE_LIMIT_TABLE = "real_estate.api_rate_limits"
+# Seconds of the Lambda's remaining time kept free when capping a wait for a token, so a
+# saturated bucket fails the request instead of sleeping the function into its timeout
+RATE_LIMIT_DEADLINE_MARGIN_SECONDS = float(os.getenv("RATE_LIMIT_DEADLINE_MARGIN_SECONDS", "10"))
+
+# provider -> (sustained requests per second, burst), shared by every Lambda instance.
+# Override with RATE_LIMIT_<PROVIDER>_PER_SECOND / RATE_LIMIT_<PROVIDER>_BURST.
+DEFAULT_PROVIDER_LIMITS = {
+    "rapidapi": (5.0, 10.0),
+    "mapbox": (8.0, 8.0),
+}
+
+
+class RateLimitTimeout(Exception):
+    """Raised when a token would not be available within the caller's max_wait."""
+
+
+def provider_limits(provider):
+    """
+    Get (rate per second, burst) for a provider from the environment or the defaults.
+    """
+    rate, burst = DEFAULT_PROVIDER_LIMITS.get(provider, (1.0, 1.0))
+    prefix = f"RATE_LIMIT_{provider.upper()}"
+    rate = float(os.getenv(f"{prefix}_PER_SECOND", rate))
+    burst = float(os.getenv(f"{prefix}_BURST", burst))
+    return rate, max(burst, 1.0)
+
+
+def _reserve(tokens, updated_at, now, rate, burst, requested, max_wait):
+    """
+    Token bucket with reservations: refill for the elapsed time, then take requested tokens
+    even if that leaves the bucket in debt. The caller waits until the debt is repaid, so
+    every request needs exactly one round trip to the shared state.
+
+    Returns:
+        tuple: (new token count, tokens available before the reservation); the token count
+        is unchanged when the reservation would wait longer than max_wait
+    """
+    available = min(burst, tokens + max(0.0, now - updated_at) * rate)
+    if max_wait is not None and requested - available > max_wait * rate:
+        return available, available
+    return available - requested, available
+
+
+class MemoryRateLimitBackend:
+    """
+    Process-local buckets, for tests and as a fallback when the shared backend is down.
+    """
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, provider, rate, burst, requested, max_wait=None):
+        with self._lock:
+            now = time.time()
+            tokens, updated_at = self._buckets.get(provider, (burst, now))
+            new_tokens, available = _reserve(tokens, updated_at, now, rate, burst, requested, max_wait)
+            self._buckets[provider] = (new_tokens, now)
+            return available
+
+
+class FileRateLimitBackend:
+    """
+    Buckets in a JSON file guarded by an exclusive flock, shared by processes on one host.
+    """
+
+    def __init__(self, path=RATE_LIMIT_FILE_PATH):
+        self.path = path
+
+    def reserve(self, provider, rate, burst, requested, max_wait=None):
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                raw = f.read()
+                state = json.loads(raw) if raw.strip() else {}
+                now = time.time()
+                tokens, updated_at = state.get(provider, (burst, now))
+                new_tokens, available = _reserve(tokens, updated_at, now, rate, burst, requested, max_wait)
+                state[provider] = (new_tokens, now)
+                f.seek(0)
+                f.truncate()
+                json.dump(state, f)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return available
+
+
+class PostgresRateLimitBackend:
+    """
+    Buckets stored one row per provider in real_estate.api_rate_limits, so every Lambda
+    instance draws from the same budget. Each reservation is a single UPDATE ... RETURNING
+    whose row lock serializes concurrent callers; the clock is the database's.
+
+    Reservations go over one dedicated connection per container, taken in turn, so
+    concurrent requests neither take a pooled session each nor pile up on the row lock.
+    """
+
+    RESERVE_SQL = f"""
+        WITH bucket AS (
+            SELECT provider,
+                   LEAST(:burst, tokens + GREATEST(0, EXTRACT(EPOCH FROM clock_timestamp() - updated_at)) * :rate) AS available
+            FROM {RATE_LIMIT_TABLE}
+            WHERE provider = :provider
+            FOR UPDATE
+        )
+        UPDATE {RATE_LIMIT_TABLE} AS t
+        SET tokens = CASE
+                WHEN CAST(:max_wait AS double precision) IS NOT NULL
+                     AND :requested - bucket.available > CAST(:max_wait AS double precision) * :rate
+                THEN bucket.available
+                ELSE bucket.available - :requested
+            END,
+            updated_at = clock_timestamp()
+        FROM bucket
+        WHERE t.provider = bucket.provider
+        RETURNING bucket.available
+    """
+
+    def __init__(self, db_name='coapt'):
+        self.db_name = db_name
+        self._known_providers = set()
+        self._engine = None
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _get_connection(self):
+        """
+        Get the limiter's connection, reopening it if it was dropped or the engine manager
+        replaced the engine. Called with the lock held.
+        """
+        engine = get_sqlalchemy_engine(self.db_name)
+        if self._connection is not None and (engine is not self._engine or self._connection.invalidated):
+            self._close_connection()
+        if self._connection is None:
+            self._connection = engine.connect()
+            self._engine = engine
+        return self._connection
+
+    def _close_connection(self):
+        try:
+            self._connection.close()
+        except Exception as e:
+            logger.warning(f"Error closing the rate limiter connection: {e}")
+        self._connection = None
+
+    def reserve(self, provider, rate, burst, requested, max_wait=None):
+        from sqlalchemy import text
+
+        with self._lock:
+            connection = self._get_connection()
+            try:
+                if provider not in self._known_providers:
+                    ensure_rate_limit_table(connection)
+                    connection.execute(
+                        text(f"""
+                            INSERT INTO {RATE_LIMIT_TABLE} (provider, tokens, updated_at)
+                            VALUES (:provider, :burst, clock_timestamp())
+                            ON CONFLICT (provider) DO NOTHING
+                        """),
+                        {"provider": provider, "burst": burst},
+                    )
+                    connection.commit()
+                    self._known_providers.add(provider)
+
+                available = connection.execute(
+                    text(self.RESERVE_SQL),
+                    {"provider": provider, "rate": rate, "burst": burst,
+                     "requested": requested, "max_wait": max_wait},
+                ).scalar_one()
+                connection.commit()
+                return float(available)
+            except Exception:
+                # The next reservation starts over on a fresh connection
+                self._close_connection()
+                raise
+
+
+def ensure_rate_limit_table(session):
+    """
+    Create real_estate.api_rate_limits if it does not exist yet, through a session or a
+    connection.
+    """
+    from sqlalchemy import text
+
+    session.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {RATE_LIMIT_TABLE} (
+            provider VARCHAR(50) PRIMARY KEY,
+            tokens DOUBLE PRECISION NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+        )
+    """))
+
+
+class RateLimitStats:
+    """
+    Per-provider acquire counts, time spent waiting for tokens and backend round trips.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._providers = {}
+
+    def record(self, provider, tokens, waited, backend_seconds=0.0, backend_calls=0, fallback=False, timed_out=False):
+        with self._lock:
+            entry = self._providers.get(provider)
+            if entry is None:
+                entry = self._providers[provider] = {
+                    "acquires": 0,
+                    "tokens": 0,
+                    "waited": 0,
+                    "wait_ms": 0.0,
+                    "max_wait_ms": 0.0,
+                    "backend_calls": 0,
+                    "backend_ms": 0.0,
+                    "fallbacks": 0,
+                    "timeouts": 0,
+                }
+            entry["acquires"] += 0 if timed_out else 1
+            entry["tokens"] += tokens
+            entry["waited"] += 1 if waited > 0 else 0
+            entry["wait_ms"] += waited * 1000
+            entry["max_wait_ms"] = max(entry["max_wait_ms"], waited * 1000)
+            entry["backend_calls"] += backend_calls
+            entry["backend_ms"] += backend_seconds * 1000
+            entry["fallbacks"] += 1 if fallback else 0
+            entry["timeouts"] += 1 if timed_out else 0
+
+    def summary(self):
+        with self._lock:
+            return {
+                provider: dict(entry, wait_ms=round(entry["wait_ms"], 2), max_wait_ms=round(entry["max_wait_ms"], 2),
+                               backend_ms=round(entry["backend_ms"], 2))
+                for provider, entry in self._providers.items()
+            }
+
+
+_rate_limit_stats = RateLimitStats()
+
+
+class RateLimiter:
+    """
+    Token-bucket limiter for one external API provider, shared across Lambda instances
+    through the configured backend.
+
+    Usable as `with limiter:` / `async with limiter:` (one token), or through
+    acquire() / acquire_async() for more tokens or a bounded wait. With reserve_batch > 1,
+    single-token acquires reserve that many tokens per backend round trip and hand them out
+    locally at the bucket's pace.
+
+    Backend round trips run outside the limiter's lock, so concurrent callers each make
+    their own reservation instead of queueing behind one another's. Inside a Lambda
+    handler, waits are capped at the invocation's remaining time (less
+    RATE_LIMIT_DEADLINE_MARGIN_SECONDS) and raise RateLimitTimeout beyond it.
+    """
+
+    def __init__(self, provider, rate=None, burst=None, backend=None, reserve_batch=RATE_LIMIT_RESERVE_BATCH,
+                 stats=_rate_limit_stats):
+        default_rate, default_burst = provider_limits(provider)
+        self.provider = provider
+        self.rate = rate or default_rate
+        self.burst = burst or default_burst
+        self.backend = backend or _backend_from_env()
+        self.reserve_batch = max(1, int(reserve_batch))
+        self.stats = stats
+        self._fallback = None
+        self._local_ready = collections.deque()
+        self._lock = threading.Lock()
+
+    def _reserve(self, requested, max_wait):
+        """
+        Reserve tokens in the backend and return the time.time() at which they are usable.
+        Falls back to a process-local bucket when the shared backend is unavailable.
+        """
+        start = time.perf_counter()
+        fallback = False
+        try:
+            available = self.backend.reserve(self.provider, self.rate, self.burst, requested, max_wait)
+        except Exception as e:
+            logger.warning(f"Rate limit backend unavailable for {self.provider}, using a local bucket: {e}")
+            with self._lock:
+                if self._fallback is None:
+                    self._fallback = MemoryRateLimitBackend()
+            available = self._fallback.reserve(self.provider, self.rate, self.burst, requested, max_wait)
+            fallback = True
+        backend_seconds = time.perf_counter() - start
+        now = time.time()
+        return available, now, backend_seconds, fallback
+
+    def _ready_times(self, tokens, max_wait):
+        available, now, backend_seconds, fallback = self._reserve(tokens, max_wait)
+        if max_wait is not None and tokens - available > max_wait * self.rate:
+            self.stats.record(self.provider, 0, 0.0, backend_seconds, 1, fallback, timed_out=True)
+            raise RateLimitTimeout(f"No {self.provider} token available within {max_wait}s")
+        # Token i of the reservation becomes available once the bucket has refilled past it
+        ready = [now + max(0.0, i - available) / self.rate for i in range(1, tokens + 1)]
+        return ready, backend_seconds, fallback
+
+    def _next_ready_at(self, tokens, max_wait):
+        backend_seconds, fallback, calls = 0.0, False, 0
+        deadline_wait = self._deadline_wait()
+        if tokens == 1 and self.reserve_batch > 1 and max_wait is None:
+            # The lock only guards the local tokens; a refill's round trip runs without it
+            with self._lock:
+                ready_at = self._local_ready.popleft() if self._local_ready else None
+            if ready_at is None:
+                ready, backend_seconds, fallback = self._ready_times(self.reserve_batch, None)
+                calls = 1
+                with self._lock:
+                    self._local_ready.extend(ready[1:])
+                ready_at = ready[0]
+            if deadline_wait is not None and ready_at - time.time() > deadline_wait:
+                with self._lock:
+                    self._local_ready.appendleft(ready_at)
+                self.stats.record(self.provider, 0, 0.0, backend_seconds, calls, fallback, timed_out=True)
+                raise RateLimitTimeout(f"No {self.provider} token available before the invocation times out")
+        else:
+            if deadline_wait is not None:
+                max_wait = deadline_wait if max_wait is None else min(max_wait, deadline_wait)
+            ready, backend_seconds, fallback = self._ready_times(tokens, max_wait)
+            ready_at = ready[-1]
+            calls = 1
+        return ready_at, backend_seconds, calls, fallback
+
+    @staticmethod
+    def _deadline_wait():
+        """Longest wait the running invocation can afford, or None outside a handler."""
+        remaining = remaining_invocation_seconds()
+        if remaining is None:
+            return None
+        return max(0.0, remaining - RATE_LIMIT_DEADLINE_MARGIN_SECONDS)
+
+    def acquire(self, tokens=1, max_wait=None):
+        """
+        Block until tokens are available.
+
+        Args:
+            tokens: Number of tokens to take
+            max_wait: Raise RateLimitTimeout instead of waiting longer than this many seconds
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        ready_at, backend_seconds, calls, fallback = self._next_ready_at(tokens, max_wait)
+        waited = max(0.0, ready_at - time.time())
+        if waited > 0:
+            time.sleep(waited)
+        self.stats.record(self.provider, tokens, waited, backend_seconds, calls, fallback)
+        return waited
+
+    async def acquire_async(self, tokens=1, max_wait=None):
+        """
+        Async version of acquire(); the backend round trip runs in a worker thread.
+        """
+        ready_at, backend_seconds, calls, fallback = await asyncio.to_thread(self._next_ready_at, tokens, max_wait)
+        waited = max(0.0, ready_at - time.time())
+        if waited > 0:
+            await asyncio.sleep(waited)
+        self.stats.record(self.provider, tokens, waited, backend_seconds, calls, fallback)
+        return waited
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    async def __aenter__(self):
+        await self.acquire_async()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+
+def _backend_from_env():
+    if RATE_LIMIT_BACKEND == "memory":
+        return _memory_backend
+    if RATE_LIMIT_BACKEND == "file":
+        return FileRateLimitBackend()
+    return _postgres_backend
+
+
+_memory_backend = MemoryRateLimitBackend()
+_postgres_backend = PostgresRateLimitBackend()
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider, reserve_batch=None):
+    """
+    Get the container-wide RateLimiter for a provider, e.g. 'rapidapi' or 'mapbox'.
+
+    Args:
+        provider: API provider name
+        reserve_batch: Tokens reserved per backend round trip when the limiter is created;
+            defaults to RATE_LIMIT_RESERVE_BATCH
+    """
+    limiter = _rate_limiters.get(provider)
+    if limiter is None:
+        with _rate_limiters_lock:
+            limiter = _rate_limiters.get(provider)
+            if limiter is None:
+                batch = RATE_LIMIT_RESERVE_BATCH if reserve_batch is None else reserve_batch
+                limiter = _rate_limiters[provider] = RateLimiter(provider, reserve_batch=batch)
+    return limiter
+
+
+def get_rate_limit_stats():
+    """
+    Get per-provider rate limiter metrics for the current invocation.
+    """
+    return _rate_limit_stats.summary()
+
+
+register_metrics_provider("rate_limits", get_rate_limit_stats, reset=_rate_limit_stats.reset)
@@ -0,0 +1,202 @@
+import os
+import queue
+import threading
+import time
+from aws_utils import logger, get_db_session, register_metrics_provider
+
+# Streaming writer settings
+STREAM_CHUNK_ROWS = int(os.getenv("STREAM_CHUNK_ROWS", "1000"))
+# Pending record batches before put() blocks, which bounds memory while the DB catches up
+STREAM_MAX_PENDING = int(os.getenv("STREAM_MAX_PENDING", "8"))
+# How often a put() blocked on a full queue checks that the writer thread is still alive
+STREAM_PUT_POLL_SECONDS = 0.1
+
+_STOP = object()
+
+
+class StreamWriterStats:
+    """
+    Per-table chunk counts, rows written or failed, and commit latency for the current invocation.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._tables = {}
+
+    def _entry(self, table):
+        return self._tables.setdefault(table, {
+            "chunks": 0, "rows": 0, "failed_chunks": 0, "failed_rows": 0,
+            "write_ms": 0.0, "max_chunk_ms": 0.0, "producer_blocked_ms": 0.0,
+        })
+
+    def record(self, table, rows, seconds, failed=False):
+        with self._lock:
+            entry = self._entry(table)
+            entry["chunks"] += 1
+            if failed:
+                entry["failed_chunks"] += 1
+                entry["failed_rows"] += rows
+            else:
+                entry["rows"] += rows
+            entry["write_ms"] += seconds * 1000
+            entry["max_chunk_ms"] = max(entry["max_chunk_ms"], seconds * 1000)
+
+    def record_blocked(self, table, seconds):
+        with self._lock:
+            self._entry(table)["producer_blocked_ms"] += seconds * 1000
+
+    def summary(self):
+        with self._lock:
+            return {
+                table: {key: round(value, 1) if isinstance(value, float) else value for key, value in entry.items()}
+                for table, entry in self._tables.items()
+            }
+
+
+_stream_writer_stats = StreamWriterStats()
+
+
+class StreamWriter:
+    """
+    Writes records to the database from a background thread while the caller keeps
+    fetching. Records are grouped into chunks of chunk_rows and each chunk is written
+    and committed in its own transaction by write_chunk(session, records), which must be
+    idempotent (an upsert) so a retried SQS batch can rewrite chunks that already landed.
+
+    A failed chunk is rolled back, logged and tagged with tag_records(records) (for
+    example the ids it held) so the caller can report exactly what was not stored;
+    later chunks are still written. If the writer thread itself dies, its exception is
+    raised from the next put() and from close(), so the caller never waits on a queue
+    nobody drains.
+
+    Usage:
+        with StreamWriter("real_estate.fct_properties", write_chunk) as writer:
+            for page in pages:
+                writer.put(page)
+        writer.result  # rows, failed_rows, failed_tags, chunks
+    """
+
+    def __init__(self, table, write_chunk, chunk_rows=STREAM_CHUNK_ROWS, max_pending=STREAM_MAX_PENDING,
+                 tag_records=None, stats=_stream_writer_stats):
+        self.table = table
+        self.write_chunk = write_chunk
+        self.chunk_rows = max(1, chunk_rows)
+        self.tag_records = tag_records
+        self.stats = stats
+        self.result = {"rows": 0, "failed_rows": 0, "failed_tags": [], "chunks": 0, "errors": []}
+        self._queue = queue.Queue(maxsize=max(1, max_pending))
+        self._thread = threading.Thread(target=self._run, name=f"stream-writer-{table}", daemon=True)
+        self._started = False
+        self._error = None
+
+    def start(self):
+        if not self._started:
+            self._thread.start()
+            self._started = True
+        return self
+
+    def put(self, records):
+        """
+        Hand a batch of records to the writer. Blocks while max_pending batches are
+        already waiting, so a slow database throttles fetching instead of growing memory.
+        """
+        if not records:
+            return
+        self.start()
+        start = time.perf_counter()
+        self._enqueue(list(records))
+        self.stats.record_blocked(self.table, time.perf_counter() - start)
+
+    def close(self):
+        """
+        Flush the remaining records and wait for the writer thread.
+
+        Returns:
+            dict: rows, failed_rows, failed_tags, chunks and errors
+        """
+        if self._started:
+            try:
+                self._enqueue(_STOP)
+            finally:
+                self._thread.join()
+        logger.info(
+            f"Stream writer for {self.table} stored {self.result['rows']} rows in {self.result['chunks']} chunks "
+            f"({self.result['failed_rows']} rows failed)"
+        )
+        self._raise_if_failed()
+        return self.result
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def _enqueue(self, item):
+        # Wait for room in the queue, giving up if the writer thread has died
+        while True:
+            self._raise_if_failed()
+            try:
+                self._queue.put(item, timeout=STREAM_PUT_POLL_SECONDS)
+                return
+            except queue.Full:
+                continue
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        try:
+            pending = []
+            while True:
+                batch = self._queue.get()
+                if batch is _STOP:
+                    break
+                pending.extend(batch)
+                while len(pending) >= self.chunk_rows:
+                    chunk, pending = pending[:self.chunk_rows], pending[self.chunk_rows:]
+                    self._write(chunk)
+            if pending:
+                self._write(pending)
+        except Exception as e:
+            logger.error(f"Stream writer for {self.table} stopped: {e}")
+            self._error = e
+
+    def _write(self, chunk):
+        start = time.perf_counter()
+        failed = False
+        try:
+            session = get_db_session()
+            self.write_chunk(session, chunk)
+            session.commit()
+            self.result["rows"] += len(chunk)
+        except Exception as e:
+            failed = True
+            if 'session' in locals():
+                session.rollback()
+            self.result["failed_rows"] += len(chunk)
+            self.result["errors"].append(str(e))
+            if self.tag_records is not None:
+                self.result["failed_tags"].extend(self.tag_records(chunk))
+            logger.error(f"Error writing a {len(chunk)} row chunk to {self.table}: {e}")
+        finally:
+            if 'session' in locals():
+                session.close()
+        self.result["chunks"] += 1
+        self.stats.record(self.table, len(chunk), time.perf_counter() - start, failed=failed)
+
+
+def get_stream_writer_stats():
+    """
+    Get per-table streaming writer chunk and commit metrics for the current invocation.
+    """
+    return _stream_writer_stats.summary()
+
+
+register_metrics_provider("stream_writer", get_stream_writer_stats, reset=_stream_writer_stats.reset)
@@ -1,11 +1,34 @@
 import json
-import requests
-from sqlalchemy import text
-from aws_utils import logger, get_db_session, execute_query
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from aws_utils import logger, get_db_session, execute_query, log_invocation_metrics
+from api_messages import SEARCH_PAGE_LIMIT, parse_message, search_endpoint, rapidapi_get
+from bulk_upsert import bulk_upsert
+from listing_records import decode_search_page
+from http_client import get_http_client
+from rate_limiter import get_rate_limiter
+from stream_writer import StreamWriter
+from listing_dedup import ListingDeduper
+from search_checkpoints import (SEARCH_CHECKPOINTS_ENABLED, UNIT_DONE, PageTracker, ensure_checkpoint_table,
+                                load_checkpoints, save_checkpoints, clear_checkpoints)
 
-def upsert_properties_to_rds(session, listings):
+# Search units fetched at once per invocation; 1 processes them serially
+CONSUMER_CONCURRENCY = int(os.getenv("PROPERTIES_CONSUMER_CONCURRENCY", "4"))
+# Pages of one search unit fetched at once once the total is known; 1 follows nextOffset serially
+PAGE_PREFETCH_CONCURRENCY = int(os.getenv("PAGE_PREFETCH_CONCURRENCY", "4"))
+
+# Kept across warm invocations so listings already written today are skipped
+_deduper = ListingDeduper()
+
+def upsert_properties_to_rds(session, listings, day):
     """
-    Upsert a batch of listings into the real_estate.fct_properties table.
+    Upsert a batch of SearchListing records into the real_estate.fct_properties table.
+
+    Args:
+        session: A SQLAlchemy session object
+        listings: SearchListing records
+        day: Snapshot date to write them under (see fetch_snapshot_date)
     """
     # Delete query (commented out in original)
     # delete_query = """
@@ -13,16 +36,6 @@ def upsert_properties_to_rds(session, listings):
     #     WHERE "date" = CURRENT_DATE;
     # """
 
-    upsert_query = """
-        INSERT INTO real_estate.fct_properties (id, price, longitude, latitude, url, "date")
-        VALUES (:id, :price, :longitude, :latitude, :url, CURRENT_DATE)
-        ON CONFLICT (id, "date") DO UPDATE SET
-            price = EXCLUDED.price,
-            longitude = EXCLUDED.longitude,
-            latitude = EXCLUDED.latitude,
-            url = EXCLUDED.url;
-    """
-
     try:
         # Uncomment if needed
         # execute_query(session, delete_query)
@@ -30,20 +43,19 @@ def upsert_properties_to_rds(session, listings):
         
         logger.info(f"Inserting {len(listings)} into real_estate.fct_properties Table")
         
-        # Create parameters list for executemany
-        params_list = []
-        for listing in listings:
-            params_list.append({
-                'id': listing["id"],
-                'price': listing["price"],
-                'longitude': listing["longitude"],
-                'latitude': listing["latitude"],
-                'url': listing["url"],
-            })
-        
-        # Execute a batch insert with executemany
-        if params_list:
-            session.execute(text(upsert_query).execution_options(autocommit=False), params_list)
+        # Stream rows through COPY into a staging table and merge them in one statement
+        params_list = (
+            (listing.id, listing.price, listing.longitude, listing.latitude, listing.url, day)
+            for listing in listings
+        )
+        bulk_upsert(
+            session,
+            "real_estate.fct_properties",
+            columns=["id", "price", "longitude", "latitude", "url", "date"],
+            records=params_list,
+            conflict_target=["id", "date"],
+            update_columns=["price", "longitude", "latitude", "url"],
+        )
         
         session.commit()
         logger.info(f"Successfully upserted {len(listings)} listings to fct_properties")
@@ -52,120 +64,315 @@ def upsert_properties_to_rds(session, listings):
         logger.error(f"Error upserting to fct_properties: {e}")
         raise
 
-def fetch_and_store_data(message_list):
+def fetch_search_page(http, rate_limiter, endpoint, unit, offset):
+    """
+    Fetch one page of a search unit, decoding only the listing fields that are stored.
+
+    Returns:
+        tuple: (list of SearchListing records, Pagination)
+    """
+    params = {"areas": unit['areas'], "noFee": unit['noFee'],
+              "limit": str(SEARCH_PAGE_LIMIT), "offset": offset}
+
+    logger.info(f"Making call with {params['areas']} (offset {offset})")
+    response = rapidapi_get(http, endpoint, rate_limiter=rate_limiter, params=params)
+    response.raise_for_status()
+    page = decode_search_page(response.content)
+    logger.info(f"Fetched {len(page.listings)} listings")
+    return page.listings, page.pagination
+
+
+def fetch_search_unit(http, rate_limiter, endpoint, unit, on_page, start_offset=0,
+                      prefetch_workers=PAGE_PREFETCH_CONCURRENCY):
+    """
+    Fetch every page of one search unit from start_offset on, and hand each page to
+    on_page(offset, listings, next_offset) as it arrives. The first page gives the total
+    and the page step, so the remaining offsets are requested concurrently and handed over
+    in offset order; if the total is missing (or grew meanwhile), pages are followed
+    through nextOffset one at a time.
+
+    Returns:
+        tuple: (number of listings, number of pages fetched)
+    """
+    if start_offset:
+        logger.info(f"Resuming {unit['areas']} from checkpoint offset {start_offset}")
+    offset = start_offset
+    listings, pagination = fetch_search_page(http, rate_limiter, endpoint, unit, offset)
+    next_offset = pagination.next_offset
+    on_page(offset, listings, next_offset)
+    listings_count = len(listings)
+    pages = 1
+    total = pagination.total
+
+    if next_offset and next_offset > offset and total and prefetch_workers > 1:
+        offsets = list(range(next_offset, total, next_offset - offset))
+        if offsets:
+            with ThreadPoolExecutor(max_workers=min(prefetch_workers, len(offsets))) as executor:
+                results = list(executor.map(
+                    lambda page_offset: fetch_search_page(http, rate_limiter, endpoint, unit, page_offset), offsets))
+            for page_offset, (listings, pagination) in zip(offsets, results):
+                on_page(page_offset, listings, pagination.next_offset)
+                listings_count += len(listings)
+            pages += len(offsets)
+            offset = offsets[-1]
+            next_offset = pagination.next_offset
+
+    # If there's no nextOffset or no new offset to move to, stop
+    while next_offset and next_offset > offset:
+        logger.info(f"Setting offset to {next_offset}")
+        offset = next_offset
+        listings, pagination = fetch_search_page(http, rate_limiter, endpoint, unit, offset)
+        next_offset = pagination.next_offset
+        on_page(offset, listings, next_offset)
+        listings_count += len(listings)
+        pages += 1
+
+    # The producer's planner estimates pages from last run's counts; log drift from it
+    expected_pages = unit.get('expected_pages')
+    if expected_pages is not None and pages != expected_pages and not start_offset:
+        logger.info(f"Fetched {pages} pages for {unit['areas']}, planner expected {expected_pages}")
+    return listings_count, pages
+
+
+def fetch_and_store_data(message_list, message_ids=None, max_workers=CONSUMER_CONCURRENCY):
     """
-    Fetch data from the given API URL, handle pagination, and store results in RDS.
+    Fetch every search unit in the messages from the API, handle pagination, and stream
+    the results into RDS. Units are fetched concurrently on up to max_workers threads; the
+    shared rate limiter keeps the combined request rate in check. Pages go through a
+    bounded queue to a writer thread that upserts and commits them in chunks while
+    fetching continues, so memory stays flat and a DB error only loses its own chunk.
+
+    When message_ids (the SQS message ids) are given and checkpoints are enabled, each
+    unit's committed offset is checkpointed so a redelivered message resumes where it
+    stopped.
 
     Returns a dict with processing summary:
-        - successful: count of messages processed successfully
-        - failed: count of messages that failed
+        - successful: count of search units processed successfully
+        - failed: count of search units (or unreadable messages) that failed
+        - failed_messages: sorted indexes of messages with a failed unit or write
         - properties_count: total properties fetched
-        - errors: list of error details for failed messages
+        - stored_count: distinct properties committed to fct_properties
+        - failed_writes: properties in chunks that could not be written
+        - skipped_unchanged: repeats identical to a listing already written today
+        - skipped_duplicates: repeats superseded by another copy in this invocation
+        - errors: list of error details for failed units
     """
-    properties_list = []
+    http = get_http_client()
+    rate_limiter = get_rate_limiter("rapidapi")
+    properties_count = 0
     successful_count = 0
     failed_count = 0
+    failed_messages = set()
     errors = []
 
+    tasks = []
     for i, message in enumerate(message_list):
-        logger.info(f"Processing message {i+1} of {len(message_list)}")
         try:
-            offset = 0
-            while True:
-                params = message['params']
-                params['offset'] = offset
+            _, listing_type, units = parse_message(message)
+        except Exception as e:
+            failed_count += 1
+            failed_messages.add(i)
+            errors.append({"message_index": i, "area": "unknown", "error": f"Unreadable message: {e}"})
+            logger.error(f"Unreadable message {i+1}: {e}")
+            continue
+        tasks.extend((i, search_endpoint(listing_type), unit_index, unit) for unit_index, unit in enumerate(units))
 
-                logger.info(f"Making call with {params['areas']}")
-                response = requests.get(message['endpoint'], headers=message['headers'], params=params)
-                response.raise_for_status()
-                data = response.json()
+    use_checkpoints = SEARCH_CHECKPOINTS_ENABLED and message_ids is not None
+    start_offsets = load_search_checkpoints(message_ids) if use_checkpoints else {}
+    tracker = PageTracker(start_offsets)
 
-                listings = data.get("listings", [])
-                logger.info(f"Fetched {len(listings)} listings")
-                if listings:
-                    properties_list.extend(listings)
+    def checkpoint_key(task_index):
+        i, _, unit_index, _ = tasks[task_index]
+        return message_ids[i], unit_index
 
-                pagination = data.get("pagination", {})
-                next_offset = pagination.get("nextOffset")
+    # Repeats of a listing are resolved in the writer thread: the copy with the highest
+    # (invocation, unit, offset, position) key wins, and copies identical to what was
+    # already written today are skipped. Every chunk is written under the database date
+    # the invocation started on, the same date the digests are keyed on
+    snapshot_date = fetch_snapshot_date()
+    invocation = _deduper.start_invocation(snapshot_date)
 
-                # If there's no nextOffset or no new offset to move to, break the loop
-                if not next_offset or next_offset <= offset:
-                    break
-                logger.info(f"Setting offset to {next_offset}")
-                offset = next_offset
+    def write_chunk(session, tagged_listings):
+        rows = _deduper.prepare(tagged_listings)
+        if rows:
+            upsert_properties_to_rds(session, [listing for _, listing in rows], snapshot_date)
+        _deduper.commit(rows)
+        if use_checkpoints:
+            save_page_checkpoints(session, tracker, tagged_listings, checkpoint_key)
 
-            successful_count += 1
+    writer = StreamWriter("real_estate.fct_properties", write_chunk,
+                          tag_records=lambda chunk: {tasks[seq[1]][0] for seq, _ in chunk})
 
+    def run(task):
+        task_index, (i, endpoint, unit_index, unit) = task
+        logger.info(f"Processing message {i+1} of {len(message_list)} (area: {unit['areas']})")
+
+        def on_page(offset, listings, next_offset):
+            if use_checkpoints:
+                tracker.register(checkpoint_key(task_index), offset, len(listings), next_offset)
+            writer.put([((invocation, task_index, offset, position), listing)
+                        for position, listing in enumerate(listings)])
+
+        try:
+            start_offset = start_offsets.get(checkpoint_key(task_index), 0) if use_checkpoints else 0
+            if start_offset == UNIT_DONE:
+                logger.info(f"Skipping {unit['areas']}, already stored before this message was redelivered")
+                return 0, None
+            listings_count, _ = fetch_search_unit(http, rate_limiter, endpoint, unit, on_page, start_offset)
+            return listings_count, None
         except Exception as e:
-            failed_count += 1
-            area = message.get('params', {}).get('areas', 'unknown')
-            error_detail = {"message_index": i, "area": area, "error": str(e)}
-            errors.append(error_detail)
-            logger.error(f"Error processing message {i+1} (area: {area}): {e}")
-            # Continue processing remaining messages instead of raising
+            logger.error(f"Error processing message {i+1} (area: {unit['areas']}): {e}")
+            return 0, {"message_index": i, "area": unit['areas'], "error": str(e)}
+
+    workers = max(1, min(max_workers, len(tasks)))
+    start = time.perf_counter()
+    with writer, ThreadPoolExecutor(max_workers=workers) as executor:
+        # map keeps task order, so results are tallied the same way as a serial run
+        for listings_count, error_detail in executor.map(run, enumerate(tasks)):
+            if error_detail:
+                failed_count += 1
+                failed_messages.add(error_detail["message_index"])
+                errors.append(error_detail)
+            else:
+                successful_count += 1
+            properties_count += listings_count
+    logger.info(f"Fetched and stored {len(tasks)} search units on {workers} threads in {time.perf_counter() - start:.2f}s")
+
+    # Messages with rows in a chunk that did not commit are retried; the upsert is idempotent
+    failed_messages.update(writer.result["failed_tags"])
+    if use_checkpoints:
+        clear_search_checkpoints([message_ids[i] for i in range(len(message_list)) if i not in failed_messages])
 
     # Log summary of message processing
     logger.info(f"Message processing complete: {successful_count} successful, {failed_count} failed")
     if errors:
         logger.warning(f"Failed messages: {errors}")
+    if not properties_count:
+        logger.warning("No properties fetched from any messages")
+    dedup_stats = dict(_deduper.stats)
+    logger.info(f"Listing dedup: {dedup_stats} ({_deduper.digest_count()} listings written today)")
+
+    return {
+        "successful": successful_count,
+        "failed": failed_count,
+        "failed_messages": sorted(failed_messages),
+        "properties_count": properties_count,
+        "stored_count": dedup_stats["written"],
+        "failed_writes": writer.result["failed_rows"],
+        "skipped_unchanged": dedup_stats["skipped_unchanged"],
+        "skipped_duplicates": dedup_stats["skipped_duplicates"],
+        "errors": errors
+    }
 
-    # Only proceed with DB insert if we have properties to insert
-    if not properties_list:
-        logger.warning("No properties fetched from any messages, skipping database insert")
-        return {
-            "successful": successful_count,
-            "failed": failed_count,
-            "properties_count": 0,
-            "errors": errors
-        }
 
+def fetch_snapshot_date():
+    """
+    Get the database's CURRENT_DATE, the fct_properties date of this invocation's rows.
+    """
     try:
-        # Get a SQLAlchemy session
-        logger.info("Creating SQLAlchemy session")
         session = get_db_session()
+        return execute_query(session, "SELECT CURRENT_DATE").scalar()
+    except Exception as e:
+        raise Exception(f"Error fetching the snapshot date from RDS: {e}")
+    finally:
+        if 'session' in locals():
+            session.close()
 
-        logger.info(f"Inserting {len(properties_list)} into real_estate.fct_properties Table")
-        upsert_properties_to_rds(session, properties_list)
 
+def load_search_checkpoints(message_ids):
+    """
+    Load the pagination checkpoints of a batch, creating the table on first use. A
+    checkpoint failure only costs the resume, so errors are logged and ignored.
+    """
+    try:
+        session = get_db_session()
+        ensure_checkpoint_table(session)
+        checkpoints = load_checkpoints(session, message_ids)
+        session.commit()
+        if checkpoints:
+            logger.info(f"Loaded {len(checkpoints)} search checkpoints")
+        return checkpoints
     except Exception as e:
-        logger.error(f"Error upserting properties: {e}")
-        raise
+        logger.warning(f"Could not load search checkpoints: {e}")
+        return {}
+    finally:
+        if 'session' in locals():
+            session.close()
+
+
+def save_page_checkpoints(session, tracker, tagged_listings, checkpoint_key):
+    """
+    Mark the pages of a committed chunk and save the checkpoints that moved, in the
+    writer's session. The chunk itself is already committed, so failures are only logged.
+    """
+    page_rows = {}
+    for seq, _ in tagged_listings:
+        page = (checkpoint_key(seq[1]), seq[2])
+        page_rows[page] = page_rows.get(page, 0) + 1
+    tracker.committed(page_rows)
+    try:
+        save_checkpoints(session, tracker.advanced())
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logger.warning(f"Could not save search checkpoints: {e}")
+
 
+def clear_search_checkpoints(message_ids):
+    """
+    Drop the checkpoints of the messages that completed.
+    """
+    try:
+        session = get_db_session()
+        clear_checkpoints(session, message_ids)
+        session.commit()
+    except Exception as e:
+        logger.warning(f"Could not clear search checkpoints: {e}")
     finally:
         if 'session' in locals():
-            logger.info("Closing SQLAlchemy session")
             session.close()
 
-    return {
-        "successful": successful_count,
-        "failed": failed_count,
-        "properties_count": len(properties_list),
-        "errors": errors
-    }
 
+@log_invocation_metrics
 def lambda_handler(event, context):
     message_list = []
+    message_ids = []
     for record in event["Records"]:
-        message_body = json.loads(record["body"])
+        try:
+            message_body = json.loads(record["body"])
+        except ValueError as e:
+            logger.error(f"Message {record['messageId']} is not valid JSON: {e}")
+            message_body = None
         message_list.append(message_body)
+        message_ids.append(record["messageId"])
 
     try:
         logger.info(f"{len(message_list)} messages received. Processing:")
-        result = fetch_and_store_data(message_list)
+        result = fetch_and_store_data(message_list, message_ids)
 
         # If all messages failed, raise an error to trigger SQS retry
-        if result["failed"] == len(message_list):
+        if result["failed"] and not result["successful"]:
             raise Exception(f"All {len(message_list)} messages failed to process: {result['errors']}")
 
+        # Only the failed messages go back to the queue (ReportBatchItemFailures); their
+        # checkpoints let the retry skip the pages that were already stored
+        batch_item_failures = [{"itemIdentifier": message_ids[i]} for i in result["failed_messages"]]
+        if batch_item_failures:
+            logger.warning(f"Reporting {len(batch_item_failures)} of {len(message_list)} messages as failed")
+
         return {
             "statusCode": 200,
+            "batchItemFailures": batch_item_failures,
             "body": json.dumps({
                 "message": "Messages processed",
                 "successful": result["successful"],
                 "failed": result["failed"],
-                "properties_count": result["properties_count"]
+                "properties_count": result["properties_count"],
+                "stored_count": result["stored_count"],
+                "skipped_unchanged": result["skipped_unchanged"],
+                "skipped_duplicates": result["skipped_duplicates"]
             })
         }
     except Exception as e:
         logger.error(f"Error processing messages: {e}")
-        raise
\ No newline at end of file
+        raise
@@ -0,0 +1,99 @@
+"""
+Drops repeated listings before they reach fct_properties.
+
+The same listing comes back from overlapping area batches and from both noFee passes.
+Within an invocation every copy carries a sequence key (invocation, unit, offset,
+position) and the copy with the highest key wins, whatever order the fetch threads
+deliver them in. Across the warm invocations of one day, a compact digest of the
+(id, date, price, latitude, longitude, url) tuple last written for each id lets
+unchanged repeats be skipped without touching the database. The day is the snapshot date
+the rows are written under, taken from the database, so a Lambda clock on the other side
+of midnight never matches a digest of the wrong day.
+"""
+
+import hashlib
+import itertools
+import threading
+
+_invocations = itertools.count(1)
+
+
+def listing_digest(listing, day):
+    """64-bit digest of the fields fct_properties stores for a listing on a day."""
+    key = "|".join(str(getattr(listing, field)) for field in ("id", "price", "latitude", "longitude", "url"))
+    return int.from_bytes(hashlib.blake2b(f"{day.isoformat()}|{key}".encode(), digest_size=8).digest(), "big")
+
+
+class ListingDeduper:
+    """
+    Per-process dedup state. prepare() and commit() are called from the stream writer
+    thread; digests are only recorded once their chunk has committed, so a failed chunk
+    is written again on retry.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._day = None
+        self._written = {}
+        self._winners = {}
+        self._invocation = 0
+        self.stats = {}
+
+    def start_invocation(self, day):
+        """
+        Begin a new invocation: reset per-invocation winners and counters, and the digests
+        on a new day.
+
+        Args:
+            day: Snapshot date the invocation's rows are written under
+        """
+        with self._lock:
+            if day != self._day:
+                self._day = day
+                self._written = {}
+            self._winners = {}
+            self._invocation = next(_invocations)
+            self.stats = {"received": 0, "written": 0, "skipped_unchanged": 0, "skipped_duplicates": 0}
+            return self._invocation
+
+    def prepare(self, tagged_listings):
+        """
+        Filter (sequence key, listing) pairs down to the listings that need writing.
+
+        Returns:
+            list: (digest, listing) pairs, one per id, in chunk order
+        """
+        with self._lock:
+            latest = {}
+            for seq, listing in tagged_listings:
+                self.stats["received"] += 1
+                listing_id = listing.id
+                winner = self._winners.get(listing_id)
+                if winner is not None and winner > seq:
+                    # A copy with a higher sequence key was already accepted; it wins
+                    self.stats["skipped_duplicates"] += 1
+                    continue
+                self._winners[listing_id] = seq
+                if listing_id in latest:
+                    self.stats["skipped_duplicates"] += 1
+                latest[listing_id] = listing
+
+            rows = []
+            for listing_id, listing in latest.items():
+                digest = listing_digest(listing, self._day)
+                if self._written.get(listing_id) == digest:
+                    self.stats["skipped_unchanged"] += 1
+                    continue
+                rows.append((digest, listing))
+            return rows
+
+    def commit(self, rows):
+        """Record the digests of rows whose chunk has committed."""
+        with self._lock:
+            for digest, listing in rows:
+                self._written[listing.id] = digest
+            self.stats["written"] += len(rows)
+
+    def digest_count(self):
+        with self._lock:
+            return len(self._written)
@@ -0,0 +1,139 @@
+"""
+Pagination checkpoints for search messages.
+
+For every (SQS message id, unit index) the next offset whose listings are not yet
+committed is kept in real_estate.search_checkpoints. When SQS redelivers a message after
+a partial failure, its units resume from that offset instead of paginating from 0.
+
+A checkpoint only ever lags the data: pages complete when every listing in them has been
+committed by the stream writer, and the checkpoint advances over the contiguous prefix
+of completed pages, so a crash between the two writes just refetches a page.
+"""
+
+import os
+import threading
+from aws_utils import logger, execute_query
+
+SEARCH_CHECKPOINTS_ENABLED = os.getenv("SEARCH_CHECKPOINTS", "true").lower() == "true"
+SEARCH_CHECKPOINT_TABLE = "real_estate.search_checkpoints"
+# Checkpoints of messages that never completed are dropped after this long
+SEARCH_CHECKPOINT_TTL_HOURS = int(os.getenv("SEARCH_CHECKPOINT_TTL_HOURS", "24"))
+# Checkpoint of a unit whose last page is committed; the largest INTEGER so it wins GREATEST()
+UNIT_DONE = 2 ** 31 - 1
+
+
+def ensure_checkpoint_table(session):
+    """
+    Create real_estate.search_checkpoints if it does not exist yet.
+    """
+    execute_query(session, f"""
+        CREATE TABLE IF NOT EXISTS {SEARCH_CHECKPOINT_TABLE} (
+            message_id VARCHAR(100) NOT NULL,
+            unit_index INTEGER NOT NULL,
+            next_offset INTEGER NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (message_id, unit_index)
+        )
+    """)
+
+
+def load_checkpoints(session, message_ids):
+    """
+    Get the saved offsets for a batch of messages.
+
+    Returns:
+        dict: (message_id, unit_index) -> next offset to fetch
+    """
+    if not message_ids:
+        return {}
+    rows = execute_query(session, f"""
+        SELECT message_id, unit_index, next_offset
+        FROM {SEARCH_CHECKPOINT_TABLE}
+        WHERE message_id = ANY(CAST(:message_ids AS VARCHAR[]))
+    """, {"message_ids": list(message_ids)}).fetchall()
+    return {(row[0], row[1]): row[2] for row in rows}
+
+
+def save_checkpoints(session, offsets):
+    """
+    Upsert (message_id, unit_index) -> next offset. The caller commits.
+    """
+    if not offsets:
+        return
+    execute_query(session, f"""
+        INSERT INTO {SEARCH_CHECKPOINT_TABLE} (message_id, unit_index, next_offset, updated_at)
+        VALUES (:message_id, :unit_index, :next_offset, now())
+        ON CONFLICT (message_id, unit_index) DO UPDATE
+        SET next_offset = GREATEST({SEARCH_CHECKPOINT_TABLE}.next_offset, EXCLUDED.next_offset),
+            updated_at = now()
+    """, [{"message_id": key[0], "unit_index": key[1], "next_offset": offset} for key, offset in offsets.items()])
+
+
+def clear_checkpoints(session, message_ids):
+    """
+    Remove the checkpoints of completed messages, and any left over from messages that
+    were abandoned more than SEARCH_CHECKPOINT_TTL_HOURS ago. The caller commits.
+    """
+    execute_query(session, f"""
+        DELETE FROM {SEARCH_CHECKPOINT_TABLE}
+        WHERE message_id = ANY(CAST(:message_ids AS VARCHAR[]))
+           OR updated_at < now() - make_interval(hours => :ttl_hours)
+    """, {"message_ids": list(message_ids), "ttl_hours": SEARCH_CHECKPOINT_TTL_HOURS})
+
+
+class PageTracker:
+    """
+    Tracks which fetched pages have been fully committed, per checkpoint key.
+
+    register() is called by the fetch threads as each page arrives, with the number of
+    listings handed to the writer and the offset that follows it; committed() is called by
+    the writer thread after a chunk commits, with the pages its rows came from.
+    """
+
+    def __init__(self, start_offsets=None):
+        self._lock = threading.Lock()
+        self._pages = {}
+        self._next = dict(start_offsets or {})
+        self._saved = dict(start_offsets or {})
+
+    def register(self, key, offset, rows, next_offset):
+        with self._lock:
+            self._next.setdefault(key, offset)
+            self._saved.setdefault(key, offset)
+            self._pages.setdefault(key, {})[offset] = [rows, next_offset]
+
+    def committed(self, page_rows):
+        """
+        Mark rows of (key, offset) pages as committed.
+
+        Args:
+            page_rows: Dict of (key, offset) -> number of rows of that page in the chunk
+        """
+        with self._lock:
+            for (key, offset), rows in page_rows.items():
+                page = self._pages.get(key, {}).get(offset)
+                if page is not None:
+                    page[0] -= rows
+
+    def advanced(self):
+        """
+        Move each key's checkpoint over its contiguous prefix of committed pages.
+
+        Returns:
+            dict: key -> new next offset, for keys whose checkpoint moved
+        """
+        moved = {}
+        with self._lock:
+            for key, pages in self._pages.items():
+                offset = self._next[key]
+                while offset in pages and pages[offset][0] <= 0:
+                    next_offset = pages.pop(offset)[1]
+                    # The last page has no nextOffset: the whole unit is stored
+                    offset = next_offset if next_offset and next_offset > offset else UNIT_DONE
+                self._next[key] = offset
+                if offset != self._saved.get(key):
+                    moved[key] = offset
+                    self._saved[key] = offset
+        if moved:
+            logger.info(f"Advancing {len(moved)} search checkpoints")
+        return moved
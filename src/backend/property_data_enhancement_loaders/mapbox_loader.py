@@ -1,17 +1,21 @@
-import json
-import requests
-import pandas as pd
-import numpy as np
-from sqlalchemy import text
-from aws_utils import get_secret, logger, get_db_session, execute_query
+from aws_utils import get_secret, logger, log_invocation_metrics
+from async_db import get_async_pool, close_async_pools, async_bulk_upsert
+from http_client import get_http_client, get_async_http_client, close_async_http_clients
+from rate_limiter import get_rate_limiter
 
 import asyncio
-import aiohttp
-from tqdm.asyncio import tqdm_asyncio
-from aiolimiter import AsyncLimiter
+import os
 
-# Create rate limiter - 8 requests per second
-rate_limiter = AsyncLimiter(8, 1)  # 8 requests per 1 second
+MAX_LISTINGS_PER_RUN = 1000
+LISTINGS_CHUNK_SIZE = 250
+MAX_LISTINGS_IN_FLIGHT = 50
+POI_WRITE_BATCH_SIZE = 2000
+MAPBOX_MAX_RETRIES = 2
+# Overridable so the loader can run against a local stand-in (scripts/perf_harness.py)
+MAPBOX_BASE_URL = os.getenv("MAPBOX_BASE_URL", "https://api.mapbox.com")
+
+# Mapbox budget shared with every other running instance (8 requests per second by default)
+rate_limiter = get_rate_limiter("mapbox")
 
 # Async function to find POIs using Search Box API
 async def find_pois_searchbox_async(longitude, latitude, category, radius_meters=1000, token=None):
@@ -24,7 +28,7 @@ async def find_pois_searchbox_async(longitude, latitude, category, radius_meters
     radius_meters: Search radius in meters (1000m is roughly a 15-minute walk)
     """
     radius_km = radius_meters / 1000
-    url = f"https://api.mapbox.com/search/searchbox/v1/category/{category}"
+    url = f"{MAPBOX_BASE_URL}/search/searchbox/v1/category/{category}"
     params = {
         'proximity': f"{longitude},{latitude}",
         'radius': radius_km,
@@ -33,44 +37,15 @@ async def find_pois_searchbox_async(longitude, latitude, category, radius_meters
     }
     
     try:
-        # Setup retry parameters
-        retry_count = 0
-        max_retries = 1  # One retry (so 2 attempts total)
-        base_delay = 0.5  # Start with 0.5 second delay
-        
-        while True:
-            try:
-                # Use rate limiter to control API access
-                async with rate_limiter:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(url, params=params) as response:
-                            if response.status != 200:
-                                error_text = await response.text()
-                                
-                                # Check if we should retry
-                                if retry_count < max_retries and ("Too Many Requests" in error_text or response.status >= 500):
-                                    retry_count += 1
-                                    delay = base_delay * (2 ** retry_count)  # Exponential backoff
-                                    logger.warning(f"Retrying API call for {category} after {delay:.2f}s delay (attempt {retry_count}/{max_retries})")
-                                    await asyncio.sleep(delay)
-                                    # Continue the while loop to retry
-                                    continue
-                                else:
-                                    logger.error(f"Error with Search Box API for category {category}: {error_text}")
-                                    return []
-                            
-                            data = await response.json()
-                            return data.get('features', [])
-                            
-            except Exception as e:
-                if retry_count < max_retries:
-                    retry_count += 1
-                    delay = base_delay * (2 ** retry_count)  # Exponential backoff
-                    logger.warning(f"Exception in API call, retrying after {delay:.2f}s (attempt {retry_count}/{max_retries}): {str(e)}")
-                    await asyncio.sleep(delay)
-                else:
-                    logger.error(f"Exception in API call after {retry_count} retries: {str(e)}")
-                    return []
+        # Connection reuse, timeouts and jittered retries on 429/5xx come from the shared client,
+        # which takes a rate limiter token before every attempt
+        response = await get_async_http_client().get(
+            url, params=params, max_retries=MAPBOX_MAX_RETRIES, rate_limiter=rate_limiter
+        )
+        if response.status_code != 200:
+            logger.error(f"Error with Search Box API for category {category}: {response.text}")
+            return []
+        return response.json().get('features', [])
     except Exception as e:
         logger.error(f"Exception in API call: {str(e)}")
         return []
@@ -82,10 +57,8 @@ def find_pois_searchbox(longitude, latitude, category, radius_meters=1000, token
     
     This is kept for backward compatibility.
     """
-    import requests
-    
     radius_km = radius_meters / 1000
-    url = f"https://api.mapbox.com/search/searchbox/v1/category/{category}"
+    url = f"{MAPBOX_BASE_URL}/search/searchbox/v1/category/{category}"
     params = {
         'proximity': f"{longitude},{latitude}",
         'radius': radius_km,
@@ -94,7 +67,7 @@ def find_pois_searchbox(longitude, latitude, category, radius_meters=1000, token
     }
     
     try:
-        response = requests.get(url, params=params)
+        response = get_http_client().get(url, params=params, max_retries=MAPBOX_MAX_RETRIES, rate_limiter=rate_limiter)
         
         if response.status_code != 200:
             logger.error(f"Error with Search Box API for category {category}: {response.content}")
@@ -137,6 +110,8 @@ def process_poi_features(features, listing_id):
 # Async function to process a single listing
 async def process_listing_async(listing, categories, radius_meters, token):
     """Process a single listing for all categories asynchronously"""
+    import pandas as pd
+
     listing_id = listing['id']
     latitude = listing['latitude']
     longitude = listing['longitude']
@@ -179,6 +154,10 @@ async def process_listings_for_pois_async(listings_df, categories=None, radius_m
     Returns:
     Dictionary of DataFrames: one per category and a combined 'all_pois_df'
     """
+    # pandas and tqdm are only needed by this DataFrame-based path, not by the handler
+    import pandas as pd
+    from tqdm.asyncio import tqdm_asyncio
+
     # Default to cafe and fitness_center if no categories provided
     if categories is None or len(categories) == 0:
         categories = ['cafe', 'fitness_center']
@@ -234,7 +213,7 @@ def process_listings_for_pois(listings_df, categories=None, radius_meters=1000,
     
     This function now uses the async implementation internally.
     The rate_limit_delay parameter is kept for backward compatibility but is ignored.
-    Rate limiting is now handled by the AsyncLimiter.
+    Rate limiting is now handled by the shared mapbox rate limiter.
     
     Parameters:
     listings_df: DataFrame with listing_id, latitude, and longitude columns
@@ -248,71 +227,172 @@ def process_listings_for_pois(listings_df, categories=None, radius_meters=1000,
     if rate_limit_delay is not None:
         logger.info("Note: rate_limit_delay parameter is ignored in the async implementation")
     
+    async def run():
+        try:
+            return await process_listings_for_pois_async(listings_df, categories, radius_meters, token)
+        finally:
+            await close_async_http_clients()
+
     # Run the async function using asyncio.run
-    return asyncio.run(process_listings_for_pois_async(listings_df, categories, radius_meters, token))
+    return asyncio.run(run())
+
 
+POI_CATEGORIES = ['fitness_center', 'food', 'grocery', 'park']
+POI_COLUMNS = ['listing_id', 'name', 'longitude', 'latitude', 'distance', 'address', 'website', 'category']
 
-def fetch_listings(session):
+
+async def stream_listings(connection, limit=MAX_LISTINGS_PER_RUN, chunk_size=LISTINGS_CHUNK_SIZE):
+    """
+    Stream up to limit listings without POIs through a server-side cursor.
+    Must be iterated inside a transaction on connection.
+    """
     query = """
     SELECT id, latitude, longitude
     FROM real_estate.latest_property_details_view
     WHERE id IS NOT NULL AND id NOT IN (
         SELECT DISTINCT listing_id
         FROM real_estate_analytics.dim_property_nearest_pois
-    );"""
-
-    listings = execute_query(session, query)
-    listings_df = pd.DataFrame(listings)
-    return listings_df
+    )
+    LIMIT $1;"""
 
+    async for listing in connection.cursor(query, limit, prefetch=chunk_size):
+        yield listing
 
-def load_mapbox_data(session):
-    API_KEYS = get_secret(secret_name='COAPTAPIKeys')
-    MAPBOX_ACCESS_TOKEN = API_KEYS['mapbox_api_key']
 
-    listings_df = fetch_listings(session)
+async def enrich_listing(listing, categories, radius_meters, token, poi_queue):
+    """
+    Look up every POI category for one listing concurrently and queue the resulting rows.
+    """
+    listing_id = listing['id']
+    latitude = listing['latitude']
+    longitude = listing['longitude']
 
-    if listings_df.empty:
-        logger.info("No listings found to process for POIs")
+    if latitude is None or longitude is None:
+        logger.warning(f"Skipping listing {listing_id} due to missing coordinates")
         return
 
-    listings_df = listings_df.head(1000)
+    features_by_category = await asyncio.gather(*[
+        find_pois_searchbox_async(longitude, latitude, category, radius_meters, token)
+        for category in categories
+    ])
 
-    logger.info(f"Fetched {len(listings_df)} property coordinates")
+    rows = []
+    for category, features in zip(categories, features_by_category):
+        for poi in process_poi_features(features, listing_id):
+            distance = poi['distance']
+            rows.append((
+                poi['listing_id'], poi['name'], poi['longitude'], poi['latitude'],
+                round(distance) if distance is not None else None,
+                poi['address'], poi['website'], category,
+            ))
+    if rows:
+        await poi_queue.put(rows)
 
-    # Process the listings for POIs
-    results = process_listings_for_pois(
-        listings_df,
-        categories=['fitness_center', 'food', 'grocery', 'park'],
-        radius_meters=1000,
-        token=MAPBOX_ACCESS_TOKEN
-    )
 
-    final_results = results['all_pois_df'][['listing_id', 'name', 'longitude', 'latitude', 'distance', 'address', 'website', 'category']]
+async def write_pois(poi_queue, batch_size=POI_WRITE_BATCH_SIZE):
+    """
+    Drain POI rows from poi_queue and write them in batches while lookups are still running.
+    A None item marks the end of the stream.
+
+    If a write fails the queue keeps being drained, so producers never block on a full
+    queue, and the error is raised once the end of the stream is reached.
 
-    # Save the results to the database
-    # Get the SQLAlchemy engine from the session
-    engine = session.get_bind()
+    Returns:
+        int: Number of POI rows sent to the database
+    """
+    batch = []
+    written = 0
+    error = None
+    while True:
+        rows = await poi_queue.get()
+        if rows is not None and error is None:
+            batch.extend(rows)
+        if batch and (rows is None or len(batch) >= batch_size):
+            try:
+                # The same POI name can come back under several categories for a listing,
+                # so duplicates on the primary key are skipped
+                await async_bulk_upsert(
+                    "real_estate_analytics.dim_property_nearest_pois",
+                    columns=POI_COLUMNS,
+                    records=batch,
+                    conflict_target=["listing_id", "name"],
+                    update_columns=[],
+                )
+                written += len(batch)
+            except Exception as e:
+                logger.error(f"Error writing POIs: {e}")
+                error = e
+            batch = []
+        if rows is None:
+            if error is not None:
+                raise error
+            return written
 
-    final_results.to_sql(
-        'dim_property_nearest_pois',
-        con=engine,
-        schema='real_estate_analytics',
-        if_exists='append',
-        index=False
-    )   
-    
 
-def lambda_handler(event, context):
+async def load_mapbox_data_async(token, categories=None, radius_meters=1000):
+    """
+    Stream listings, enrich them with POIs and write the results, all overlapping in one
+    event loop: the listings cursor, the rate-limited Mapbox calls and the COPY writer run
+    concurrently, with at most MAX_LISTINGS_IN_FLIGHT listings being enriched at a time.
+    """
+    categories = categories or POI_CATEGORIES
+    pool = await get_async_pool()
+    poi_queue = asyncio.Queue(maxsize=MAX_LISTINGS_IN_FLIGHT)
+    writer = asyncio.create_task(write_pois(poi_queue))
+    in_flight = asyncio.Semaphore(MAX_LISTINGS_IN_FLIGHT)
+    tasks = []
 
-    session = get_db_session()
-    
+    async def enrich(listing):
+        try:
+            await enrich_listing(listing, categories, radius_meters, token, poi_queue)
+        finally:
+            in_flight.release()
+
+    listings_count = 0
+    try:
+        async with pool.acquire() as connection:
+            async with connection.transaction():
+                async for listing in stream_listings(connection):
+                    await in_flight.acquire()
+                    listings_count += 1
+                    tasks.append(asyncio.create_task(enrich(listing)))
+
+        logger.info(f"Streamed {listings_count} property coordinates")
+        await asyncio.gather(*tasks)
+    finally:
+        await poi_queue.put(None)
+        pois_count = await writer
+
+    return listings_count, pois_count
+
+
+def load_mapbox_data():
+    API_KEYS = get_secret(secret_name='COAPTAPIKeys')
+    MAPBOX_ACCESS_TOKEN = API_KEYS['mapbox_api_key']
+
+    async def run():
+        try:
+            return await load_mapbox_data_async(MAPBOX_ACCESS_TOKEN, radius_meters=1000)
+        finally:
+            await close_async_http_clients()
+            await close_async_pools()
+
+    listings_count, pois_count = asyncio.run(run())
+    if listings_count == 0:
+        logger.info("No listings found to process for POIs")
+        return
+
+    logger.info(f"Saved {pois_count} POIs for {listings_count} listings")
+
+
+@log_invocation_metrics
+def lambda_handler(event, context):
     try:
-        result = load_mapbox_data(session)
+        result = load_mapbox_data()
         # If result is returned (from loader functions), return it
         if result is not None:
             return {"statusCode": 200, "body": result}
             
     except Exception as e:
         logger.error(f"Error processing api type mapbox: {e}")
-        raise
\ No newline at end of file
+        raise
@@ -1,9 +1,15 @@
-import json
-import requests
 import pandas as pd
 import numpy as np
-from sqlalchemy import text
-from aws_utils import get_secret, logger, get_db_session, execute_query
+from aws_utils import logger, get_db_session, execute_query, stream_query, log_invocation_metrics
+from bulk_upsert import bulk_upsert
+
+LISTINGS_CHUNK_SIZE = 2000
+
+NEAREST_STATION_COLUMNS = [
+    'listing_id', 'parent_station', 'route_id', 'manhattan_distance_km', 'walking_minutes',
+    'route_short_name', 'route_long_name', 'route_color', 'stop_name', 'peak', 'off_peak',
+    'late_night', 'stop_lat', 'stop_lon', 'location_type', 'agency_id',
+]
 
 
 # Create a simplified parent station dataframe with just the 3 columns
@@ -176,22 +182,22 @@ def get_nearest_station_per_route(aggregated_df):
     
     return nearest_df
 
-def load_nearest_subways(session):
-    try:
-        logger.info("Fetching property coordinates")
-        query = """
-        SELECT id, latitude, longitude
-        FROM real_estate.latest_property_details_view
-        WHERE id IS NOT NULL
-          AND id NOT IN (
-              SELECT DISTINCT listing_id
-              FROM real_estate_analytics.dim_property_nearest_stations
-          );"""
+def find_nearest_stations(listings_df, subway_df, simple_parent_df):
+    """
+    Run the nearest-station pipeline for one chunk of listings.
 
-        listings = execute_query(session, query)
-        listings_df = pd.DataFrame(listings)
-        logger.info(f"Fetched {len(listings_df)} property coordinates")
-        
+    Returns:
+    --------
+    DataFrame with the closest station for each route for each listing in the chunk
+    """
+    nearby_stations_df = find_nearby_subway_stations_manhattan(listings_df, simple_parent_df)
+    nearby_stations_with_subway_df = nearby_stations_df.merge(subway_df, on='parent_station', how='left')
+    aggregated_stations_df = aggregate_by_listing_and_route(nearby_stations_with_subway_df)
+    return get_nearest_station_per_route(aggregated_stations_df)
+
+
+def load_nearest_subways(session, chunk_size=LISTINGS_CHUNK_SIZE):
+    try:
         logger.info("Fetching subway stations")
         query = """
         SELECT * FROM real_estate_analytics.subway_stops;
@@ -204,39 +210,47 @@ def load_nearest_subways(session):
         logger.info("Creating simple parent station dataframe")
         simple_parent_df = create_simple_parent_station_df(subway_df)
 
-        logger.info("Finding nearby stations")
-        nearby_stations_df = find_nearby_subway_stations_manhattan(listings_df, simple_parent_df)
+        # Listings are streamed with a server-side cursor so memory stays bounded by chunk_size
+        logger.info("Streaming property coordinates")
+        query = """
+        SELECT id, latitude, longitude
+        FROM real_estate.latest_property_details_view
+        WHERE id IS NOT NULL
+          AND id NOT IN (
+              SELECT DISTINCT listing_id
+              FROM real_estate_analytics.dim_property_nearest_stations
+          );"""
 
-        logger.info("Joining nearby stations with subway data")
-        nearby_stations_with_subway_df = nearby_stations_df.merge(subway_df, on='parent_station', how='left')
+        listings_count = 0
+        inserted_count = 0
+        for listings_df in stream_query(session, query, chunk_size=chunk_size):
+            listings_count += len(listings_df)
+            logger.info(f"Finding nearest stations for {len(listings_df)} listings ({listings_count} so far)")
+            nearest_stations_df = find_nearest_stations(listings_df, subway_df, simple_parent_df)
+            if len(nearest_stations_df) == 0:
+                continue
 
-        logger.info("Aggregating nearby stations")
-        aggregated_stations_df = aggregate_by_listing_and_route(nearby_stations_with_subway_df)
+            # Convert DataFrame to list of dicts, replacing NaN with None for SQL compatibility
+            records = nearest_stations_df.drop(columns=['loaded_datetime'], errors='ignore') \
+                .replace({np.nan: None}).to_dict('records')
 
-        logger.info("Getting nearest station per route")
-        nearest_stations_df = get_nearest_station_per_route(aggregated_stations_df)
+            bulk_upsert(
+                session,
+                "real_estate_analytics.dim_property_nearest_stations",
+                columns=NEAREST_STATION_COLUMNS,
+                records=records,
+                conflict_target=["listing_id", "route_id"],
+                update_columns=[],
+                extra_values={"loaded_datetime": "NOW()"},
+            )
+            inserted_count += len(records)
 
-        logger.info(f"Inserting {len(nearest_stations_df)} nearest stations into dim_property_nearest_stations")
-        if len(nearest_stations_df) == 0:
+        logger.info(f"Inserted {inserted_count} nearest stations for {listings_count} listings into dim_property_nearest_stations")
+        if inserted_count == 0:
             logger.info("No new stations to insert")
             return
 
-        insert_sql = text("""
-            INSERT INTO real_estate_analytics.dim_property_nearest_stations
-            (listing_id, parent_station, route_id, manhattan_distance_km, walking_minutes,
-             route_short_name, route_long_name, route_color, stop_name, peak, off_peak,
-             late_night, stop_lat, stop_lon, location_type, agency_id, loaded_datetime)
-            VALUES (:listing_id, :parent_station, :route_id, :manhattan_distance_km, :walking_minutes,
-             :route_short_name, :route_long_name, :route_color, :stop_name, :peak, :off_peak,
-             :late_night, :stop_lat, :stop_lon, :location_type, :agency_id, NOW())
-            ON CONFLICT (listing_id, route_id) DO NOTHING
-        """)
-
-        # Convert DataFrame to list of dicts, replacing NaN with None for SQL compatibility
-        records = nearest_stations_df.drop(columns=['loaded_datetime'], errors='ignore') \
-            .replace({np.nan: None}).to_dict('records')
-
-        session.execute(insert_sql, records)
+        # Committing closes the server-side cursor, so it only happens once the stream is drained
         session.commit()
 
     except Exception as e:
@@ -247,6 +261,7 @@ def load_nearest_subways(session):
             session.close()
 
 
+@log_invocation_metrics
 def lambda_handler(event, context):
 
     session = get_db_session()
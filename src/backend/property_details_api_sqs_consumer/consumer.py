@@ -1,225 +1,394 @@
+import asyncio
 import json
-import requests
-from sqlalchemy import text
-from aws_utils import logger, get_db_session
+import os
+from aws_utils import logger, get_db_session, log_invocation_metrics
+from api_messages import parse_message, details_endpoint, rapidapi_get, rapidapi_get_async
+from bulk_upsert import bulk_upsert
+from detail_work_queue import complete_detail_ids, park_empty_detail_ids
+from details_hashes import (DETAILS_CHANGE_DETECTION_ENABLED, DETAIL_COLUMN_GROUPS, ensure_details_hash_table,
+                            load_details_hashes, plan_detail_writes, save_details_hashes)
+from listing_records import decode_property_details
+from http_client import get_http_client, get_async_http_client, close_async_http_clients
+from rate_limiter import get_rate_limiter
+from stream_writer import StreamWriter
 
-def upsert_property_details_to_rds(session, listings):
-    """
-    Upsert a batch of listings into the real_estate.dim_property_details table.
+# Detail rows carry descriptions and media arrays, so they are committed in smaller chunks
+DETAILS_CHUNK_ROWS = int(os.getenv("DETAILS_CHUNK_ROWS", "100"))
+# "async" keeps up to DETAILS_FETCH_CONCURRENCY detail requests in flight, so throughput is
+# set by the shared RapidAPI rate limiter rather than the number of instances; "sync"
+# fetches one id at a time
+DETAILS_FETCH_MODE = os.getenv("DETAILS_FETCH_MODE", "async").lower()
+DETAILS_FETCH_CONCURRENCY = int(os.getenv("DETAILS_FETCH_CONCURRENCY", "16"))
+# RapidAPI tokens reserved per rate limiter round trip in async mode, so the in-flight
+# requests share a few round trips to the shared bucket instead of making one each
+DETAILS_RATE_LIMIT_RESERVE_BATCH = int(os.getenv("DETAILS_RATE_LIMIT_RESERVE_BATCH", "4"))
+
+def upsert_property_details_to_rds(session, listings, change_stats=None):
     """
-    upsert_query = """
-        INSERT INTO real_estate.dim_property_details (
-            id, status, listed_at, closed_at, days_on_market, available_from,
-            address, price, borough, neighborhood, zipcode, property_type,
-            sqft, bedrooms, bathrooms, type, latitude, longitude, amenities,
-            built_in, building_id, agents, no_fee, thumbnail_image,
-            description, images, videos, floorplans
-        )
-        VALUES (
-            :id, :status, :listed_at, :closed_at, :days_on_market, :available_from,
-            :address, :price, :borough, :neighborhood, :zipcode, :property_type,
-            :sqft, :bedrooms, :bathrooms, :type, :latitude, :longitude,
-            :amenities, :built_in, :building_id, :agents, :no_fee, :thumbnail_image,
-            :description, :images, :videos, :floorplans
-        )
-        ON CONFLICT (id) DO UPDATE SET
-            status = EXCLUDED.status,
-            listed_at = EXCLUDED.listed_at,
-            closed_at = EXCLUDED.closed_at,
-            days_on_market = EXCLUDED.days_on_market,
-            available_from = EXCLUDED.available_from,
-            address = EXCLUDED.address,
-            price = EXCLUDED.price,
-            borough = EXCLUDED.borough,
-            neighborhood = EXCLUDED.neighborhood,
-            zipcode = EXCLUDED.zipcode,
-            property_type = EXCLUDED.property_type,
-            sqft = EXCLUDED.sqft,
-            bedrooms = EXCLUDED.bedrooms,
-            bathrooms = EXCLUDED.bathrooms,
-            type = EXCLUDED.type,
-            latitude = EXCLUDED.latitude,
-            longitude = EXCLUDED.longitude,
-            amenities = EXCLUDED.amenities,
-            built_in = EXCLUDED.built_in,
-            building_id = EXCLUDED.building_id,
-            agents = EXCLUDED.agents,
-            no_fee = EXCLUDED.no_fee,
-            thumbnail_image = EXCLUDED.thumbnail_image,
-            description = EXCLUDED.description,
-            images = EXCLUDED.images,
-            videos = EXCLUDED.videos,
-            floorplans = EXCLUDED.floorplans,
-            loaded_datetime = EXCLUDED.loaded_datetime;
+    Upsert a batch of PropertyDetails records into the real_estate.dim_property_details table.
+
+    With change_stats (a dict of counters), rows are compared with their stored content
+    hashes first: unchanged rows are skipped and changed rows only rewrite the column
+    groups that differ. Without it every row is written in full.
     """
+    columns = [
+        'id', 'status', 'listed_at', 'closed_at', 'days_on_market', 'available_from',
+        'address', 'price', 'borough', 'neighborhood', 'zipcode', 'property_type',
+        'sqft', 'bedrooms', 'bathrooms', 'type', 'latitude', 'longitude', 'amenities',
+        'built_in', 'building_id', 'agents', 'no_fee', 'thumbnail_image',
+        'description', 'images', 'videos', 'floorplans',
+    ]
 
     try:
-        # Create parameters list for executemany
-        params_list = []
-        
+        # Rows in columns order; list columns stay Python lists and are sent as text[]
+        # through binary COPY, so no array literals are built or escaped
+        rows = []
         for listing in listings:
-            # Convert Python lists to PostgreSQL array format with null checks
-            amenities = listing.get("amenities") or []
-            agents = listing.get("agents") or []
-            amenities_array = "{" + ",".join(f'"{item}"' for item in amenities) + "}" if amenities else "{}"
-            agents_array = "{" + ",".join(f'"{item}"' for item in agents) + "}" if agents else "{}"
-            
-            # Safely extract building_id with null check
-            building = listing.get("building")
-            building_id = building.get("id") if building else None
-
-            # Safely extract thumbnail_image
-            images = listing.get("images") or []
-            thumbnail_image = images[0] if images and len(images) > 0 else None
-
-            # Format media arrays for PostgreSQL
-            videos = listing.get("videos") or []
-            floorplans = listing.get("floorplans") or []
-            images_array = "{" + ",".join(f'"{item}"' for item in images) + "}" if images else "{}"
-            videos_array = "{" + ",".join(f'"{item}"' for item in videos) + "}" if videos else "{}"
-            floorplans_array = "{" + ",".join(f'"{item}"' for item in floorplans) + "}" if floorplans else "{}"
-
-            params_list.append({
-                'id': listing.get("id"),
-                'status': listing.get("status"),
-                'listed_at': listing.get("listedAt"),
-                'closed_at': listing.get("closedAt"),
-                'days_on_market': listing.get("daysOnMarket"),
-                'available_from': listing.get("availableFrom"),
-                'address': listing.get("address"),
-                'price': listing.get("price"),
-                'borough': listing.get("borough"),
-                'neighborhood': listing.get("neighborhood"),
-                'zipcode': listing.get("zipcode"),
-                'property_type': listing.get("propertyType"),
-                'sqft': listing.get("sqft"),
-                'bedrooms': listing.get("bedrooms"),
-                'bathrooms': listing.get("bathrooms"),
-                'type': listing.get("type"),
-                'latitude': listing.get("latitude"),
-                'longitude': listing.get("longitude"),
-                'amenities': amenities_array,
-                'built_in': listing.get("builtIn"),
-                'building_id': building_id,
-                'agents': agents_array,
-                'no_fee': listing.get("noFee"),
-                'thumbnail_image': thumbnail_image,
-                'description': listing.get("description") or None,
-                'images': images_array,
-                'videos': videos_array,
-                'floorplans': floorplans_array,
-            })
-        
-        # Execute a batch insert with executemany
-        if params_list:
-            session.execute(text(upsert_query).execution_options(autocommit=False), params_list)
-        
+            building = listing.building
+            images = listing.images or []
+            rows.append((
+                listing.id,
+                listing.status,
+                listing.listed_at,
+                listing.closed_at,
+                listing.days_on_market,
+                listing.available_from,
+                listing.address,
+                listing.price,
+                listing.borough,
+                listing.neighborhood,
+                listing.zipcode,
+                listing.property_type,
+                listing.sqft,
+                listing.bedrooms,
+                listing.bathrooms,
+                listing.type,
+                listing.latitude,
+                listing.longitude,
+                listing.amenities or [],
+                listing.built_in,
+                building.id if building else None,
+                listing.agents or [],
+                listing.no_fee,
+                images[0] if images else None,
+                listing.description or None,
+                images,
+                listing.videos or [],
+                listing.floorplans or [],
+            ))
+
+        # Repeats of an id in the chunk collapse to the last one, as bulk_upsert would
+        rows = list({row[0]: row for row in rows}.values())
+        if change_stats is not None:
+            stored = load_details_hashes(session, [row[0] for row in rows])
+            full_rows, partial_rows, unchanged_ids, hashes = plan_detail_writes(rows, columns, stored)
+        else:
+            full_rows, partial_rows, unchanged_ids, hashes = rows, {}, [], None
+
+        # Stage each batch with binary COPY and merge it in one statement; loaded_datetime is
+        # not staged, so EXCLUDED.loaded_datetime picks up the column default
+        if full_rows:
+            bulk_upsert(
+                session,
+                "real_estate.dim_property_details",
+                columns=columns,
+                records=full_rows,
+                conflict_target=["id"],
+                update_columns=columns[1:] + ["loaded_datetime"],
+                copy_format="binary",
+            )
+        for groups, group_rows in partial_rows.items():
+            group_columns = [column for group in groups for column in DETAIL_COLUMN_GROUPS[group]]
+            positions = [columns.index(column) for column in ["id"] + group_columns]
+            bulk_upsert(
+                session,
+                "real_estate.dim_property_details",
+                columns=["id"] + group_columns,
+                records=([row[i] for i in positions] for row in group_rows),
+                conflict_target=["id"],
+                update_columns=group_columns + ["loaded_datetime"],
+                copy_format="binary",
+            )
+        if hashes is not None:
+            save_details_hashes(session, hashes)
+
+        # Drop the stored ids from the detail work queue in the same transaction
+        complete_detail_ids(session, [row[0] for row in rows])
         session.commit()
-        logger.info(f"Successfully upserted {len(listings)} listings to dim_property_details")
+        if change_stats is not None:
+            change_stats["new"] += len(full_rows)
+            change_stats["partial"] += sum(len(group_rows) for group_rows in partial_rows.values())
+            change_stats["unchanged"] += len(unchanged_ids)
+        logger.info(
+            f"Successfully upserted {len(listings)} listings to dim_property_details "
+            f"({len(unchanged_ids)} unchanged, {len(rows) - len(full_rows) - len(unchanged_ids)} partial)"
+        )
     except Exception as e:
         session.rollback()
         logger.error(f"Error upserting to dim_property_details: {e}")
         raise
 
 
-def fetch_and_store_data(message_list):
+def fetch_property_details(http, rate_limiter, endpoint):
     """
-    Fetch data from the given API URL, handle pagination, and store results in RDS.
+    Fetch and decode one listing's details.
 
-    Returns a dict with processing summary:
-        - successful: count of messages processed successfully
-        - failed: count of messages that failed
-        - errors: list of error details for failed messages
+    Returns:
+        PropertyDetails or None: None for an empty response
     """
-    property_details_list = []
-    successful_count = 0
-    failed_count = 0
-    errors = []
+    response = rapidapi_get(http, endpoint, rate_limiter=rate_limiter)
+    response.raise_for_status()
+    return decode_property_details(response.content)
 
-    for i, message in enumerate(message_list):
-        logger.info(f"Processing message {i+1} of {len(message_list)}")
-        try:
-            response = requests.get(message['endpoint'], headers=message['headers'])
-            response.raise_for_status()
-            data = response.json()
 
-            if data:
-                property_details_list.append(data)
-                successful_count += 1
-            else:
-                logger.warning(f"Empty response for message {i+1}")
-                successful_count += 1  # Empty response is not a failure
+async def fetch_property_details_async(http, rate_limiter, endpoint):
+    """
+    Async version of fetch_property_details for an AsyncHttpClient.
+    """
+    response = await rapidapi_get_async(http, endpoint, rate_limiter=rate_limiter)
+    response.raise_for_status()
+    return decode_property_details(response.content)
 
+
+def fetch_details(jobs, writer, rate_limiter):
+    """
+    Fetch the details of each (message index, property id, endpoint) job one at a time,
+    handing them to the writer as they arrive.
+
+    Returns:
+        list: Per job, the PropertyDetails, None for an empty response, or the exception
+    """
+    http = get_http_client()
+    outcomes = []
+    for _, _, endpoint in jobs:
+        try:
+            details = fetch_property_details(http, rate_limiter, endpoint)
         except Exception as e:
-            failed_count += 1
-            # Extract property ID from endpoint for better error tracking
-            endpoint = message.get('endpoint', 'unknown')
-            error_detail = {"message_index": i, "endpoint": endpoint, "error": str(e)}
-            errors.append(error_detail)
-            logger.error(f"Error fetching message {i+1} ({endpoint}): {e}")
-            # Continue processing remaining messages instead of raising
+            outcomes.append(e)
+            continue
+        if details is not None:
+            writer.put([details])
+        outcomes.append(details)
+    return outcomes
 
-    # Log summary of message processing
-    logger.info(f"Message processing complete: {successful_count} successful, {failed_count} failed")
-    if errors:
-        logger.warning(f"Failed messages: {errors}")
 
-    # Only proceed with DB insert if we have property details to insert
-    if not property_details_list:
-        logger.warning("No property details fetched from any messages, skipping database inserts")
-        return {
-            "successful": successful_count,
-            "failed": failed_count,
-            "properties_count": 0,
-            "errors": errors
-        }
+async def fetch_details_async(jobs, writer, rate_limiter, max_in_flight=DETAILS_FETCH_CONCURRENCY):
+    """
+    Fetch the details of every job concurrently, with at most max_in_flight requests
+    open; every attempt still takes a token from the shared rate limiter. Fetched details
+    are handed to the writer a chunk at a time from a worker thread, so a busy database
+    throttles fetching without blocking the event loop.
+
+    Returns:
+        list: Per job, the PropertyDetails, None for an empty response, or the exception
+    """
+    http = get_async_http_client()
+    in_flight = asyncio.Semaphore(max(1, max_in_flight))
+    pending = []
+
+    async def fetch(endpoint):
+        async with in_flight:
+            try:
+                details = await fetch_property_details_async(http, rate_limiter, endpoint)
+            except Exception as e:
+                return e
+        if details is not None:
+            pending.append(details)
+            if len(pending) >= DETAILS_CHUNK_ROWS:
+                batch = pending[:]
+                pending.clear()
+                await asyncio.to_thread(writer.put, batch)
+        return details
 
     try:
-        # Get a SQLAlchemy session
-        logger.info("Creating SQLAlchemy session")
-        session = get_db_session()
+        outcomes = await asyncio.gather(*(fetch(endpoint) for _, _, endpoint in jobs))
+        if pending:
+            await asyncio.to_thread(writer.put, pending)
+    finally:
+        await close_async_http_clients()
+    return outcomes
+
 
-        logger.info(f"Inserting {len(property_details_list)} messages into dim_property_details")
-        upsert_property_details_to_rds(session, property_details_list)
+def prepare_change_detection():
+    """
+    Create the details hash table on first use. Change detection only saves writes, so if
+    the table cannot be prepared every row is written in full.
 
+    Returns:
+        dict or None: Zeroed change counters, or None when change detection is off
+    """
+    if not DETAILS_CHANGE_DETECTION_ENABLED:
+        return None
+    try:
+        session = get_db_session()
+        ensure_details_hash_table(session)
+        session.commit()
+        return {"new": 0, "partial": 0, "unchanged": 0}
     except Exception as e:
-        logger.error(f"Error upserting property details: {e}")
-        raise
+        logger.warning(f"Change detection disabled for this invocation: {e}")
+        return None
+    finally:
+        if 'session' in locals():
+            session.close()
+
 
+def park_empty_ids(property_ids):
+    """
+    Park ids whose detail response was empty in the detail work queue, so they are not
+    leased and fetched again until they use up their attempts. Best effort: an id that
+    cannot be parked is only fetched again.
+    """
+    if not property_ids:
+        return
+    try:
+        session = get_db_session()
+        parked = park_empty_detail_ids(session, property_ids)
+        session.commit()
+        logger.info(f"Parked {parked} ids with empty detail responses in the work queue")
+    except Exception as e:
+        logger.warning(f"Could not park {len(property_ids)} ids with empty detail responses: {e}")
     finally:
         if 'session' in locals():
-            logger.info("Closing SQLAlchemy session")
             session.close()
 
+
+def fetch_and_store_data(message_list, fetch_mode=DETAILS_FETCH_MODE, max_in_flight=DETAILS_FETCH_CONCURRENCY):
+    """
+    Fetch details for every property id in the messages and stream them into RDS: a
+    writer thread upserts and commits them in chunks while fetching continues. In async
+    mode up to max_in_flight ids are fetched at once under the shared RapidAPI rate
+    limiter. Ids in a chunk that fails to write stay in the detail work queue, so a later
+    producer run leases them again once their lease expires; ids with an empty response
+    are parked in the queue instead of being fetched again.
+
+    Returns a dict with processing summary:
+        - successful: count of property ids processed successfully
+        - failed: count of property ids (or unreadable messages) that failed
+        - properties_count: property details fetched
+        - stored_count: property details committed to dim_property_details
+        - failed_ids: ids in chunks that could not be written
+        - failed_messages: sorted indexes of messages with an id that was not fetched or written
+        - unchanged_count: stored details skipped because their content hash matched
+        - partial_count: stored details that only rewrote their changed column groups
+        - skip_rate: unchanged_count over the details written or skipped
+        - errors: list of error details for failed property ids
+    """
+    rate_limiter = get_rate_limiter("rapidapi",
+                                    reserve_batch=DETAILS_RATE_LIMIT_RESERVE_BATCH if fetch_mode == "async" else None)
+    change_stats = prepare_change_detection()
+    writer = StreamWriter("real_estate.dim_property_details",
+                          lambda session, chunk: upsert_property_details_to_rds(session, chunk, change_stats),
+                          chunk_rows=DETAILS_CHUNK_ROWS, tag_records=lambda chunk: [d.id for d in chunk])
+    properties_count = 0
+    successful_count = 0
+    failed_count = 0
+    failed_messages = set()
+    # An id can be in more than one message; a write failure fails every one of them
+    messages_by_id = {}
+    empty_ids = []
+    errors = []
+
+    jobs = []
+    for i, message in enumerate(message_list):
+        try:
+            _, listing_type, property_ids = parse_message(message)
+        except Exception as e:
+            failed_count += 1
+            failed_messages.add(i)
+            errors.append({"message_index": i, "endpoint": "unknown", "error": f"Unreadable message: {e}"})
+            logger.error(f"Unreadable message {i+1}: {e}")
+            continue
+        for property_id in property_ids:
+            messages_by_id.setdefault(str(property_id), set()).add(i)
+            jobs.append((i, property_id, details_endpoint(property_id, listing_type)))
+
+    logger.info(f"Fetching details for {len(jobs)} properties from {len(message_list)} messages ({fetch_mode} mode)")
+    with writer:
+        if fetch_mode == "async":
+            outcomes = asyncio.run(fetch_details_async(jobs, writer, rate_limiter, max_in_flight))
+        else:
+            outcomes = fetch_details(jobs, writer, rate_limiter)
+
+    for (i, property_id, endpoint), outcome in zip(jobs, outcomes):
+        if isinstance(outcome, Exception):
+            failed_count += 1
+            failed_messages.add(i)
+            errors.append({"message_index": i, "endpoint": endpoint, "error": str(outcome)})
+            logger.error(f"Error fetching message {i+1} ({endpoint}): {outcome}")
+        elif outcome is None:
+            logger.warning(f"Empty response for property {property_id}")
+            empty_ids.append(str(property_id))
+            successful_count += 1  # Empty response is not a failure
+        else:
+            properties_count += 1
+            successful_count += 1
+    for property_id in writer.result["failed_tags"]:
+        failed_messages.update(messages_by_id.get(str(property_id), ()))
+    park_empty_ids(empty_ids)
+
+    # Log summary of message processing
+    logger.info(f"Message processing complete: {successful_count} successful, {failed_count} failed")
+    if errors:
+        logger.warning(f"Failed messages: {errors}")
+    if writer.result["failed_tags"]:
+        logger.warning(f"Property details not written, left in the work queue: {writer.result['failed_tags']}")
+    if not properties_count:
+        logger.warning("No property details fetched from any messages")
+    change_stats = change_stats or {"new": 0, "partial": 0, "unchanged": 0}
+    compared = sum(change_stats.values())
+    skip_rate = change_stats["unchanged"] / compared if compared else 0.0
+    logger.info(f"Details change detection: {change_stats} (skip rate {skip_rate:.1%})")
+
     return {
         "successful": successful_count,
         "failed": failed_count,
-        "properties_count": len(property_details_list),
+        "properties_count": properties_count,
+        "stored_count": writer.result["rows"],
+        "failed_ids": writer.result["failed_tags"],
+        "failed_messages": sorted(failed_messages),
+        "unchanged_count": change_stats["unchanged"],
+        "partial_count": change_stats["partial"],
+        "skip_rate": round(skip_rate, 4),
         "errors": errors
     }
 
 
+@log_invocation_metrics
 def lambda_handler(event, context):
     message_list = []
+    message_ids = []
     for record in event["Records"]:
-        message_body = json.loads(record["body"])
+        try:
+            message_body = json.loads(record["body"])
+        except ValueError as e:
+            logger.error(f"Message {record['messageId']} is not valid JSON: {e}")
+            message_body = None
         message_list.append(message_body)
+        message_ids.append(record["messageId"])
 
     try:
         logger.info(f"{len(message_list)} messages received. Processing:")
         result = fetch_and_store_data(message_list)
 
         # If all messages failed, raise an error to trigger SQS retry
-        if result["failed"] == len(message_list):
+        if result["failed"] and not result["successful"]:
             raise Exception(f"All {len(message_list)} messages failed to process: {result['errors']}")
 
+        # Only the failed messages go back to the queue (ReportBatchItemFailures)
+        batch_item_failures = [{"itemIdentifier": message_ids[i]} for i in result["failed_messages"]]
+        if batch_item_failures:
+            logger.warning(f"Reporting {len(batch_item_failures)} of {len(message_list)} messages as failed")
+
         return {
             "statusCode": 200,
+            "batchItemFailures": batch_item_failures,
             "body": json.dumps({
                 "message": "Messages processed",
                 "successful": result["successful"],
                 "failed": result["failed"],
-                "properties_count": result["properties_count"]
+                "properties_count": result["properties_count"],
+                "stored_count": result["stored_count"],
+                "skip_rate": result["skip_rate"]
             })
         }
     except Exception as e:
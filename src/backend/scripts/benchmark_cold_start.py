@@ -0,0 +1,168 @@
+"""
+Measure cold-start import cost of each Lambda handler.
+
+Imports every handler module in a fresh interpreter with `python -X importtime`,
+the same way the Lambda runtime does on a cold start (the aws_utils layer and the
+function's own directory on sys.path), and reports the total import time, the
+slowest top-level imports and the peak resident memory of the process.
+
+Usage:
+    cd src/backend && source venv/bin/activate
+    python scripts/benchmark_cold_start.py
+
+    # Median of several runs, only some handlers:
+    python scripts/benchmark_cold_start.py --repeat 5 --handler subway_loader --handler data_process_checker
+
+    # Fail (exit 1) when a handler exceeds an import budget, e.g. in CI:
+    python scripts/benchmark_cold_start.py --budget-ms 800 --budget-mb 150
+
+    # Machine-readable output:
+    python scripts/benchmark_cold_start.py --json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+LAYER_DIR = os.path.join(BACKEND_DIR, 'layers', 'aws_utils')
+
+# name -> (function directory, handler module), mirroring CodeUri/Handler in template.yml
+HANDLERS = {
+    'generic_api_sqs_producer': ('generic_api_sqs_producer', 'producer'),
+    'properties_api_sqs_consumer': ('properties_api_sqs_consumer', 'consumer'),
+    'property_details_api_sqs_consumer': ('property_details_api_sqs_consumer', 'consumer'),
+    'data_process_checker': ('data_process_checker', 'checker'),
+    'anthropic_batch_processor': ('anthropic_batch_processor', 'batch_processor'),
+    'subway_loader': ('property_data_enhancement_loaders', 'subway_loader'),
+    'mapbox_loader': ('property_data_enhancement_loaders', 'mapbox_loader'),
+}
+
+# Imported and measured in the child process; prints peak RSS in KB on the last line
+CHILD_SNIPPET = (
+    "import resource, sys\n"
+    "__import__(sys.argv[1])\n"
+    "print('maxrss_kb=%d' % resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)\n"
+)
+TOP_IMPORTS = 8
+
+
+def parse_importtime(stderr):
+    """
+    Parse `-X importtime` output into a list of (module, self_us, cumulative_us, depth).
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3:
+            continue
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(parts[0]), int(parts[1]), depth))
+    return rows
+
+
+def measure_handler(function_dir, module):
+    """
+    Import one handler module in a fresh interpreter.
+
+    Returns:
+        dict: import_ms (handler module cumulative), maxrss_mb and the top-level imports
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([LAYER_DIR, os.path.join(BACKEND_DIR, function_dir)])
+
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD_SNIPPET, module],
+        capture_output=True, text=True, env=env, cwd=BACKEND_DIR,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{proc.stderr.strip().splitlines()[-1]}")
+
+    rows = parse_importtime(proc.stderr)
+    # importtime lists a module after everything it imported, so the handler's direct
+    # imports are the depth-1 rows between the previous top-level row and the handler row
+    children = []
+    import_ms = 0.0
+    for name, _, cumulative_us, depth in rows:
+        if depth == 0:
+            if name == module:
+                import_ms = cumulative_us / 1000
+                break
+            children = []
+        elif depth == 1:
+            children.append((name, cumulative_us))
+    top = sorted(children, key=lambda r: r[1], reverse=True)[:TOP_IMPORTS]
+
+    maxrss_kb = 0
+    for line in proc.stdout.splitlines():
+        if line.startswith('maxrss_kb='):
+            maxrss_kb = int(line.split('=', 1)[1])
+
+    return {
+        'import_ms': import_ms,
+        'maxrss_mb': maxrss_kb / 1024,
+        'top_imports': [{'module': name, 'cumulative_ms': us / 1000} for name, us in top],
+    }
+
+
+def run_benchmark(names, repeat):
+    """Measure each handler `repeat` times and keep the median run."""
+    results = {}
+    for name in names:
+        function_dir, module = HANDLERS[name]
+        runs = [measure_handler(function_dir, module) for _ in range(repeat)]
+        median_ms = statistics.median(r['import_ms'] for r in runs)
+        representative = min(runs, key=lambda r: abs(r['import_ms'] - median_ms))
+        results[name] = {
+            'import_ms': median_ms,
+            'import_ms_min': min(r['import_ms'] for r in runs),
+            'import_ms_max': max(r['import_ms'] for r in runs),
+            'maxrss_mb': statistics.median(r['maxrss_mb'] for r in runs),
+            'top_imports': representative['top_imports'],
+        }
+    return results
+
+
+def print_report(results):
+    print(f"{'handler':<36} {'import ms':>10} {'min':>8} {'max':>8} {'max RSS MB':>11}")
+    for name, r in results.items():
+        print(
+            f"{name:<36} {r['import_ms']:>10.1f} {r['import_ms_min']:>8.1f} "
+            f"{r['import_ms_max']:>8.1f} {r['maxrss_mb']:>11.1f}"
+        )
+    for name, r in results.items():
+        print(f"\n{name} — slowest imports:")
+        for imp in r['top_imports']:
+            print(f"    {imp['cumulative_ms']:>8.1f} ms  {imp['module']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure cold-start import time and memory of each Lambda handler')
+    parser.add_argument('--handler', action='append', choices=sorted(HANDLERS), help='Handler to measure (repeatable, default: all)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per handler; the median is reported')
+    parser.add_argument('--budget-ms', type=float, help='Exit 1 if any handler imports slower than this')
+    parser.add_argument('--budget-mb', type=float, help='Exit 1 if any handler peaks above this RSS')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.handler or list(HANDLERS), max(1, args.repeat))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
+
+    over_budget = [
+        name for name, r in results.items()
+        if (args.budget_ms is not None and r['import_ms'] > args.budget_ms)
+        or (args.budget_mb is not None and r['maxrss_mb'] > args.budget_mb)
+    ]
+    if over_budget:
+        print(f"\nOver budget: {', '.join(over_budget)}", file=sys.stderr)
+        sys.exit(1)
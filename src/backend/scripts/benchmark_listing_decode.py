@@ -0,0 +1,146 @@
+"""
+Compare decoding RapidAPI responses into typed listing records with the json dict path.
+
+Builds the response bodies of one details consumer invocation (--messages SQS messages of
+--ids-per-message property ids, the template.yml BatchSize and the producer default) and
+of --search-pages full search pages from the local stand-ins in scripts/perf_standins.py,
+then decodes every body both ways:
+
+    json       response.json(): a dict for every object in the body
+    records    listing_records.decode_*: msgspec structs with only the stored fields
+
+and reports the median CPU time per batch, the peak traced memory while decoding the
+batch and the memory still held by the decoded batch (what the consumer keeps until the
+rows are written).
+
+The stand-in responses only carry the fields the pipeline stores; real responses carry
+more. --unused-kb adds a nested object of roughly that size to every details body to see
+how the two paths scale with fields that are not stored.
+
+Usage:
+    cd src/backend && source venv/bin/activate
+    python scripts/benchmark_listing_decode.py
+
+    # Bodies padded with ~4 KB of unstored fields, more runs:
+    python scripts/benchmark_listing_decode.py --unused-kb 4 --repeat 9
+
+    # Machine-readable output:
+    python scripts/benchmark_listing_decode.py --json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.abspath(os.path.join(SCRIPTS_DIR, '..'))
+LAYER_DIR = os.path.join(BACKEND_DIR, 'layers', 'aws_utils')
+sys.path.insert(0, LAYER_DIR)
+sys.path.insert(0, SCRIPTS_DIR)
+
+from perf_standins import listing_details, search_listing  # noqa: E402
+from listing_records import decode_property_details, decode_search_page  # noqa: E402
+
+SEARCH_PAGE_SIZE = 500
+
+
+def unused_fields(listing_id, kb):
+    """A nested object of about kb KB that the pipeline does not store."""
+    if kb <= 0:
+        return {}
+    entries = max(1, kb * 1024 // 64)
+    return {"unusedPayload": {"listingId": listing_id, "entries": [
+        {"key": f"field_{i}", "value": f"value {i} of listing {listing_id}"} for i in range(entries)
+    ]}}
+
+
+def details_bodies(messages, ids_per_message, unused_kb):
+    bodies = []
+    for n in range(messages * ids_per_message):
+        listing_id = str(4000000 + n)
+        bodies.append(json.dumps({**listing_details(listing_id), **unused_fields(listing_id, unused_kb)}).encode())
+    return bodies
+
+
+def search_bodies(pages):
+    bodies = []
+    for page in range(pages):
+        listings = []
+        for n in range(SEARCH_PAGE_SIZE):
+            listings.append(search_listing(str(5000000 + page * SEARCH_PAGE_SIZE + n)))
+        pagination = {"total": pages * SEARCH_PAGE_SIZE, "nextOffset": (page + 1) * SEARCH_PAGE_SIZE}
+        bodies.append(json.dumps({"listings": listings, "pagination": pagination}).encode())
+    return bodies
+
+
+def measure(decode, bodies, repeat):
+    """
+    Decode every body repeat times.
+
+    Returns:
+        dict: cpu_ms (median per batch), peak_mb and retained_mb of one traced batch
+    """
+    cpu_ms = []
+    for _ in range(repeat):
+        start = time.process_time()
+        decoded = [decode(body) for body in bodies]
+        cpu_ms.append((time.process_time() - start) * 1000)
+        del decoded
+
+    tracemalloc.start()
+    decoded = [decode(body) for body in bodies]
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del decoded
+    return {'cpu_ms': statistics.median(cpu_ms), 'peak_mb': peak / 2 ** 20, 'retained_mb': retained / 2 ** 20}
+
+
+def run_benchmark(args):
+    workloads = {
+        'details': (details_bodies(args.messages, args.ids_per_message, args.unused_kb),
+                    {'json': json.loads, 'records': decode_property_details}),
+        'search': (search_bodies(args.search_pages),
+                   {'json': json.loads, 'records': decode_search_page}),
+    }
+    results = {}
+    for name, (bodies, decoders) in workloads.items():
+        results[name] = {
+            'bodies': len(bodies),
+            'body_mb': sum(len(body) for body in bodies) / 2 ** 20,
+            'paths': {path: measure(decode, bodies, args.repeat) for path, decode in decoders.items()},
+        }
+    return results
+
+
+def print_report(results):
+    print(f"{'workload':<10} {'path':<8} {'bodies':>7} {'body MB':>8} {'cpu ms':>9} {'peak MB':>8} {'retained MB':>12}")
+    for name, r in results.items():
+        for path, m in r['paths'].items():
+            print(
+                f"{name:<10} {path:<8} {r['bodies']:>7} {r['body_mb']:>8.2f} {m['cpu_ms']:>9.1f} "
+                f"{m['peak_mb']:>8.2f} {m['retained_mb']:>12.2f}"
+            )
+        base, new = r['paths']['json'], r['paths']['records']
+        print(f"{'':<10} records vs json: {base['cpu_ms'] / max(new['cpu_ms'], 1e-9):.1f}x faster, "
+              f"{base['retained_mb'] / max(new['retained_mb'], 1e-9):.1f}x less retained memory")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare typed record decoding of RapidAPI responses with json dicts')
+    parser.add_argument('--messages', type=int, default=50, help='Details messages per invocation (template.yml BatchSize)')
+    parser.add_argument('--ids-per-message', type=int, default=20, help='Property ids per details message (DETAIL_IDS_PER_MESSAGE)')
+    parser.add_argument('--search-pages', type=int, default=20, help=f'Search pages of {SEARCH_PAGE_SIZE} listings')
+    parser.add_argument('--unused-kb', type=int, default=0, help='Approximate KB of unstored fields added to each details body')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per path; the median is reported')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
@@ -0,0 +1,154 @@
+-- Local schema for scripts/perf_harness.py.
+--
+-- Mirrors the tables in src/frontend/prisma/schema.prisma that the Lambda functions read
+-- and write, plus the views and the subway_stops table they depend on, which are managed
+-- outside Prisma. The view definitions are close approximations of the production ones:
+-- enough for the handlers' queries, not for analytics.
+
+CREATE SCHEMA IF NOT EXISTS real_estate;
+CREATE SCHEMA IF NOT EXISTS real_estate_analytics;
+
+CREATE TABLE IF NOT EXISTS real_estate.fct_properties (
+    id              VARCHAR(100) NOT NULL,
+    price           INTEGER,
+    longitude       NUMERIC(20, 8),
+    latitude        NUMERIC(20, 8),
+    url             VARCHAR(255),
+    date            DATE NOT NULL DEFAULT now(),
+    loaded_datetime TIMESTAMP(6) DEFAULT now(),
+    CONSTRAINT fct_properties_composite_pk PRIMARY KEY (id, date)
+);
+
+CREATE TABLE IF NOT EXISTS real_estate.dim_property_details (
+    id                  VARCHAR(20) PRIMARY KEY,
+    status              VARCHAR(50),
+    listed_at           DATE,
+    closed_at           DATE,
+    days_on_market      INTEGER,
+    available_from      DATE,
+    address             TEXT,
+    price               NUMERIC(10, 2),
+    borough             VARCHAR(50),
+    neighborhood        VARCHAR(100),
+    zipcode             VARCHAR(10),
+    property_type       VARCHAR(50),
+    sqft                INTEGER,
+    bedrooms            INTEGER,
+    bathrooms           NUMERIC(3, 1),
+    type                VARCHAR(50),
+    latitude            NUMERIC(9, 6),
+    longitude           NUMERIC(9, 6),
+    amenities           TEXT[],
+    built_in            INTEGER,
+    building_id         VARCHAR(20),
+    agents              TEXT[],
+    no_fee              BOOLEAN,
+    thumbnail_image     TEXT,
+    tag_list            TEXT[],
+    loaded_datetime     TIMESTAMP(6) DEFAULT now(),
+    brokers_fee         NUMERIC(10, 2),
+    additional_fees     JSONB,
+    description         TEXT,
+    description_summary TEXT,
+    images              TEXT[],
+    videos              TEXT[],
+    floorplans          TEXT[]
+);
+
+CREATE TABLE IF NOT EXISTS real_estate.neighborhoods (
+    id        INTEGER PRIMARY KEY,
+    name      VARCHAR(255) NOT NULL,
+    "group"   VARCHAR(255),
+    parent_id INTEGER
+);
+
+CREATE OR REPLACE VIEW real_estate.neighborhoods_enhanced_view AS
+WITH RECURSIVE tree AS (
+    SELECT n.id, n.name, n."group", n.parent_id, ''::VARCHAR(255) AS parent_name,
+           n.name::TEXT AS hierarchy_path, 1 AS level
+    FROM real_estate.neighborhoods n
+    WHERE n.parent_id IS NULL
+    UNION ALL
+    SELECT n.id, n.name, n."group", n.parent_id, t.name,
+           t.hierarchy_path || ' > ' || n.name, t.level + 1
+    FROM real_estate.neighborhoods n
+    JOIN tree t ON n.parent_id = t.id
+)
+SELECT id, name, "group", parent_id, parent_name, hierarchy_path, level FROM tree;
+
+-- Latest daily snapshot of fct_properties joined to whatever details have been loaded;
+-- id is NULL for listings whose details are still missing
+CREATE OR REPLACE VIEW real_estate.latest_property_details_view AS
+SELECT
+    f.id AS fct_id,
+    f.date,
+    f.price,
+    f.url,
+    d.id,
+    d.status,
+    d.borough,
+    d.neighborhood,
+    d.bedrooms,
+    d.bathrooms,
+    d.sqft,
+    d.no_fee,
+    d.description,
+    d.description_summary,
+    COALESCE(d.latitude, f.latitude) AS latitude,
+    COALESCE(d.longitude, f.longitude) AS longitude,
+    d.loaded_datetime
+FROM real_estate.fct_properties f
+LEFT JOIN real_estate.dim_property_details d ON d.id = f.id
+WHERE f.date = (SELECT MAX(date) FROM real_estate.fct_properties);
+
+CREATE TABLE IF NOT EXISTS real_estate_analytics.subway_stops (
+    stop_id          VARCHAR(20) NOT NULL,
+    stop_name        VARCHAR(100),
+    stop_lat         NUMERIC(9, 6),
+    stop_lon         NUMERIC(9, 6),
+    location_type    VARCHAR(20),
+    parent_station   VARCHAR(50),
+    route_id         VARCHAR(10) NOT NULL,
+    route_short_name VARCHAR(10),
+    route_long_name  VARCHAR(100),
+    route_color      VARCHAR(10),
+    agency_id        VARCHAR(20),
+    peak             NUMERIC(8, 2),
+    off_peak         NUMERIC(8, 2),
+    late_night       NUMERIC(8, 2),
+    PRIMARY KEY (stop_id, route_id)
+);
+
+CREATE TABLE IF NOT EXISTS real_estate_analytics.dim_property_nearest_stations (
+    listing_id            VARCHAR(20) NOT NULL,
+    parent_station        VARCHAR(50) NOT NULL,
+    route_id              VARCHAR(10) NOT NULL,
+    manhattan_distance_km NUMERIC(6, 2) NOT NULL,
+    walking_minutes       NUMERIC(5, 1) NOT NULL,
+    route_short_name      VARCHAR(10),
+    route_long_name       VARCHAR(100),
+    route_color           VARCHAR(10),
+    stop_name             VARCHAR(100),
+    peak                  NUMERIC(8, 2),
+    off_peak              NUMERIC(8, 2),
+    late_night            NUMERIC(8, 2),
+    stop_lat              NUMERIC(9, 6),
+    stop_lon              NUMERIC(9, 6),
+    location_type         VARCHAR(20),
+    agency_id             VARCHAR(20),
+    loaded_datetime       TIMESTAMP(6) NOT NULL DEFAULT now(),
+    PRIMARY KEY (listing_id, route_id)
+);
+
+CREATE TABLE IF NOT EXISTS real_estate_analytics.dim_property_nearest_pois (
+    listing_id      VARCHAR(20) NOT NULL,
+    name            VARCHAR(255) NOT NULL,
+    longitude       NUMERIC(11, 8) NOT NULL,
+    latitude        NUMERIC(11, 8) NOT NULL,
+    distance        BIGINT NOT NULL,
+    address         VARCHAR(255),
+    website         VARCHAR(255),
+    category        VARCHAR(50) NOT NULL,
+    loaded_datetime TIMESTAMP(6) NOT NULL DEFAULT now(),
+    PRIMARY KEY (listing_id, name)
+);
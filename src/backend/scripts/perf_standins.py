@@ -0,0 +1,426 @@
+"""
+Local stand-ins for the external services the Lambda functions call, used by
+scripts/perf_harness.py.
+
+StandinServer is one threaded HTTP server that answers like:
+    - RapidAPI NYC real estate:  GET /rentals/search, GET /rentals/{id}
+    - Mapbox Search Box:         GET /search/searchbox/v1/category/{category}
+    - Anthropic message batches: POST /v1/messages/batches, GET /v1/messages/batches/{id}[/results]
+
+Responses are generated deterministically from the request (area names, listing ids,
+coordinates), so repeated runs see the same data. Every response can be delayed by a
+configurable latency and a configurable fraction of requests fail with 429 or 503, to
+exercise retries and rate limiting.
+
+FakeSQS captures send_message / send_message_batch calls in memory so producer output
+can be replayed into the consumers as SQS events.
+"""
+
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Rough bounding box of the five boroughs
+NYC_LAT_RANGE = (40.55, 40.90)
+NYC_LON_RANGE = (-74.10, -73.75)
+
+AMENITIES = ['dishwasher', 'doorman', 'elevator', 'gym', 'laundry', 'pets', 'roof_deck', 'washer_dryer']
+POI_NAMES = ['Cafe', 'Market', 'Fitness', 'Park', 'Deli', 'Bakery', 'Studio', 'Garden']
+
+
+def _seed(*parts):
+    """Stable integer seed for a tuple of values."""
+    digest = hashlib.sha1("|".join(str(p) for p in parts).encode()).hexdigest()
+    return int(digest[:12], 16)
+
+
+def listing_ids_for_area(area, listings_per_area):
+    """
+    Listing ids returned by a search for one area slug. Counts vary by area around
+    listings_per_area, and "all-" areas are several times larger, so pagination depth
+    differs between messages.
+    """
+    rng = random.Random(_seed("area", area))
+    count = max(1, int(listings_per_area * rng.uniform(0.5, 1.5) * (8 if area.startswith("all-") else 1)))
+    base = _seed("ids", area) % 10_000_000
+    return [str(4_000_000_000 + base * 100 + i) for i in range(count)]
+
+
+def listing_coordinates(listing_id):
+    rng = random.Random(_seed("coords", listing_id))
+    return round(rng.uniform(*NYC_LAT_RANGE), 6), round(rng.uniform(*NYC_LON_RANGE), 6)
+
+
+def search_listing(listing_id, day=None):
+    """One item of a /rentals/search response."""
+    rng = random.Random(_seed("search", listing_id))
+    latitude, longitude = listing_coordinates(listing_id)
+    # Prices drift a little from day to day so daily snapshots are not identical
+    day_offset = (day or date.today()).toordinal() % 7
+    return {
+        "id": listing_id,
+        "price": rng.randrange(1800, 9000, 25) + day_offset * 25 * (rng.random() < 0.2),
+        "status": "open",
+        "longitude": longitude,
+        "latitude": latitude,
+        "url": f"https://streeteasy.com/rental/{listing_id}",
+    }
+
+
+def listing_details(listing_id, area=None, no_fee=None):
+    """
+    A /rentals/{id} response. area and no_fee, when known from an earlier search, keep
+    the details consistent with the search results.
+    """
+    rng = random.Random(_seed("details", listing_id))
+    latitude, longitude = listing_coordinates(listing_id)
+    listed_at = date.today() - timedelta(days=rng.randrange(1, 90))
+    images = [f"https://photos.example.com/{listing_id}/{i}.jpg" for i in range(rng.randrange(1, 12))]
+    bedrooms = rng.randrange(0, 4)
+    return {
+        "id": listing_id,
+        "status": "open",
+        "listedAt": listed_at.isoformat(),
+        "closedAt": None,
+        "daysOnMarket": (date.today() - listed_at).days,
+        "availableFrom": (date.today() + timedelta(days=rng.randrange(0, 45))).isoformat(),
+        "address": f"{rng.randrange(1, 999)} {rng.choice(['E', 'W'])} {rng.randrange(1, 200)}th St #{rng.randrange(1, 20)}{rng.choice('ABCDEF')}",
+        "price": rng.randrange(1800, 9000, 25),
+        "borough": rng.choice(['manhattan', 'brooklyn', 'queens', 'bronx']),
+        "neighborhood": area or rng.choice(['east-village', 'williamsburg', 'astoria', 'harlem', 'chelsea']),
+        "zipcode": str(rng.randrange(10001, 11400)),
+        "propertyType": rng.choice(['rental', 'condo', 'coop']),
+        "sqft": rng.choice([None, rng.randrange(350, 2000)]),
+        "bedrooms": bedrooms,
+        "bathrooms": rng.choice([1, 1, 1.5, 2]),
+        "type": "rental",
+        "latitude": latitude,
+        "longitude": longitude,
+        "amenities": rng.sample(AMENITIES, rng.randrange(0, len(AMENITIES))),
+        "builtIn": rng.choice([None, rng.randrange(1890, 2024)]),
+        "building": {"id": str(rng.randrange(100000, 999999))},
+        "agents": [f"Agent {rng.randrange(1, 500)}"],
+        "noFee": no_fee if no_fee is not None else rng.random() < 0.4,
+        "description": (
+            f"Bright {bedrooms} bedroom apartment with {rng.choice(['renovated kitchen', 'high ceilings', 'park views'])}. "
+            f"{rng.choice(['No fee.', 'One month broker fee applies.', 'Heat and hot water included.'])}"
+        ),
+        "images": images,
+        "videos": [],
+        "floorplans": [f"https://photos.example.com/{listing_id}/floorplan.png"] if rng.random() < 0.5 else [],
+    }
+
+
+def mapbox_features(category, longitude, latitude, limit=25):
+    """A Mapbox Search Box category response around a point."""
+    rng = random.Random(_seed("poi", category, round(longitude, 4), round(latitude, 4)))
+    features = []
+    for i in range(rng.randrange(max(1, limit // 3), limit + 1)):
+        features.append({
+            "type": "Feature",
+            "geometry": {
+                "type": "Point",
+                "coordinates": [round(longitude + rng.uniform(-0.008, 0.008), 6), round(latitude + rng.uniform(-0.008, 0.008), 6)],
+            },
+            "properties": {
+                "name": f"{rng.choice(POI_NAMES)} {category} {i}",
+                "address": f"{rng.randrange(1, 999)} Example Ave",
+                "distance": rng.randrange(20, 1000),
+                "metadata": {"website": f"https://poi.example.com/{category}/{i}"} if rng.random() < 0.5 else {},
+            },
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def batch_result(custom_id):
+    """One line of an Anthropic message batch results file."""
+    rng = random.Random(_seed("batch", custom_id))
+    fees = []
+    if rng.random() < 0.3:
+        fees.append({"name": "brokers-fee", "amount": rng.choice([1, 1.5, 15]), "type": rng.choice(["months", "percentage"]), "recurring": False})
+    return {
+        "custom_id": custom_id,
+        "result": {
+            "type": "succeeded",
+            "message": {
+                "id": f"msg_{uuid.uuid4().hex[:24]}",
+                "type": "message",
+                "role": "assistant",
+                "model": "claude-haiku-4-5-20251001",
+                "content": [{
+                    "type": "tool_use",
+                    "id": f"toolu_{uuid.uuid4().hex[:24]}",
+                    "name": "save_details",
+                    "input": {
+                        "summary": "Well located apartment with modern finishes.",
+                        "tag_list": rng.sample(['renovated', 'spacious', 'cozy', 'natural-light', 'pet-friendly', 'close-to-subway'], 3),
+                        "additional_fees": fees,
+                        "input_description": "",
+                    },
+                }],
+                "stop_reason": "tool_use",
+                "stop_sequence": None,
+                "usage": {"input_tokens": 900, "output_tokens": 120},
+            },
+        },
+    }
+
+
+class StandinState:
+    """Configuration and request counters shared by the handler threads."""
+
+    def __init__(self, latency_ms=0.0, latency_jitter=0.5, error_rate=0.0, listings_per_area=40, seed=0, areas=()):
+        self.latency_ms = latency_ms
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.listings_per_area = listings_per_area
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.batches = {}
+        # listing id -> (area, no_fee) for the given area slugs, so details agree with
+        # the searches that returned them; every third listing in an area is no-fee
+        self.listings = {
+            listing_id: (area, i % 3 == 0)
+            for area in areas
+            for i, listing_id in enumerate(listing_ids_for_area(area, listings_per_area))
+        }
+        self.base_url = None
+
+    def count(self, route, status):
+        with self.lock:
+            entry = self.requests.setdefault(route, {})
+            entry[status] = entry.get(status, 0) + 1
+
+    def delay(self):
+        if self.latency_ms <= 0:
+            return
+        with self.lock:
+            jitter = self.rng.uniform(1 - self.latency_jitter, 1 + self.latency_jitter)
+        time.sleep(self.latency_ms * jitter / 1000)
+
+    def should_fail(self):
+        if self.error_rate <= 0:
+            return False
+        with self.lock:
+            return self.rng.random() < self.error_rate
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without TCP_NODELAY every keep-alive
+    # response would stall on delayed ACKs and dwarf the configured latency
+    disable_nagle_algorithm = True
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, route, status, payload, headers=None, content_type="application/json"):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.state.count(route, status)
+
+    def _maybe_fail(self, route):
+        self.state.delay()
+        if self.state.should_fail():
+            if self.state.rng.random() < 0.5:
+                self._send_json(route, 429, {"message": "Too Many Requests"}, {"Retry-After": "0.1"})
+            else:
+                self._send_json(route, 503, {"message": "Service Unavailable"})
+            return True
+        return False
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        path = parts.path
+
+        match = re.fullmatch(r"/(rentals|sales)/search", path)
+        if match:
+            route = "rapidapi_search"
+            if self._maybe_fail(route):
+                return
+            ids = []
+            for area in query.get("areas", "").split(","):
+                if area:
+                    area_ids = listing_ids_for_area(area, self.state.listings_per_area)
+                    ids.extend(area_ids[::3] if query.get("noFee") == "true" else area_ids)
+            offset = int(query.get("offset", 0))
+            limit = int(query.get("limit", 500))
+            page = ids[offset:offset + limit]
+            next_offset = offset + limit if offset + limit < len(ids) else None
+            self._send_json(route, 200, {
+                "listings": [search_listing(listing_id) for listing_id in page],
+                "pagination": {"count": len(page), "total": len(ids), "nextOffset": next_offset},
+            })
+            return
+
+        match = re.fullmatch(r"/(rentals|sales)/(\d+)", path)
+        if match:
+            route = "rapidapi_details"
+            if self._maybe_fail(route):
+                return
+            area, no_fee = self.state.listings.get(match.group(2), (None, None))
+            self._send_json(route, 200, listing_details(match.group(2), area, no_fee))
+            return
+
+        match = re.fullmatch(r"/search/searchbox/v1/category/([\w-]+)", path)
+        if match:
+            route = "mapbox_category"
+            if self._maybe_fail(route):
+                return
+            longitude, latitude = (float(v) for v in query.get("proximity", "0,0").split(","))
+            self._send_json(route, 200, mapbox_features(match.group(1), longitude, latitude, int(query.get("limit", 25))))
+            return
+
+        match = re.fullmatch(r"/v1/messages/batches/([\w-]+)(/results)?", path)
+        if match:
+            batch = self.state.batches.get(match.group(1))
+            if batch is None:
+                self._send_json("anthropic_batches", 404, {"type": "error", "error": {"type": "not_found_error", "message": "batch not found"}})
+                return
+            self.state.delay()
+            if match.group(2):
+                lines = "\n".join(json.dumps(batch_result(custom_id)) for custom_id in batch["custom_ids"])
+                self._send_json("anthropic_results", 200, lines.encode(), content_type="application/binary")
+            else:
+                self._send_json("anthropic_batches", 200, self._batch_object(batch, ended=True))
+            return
+
+        self._send_json("unknown", 404, {"message": f"No stand-in for {path}"})
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        if path == "/v1/messages/batches":
+            self.state.delay()
+            body = self._read_body()
+            batch_id = f"msgbatch_{uuid.uuid4().hex[:24]}"
+            batch = {"id": batch_id, "custom_ids": [r["custom_id"] for r in body.get("requests", [])],
+                     "created_at": datetime.now(timezone.utc)}
+            self.state.batches[batch_id] = batch
+            self._send_json("anthropic_batches", 200, self._batch_object(batch, ended=False))
+            return
+        self._send_json("unknown", 404, {"message": f"No stand-in for {path}"})
+
+    def _batch_object(self, batch, ended):
+        created_at = batch["created_at"]
+        count = len(batch["custom_ids"])
+        return {
+            "id": batch["id"],
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {
+                "processing": 0 if ended else count,
+                "succeeded": count if ended else 0,
+                "errored": 0, "canceled": 0, "expired": 0,
+            },
+            "created_at": created_at.isoformat(),
+            "expires_at": (created_at + timedelta(days=1)).isoformat(),
+            "ended_at": datetime.now(timezone.utc).isoformat() if ended else None,
+            "archived_at": None,
+            "cancel_initiated_at": None,
+            "results_url": f"{self.state.base_url}/v1/messages/batches/{batch['id']}/results" if ended else None,
+        }
+
+
+class StandinServer:
+    """
+    Run the stand-in HTTP server on a background thread.
+
+    Usage:
+        with StandinServer(latency_ms=80, error_rate=0.02) as server:
+            os.environ["RAPIDAPI_BASE_URL"] = server.base_url
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, **state_kwargs):
+        self.state = StandinState(**state_kwargs)
+        handler = type("BoundStandinHandler", (StandinHandler,), {"state": self.state})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://{host}:{self.httpd.server_port}"
+        self.state.base_url = self.base_url
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def request_counts(self):
+        with self.state.lock:
+            return {route: dict(statuses) for route, statuses in self.state.requests.items()}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+
+class FakeSQS:
+    """
+    In-memory stand-in for the boto3 SQS client methods the producer uses.
+    """
+
+    def __init__(self):
+        self.queues = {}
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        with self.lock:
+            self.calls += 1
+            self.queues.setdefault(QueueUrl, []).append(MessageBody)
+        return {"MessageId": uuid.uuid4().hex}
+
+    def send_message_batch(self, QueueUrl, Entries, **kwargs):
+        with self.lock:
+            self.calls += 1
+            self.queues.setdefault(QueueUrl, []).extend(entry["MessageBody"] for entry in Entries)
+        return {"Successful": [{"Id": entry["Id"], "MessageId": uuid.uuid4().hex} for entry in Entries], "Failed": []}
+
+    def drain(self, queue_url):
+        """Remove and return every message body sent to queue_url."""
+        with self.lock:
+            return self.queues.pop(queue_url, [])
+
+
+def sqs_event(bodies, queue_arn="arn:aws:sqs:us-east-2:000000000000:local"):
+    """Build a Lambda SQS event from message bodies."""
+    return {
+        "Records": [
+            {
+                "messageId": str(uuid.uuid4()),
+                "receiptHandle": uuid.uuid4().hex,
+                "body": body,
+                "attributes": {"ApproximateReceiveCount": "1"},
+                "messageAttributes": {},
+                "eventSource": "aws:sqs",
+                "eventSourceARN": queue_arn,
+            }
+            for body in bodies
+        ]
+    }
@@ -0,0 +1,48 @@
+"""
+Shared fixtures for the backend tests.
+
+Run from src/backend:
+
+    python -m pytest tests
+
+Tests that need Postgres use the db_session fixture and are skipped unless
+TEST_DATABASE_URL points at a database they may create the real_estate schema in. Each
+test runs in one transaction that is rolled back afterwards.
+"""
+
+import os
+import sys
+import pytest
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# Lambda packages each function directory next to the layer, so their modules import
+# each other by bare name; the consumers' consumer.py files are loaded by path instead
+for directory in ('layers/aws_utils', 'generic_api_sqs_producer', 'properties_api_sqs_consumer',
+                  'anthropic_batch_processor'):
+    sys.path.insert(0, os.path.join(BACKEND_DIR, directory))
+
+SCHEMA_SQL = os.path.join(BACKEND_DIR, 'scripts', 'perf_schema.sql')
+
+
+@pytest.fixture
+def db_session():
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    engine = create_engine(url)
+    connection = engine.connect()
+    transaction = connection.begin()
+    session = Session(bind=connection)
+    with open(SCHEMA_SQL) as f:
+        connection.exec_driver_sql(f.read())
+    connection.exec_driver_sql("TRUNCATE real_estate.fct_properties, real_estate.dim_property_details")
+    try:
+        yield session
+    finally:
+        session.close()
+        transaction.rollback()
+        connection.close()
+        engine.dispose()
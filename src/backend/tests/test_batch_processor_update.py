@@ -0,0 +1,32 @@
+import datetime
+import batch_processor
+from aws_utils import execute_query
+
+
+def test_update_without_property_ids_does_not_touch_the_database(monkeypatch):
+    def no_session():
+        raise AssertionError("no session expected")
+
+    monkeypatch.setattr(batch_processor, "get_db_session", no_session)
+    batch_processor.update_rds([{"tag_list": ["cozy"], "additional_fees": []}])
+
+
+def test_update_looks_up_prices_of_the_batch(db_session, monkeypatch):
+    monkeypatch.setattr(batch_processor, "get_db_session", lambda: db_session)
+    execute_query(db_session, """
+        INSERT INTO real_estate.fct_properties (id, price, latitude, longitude, url, date)
+        VALUES ('1', 3000, 40.7, -73.9, '/rental/1', :date)
+    """, {"date": datetime.date(2030, 1, 10)})
+    execute_query(db_session, "INSERT INTO real_estate.dim_property_details (id, status, price) VALUES ('1', 'open', 3000)")
+
+    batch_processor.update_rds([
+        {"property_id": "1", "tag_list": ["cozy"],
+         "additional_fees": [{"name": "Broker fee", "type": "dollars", "amount": 3000}]},
+        {"tag_list": ["luxury"], "additional_fees": []},
+    ])
+
+    tags, brokers_fee = execute_query(
+        db_session, "SELECT tag_list, brokers_fee FROM real_estate.dim_property_details WHERE id = '1'"
+    ).fetchone()
+    assert tags == ["cozy"]
+    assert float(brokers_fee) == 12.0
@@ -0,0 +1,104 @@
+"""
+Binary COPY encoders checked byte for byte against Postgres' own send functions
+(numeric_send, array_send, date_send, timestamp_send, timestamptz_send), whose output the
+expected values were taken from.
+"""
+
+import datetime
+import struct
+from decimal import Decimal
+import pytest
+from sqlalchemy import text
+from bulk_upsert import (BINARY_COPY_HEADER, BINARY_COPY_TRAILER, _binary_chunks, _binary_encoder, _csv_encoder,
+                         bulk_upsert)
+
+
+@pytest.mark.parametrize("value, expected", [
+    (Decimal("-1234.5600"), "000200004000000404d215e0"),
+    (Decimal("0.0001"), "0001ffff000000040001"),
+    (-0.5, "0001ffff400000011388"),
+    (Decimal("123456789.012"), "0004000200000003000109291a850078"),
+    (0, "0000000000000000"),
+    (10000, "00010001000000000001"),
+    (Decimal("NaN"), "00000000c0000000"),
+    (float("nan"), "00000000c0000000"),
+])
+def test_numeric(value, expected):
+    assert _binary_encoder("numeric")(value).hex() == expected
+
+
+def test_negative_zero_is_sent_as_zero():
+    assert _binary_encoder("numeric")(-0.0).hex() == "0000000000000001"
+
+
+@pytest.mark.parametrize("typname, value, expected", [
+    ("_text", ["a", None, "b'c"], "00000001000000010000001900000003000000010000000161ffffffff00000003622763"),
+    ("_text", [], "000000000000000000000019"),
+    ("_text", [None], "0000000100000001000000190000000100000001ffffffff"),
+    ("_int4", [1, None, -3], "00000001000000010000001700000003000000010000000400000001ffffffff00000004fffffffd"),
+])
+def test_array(typname, value, expected):
+    assert _binary_encoder(typname)(value).hex() == expected
+
+
+def test_array_rejects_a_string():
+    with pytest.raises(ValueError):
+        _binary_encoder("_text")("a,b")
+
+
+@pytest.mark.parametrize("value, expected", [
+    (datetime.date(1999, 12, 31), "ffffffff"),
+    (datetime.date(1969, 7, 20), "ffffd48e"),
+    ("2030-01-10", "00002ad7"),
+    (datetime.datetime(2030, 1, 10, 23, 0), "00002ad7"),
+])
+def test_date(value, expected):
+    assert _binary_encoder("date")(value).hex() == expected
+
+
+def test_timestamp_before_the_postgres_epoch():
+    value = datetime.datetime(1999, 12, 31, 23, 59, 59, 500000)
+    assert _binary_encoder("timestamp")(value).hex() == "fffffffffff85ee0"
+
+
+def test_timestamptz_converts_to_utc():
+    value = datetime.datetime(2030, 1, 10, 12, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+    assert _binary_encoder("timestamptz")(value).hex() == "00035dd2c7660800"
+
+
+def test_floats_round_into_integer_columns_as_in_csv():
+    for typname, fmt in (("int2", ">h"), ("int4", ">i"), ("int8", ">q")):
+        for value, expected in ((712.6, 713), (712.4, 712), (-2.5, -3), (Decimal("3500.5"), 3501), (7.0, 7)):
+            assert _binary_encoder(typname)(value) == struct.pack(fmt, expected)
+            assert _csv_encoder(typname)(value) == str(expected)
+
+
+def test_copy_stream_framing():
+    encoders = [_binary_encoder("int4"), _binary_encoder("text")]
+    payload = b"".join(_binary_chunks([(7, None)], encoders))
+    assert payload == BINARY_COPY_HEADER + bytes.fromhex("0002" "00000004" "00000007" "ffffffff") + BINARY_COPY_TRAILER
+
+
+def test_binary_copy_round_trip(db_session):
+    db_session.execute(text("""
+        CREATE TEMP TABLE bulk_upsert_binary_test (
+            id INTEGER PRIMARY KEY, amount NUMERIC(12, 4), tags TEXT[], day DATE, seen TIMESTAMP
+        ) ON COMMIT DROP
+    """))
+    row = (1, Decimal("-1234.5600"), ["a", None, 'b"c', ""], datetime.date(1969, 7, 20),
+           datetime.datetime(1999, 12, 31, 23, 59, 59, 500000))
+    bulk_upsert(db_session, "pg_temp.bulk_upsert_binary_test", columns=["id", "amount", "tags", "day", "seen"],
+                records=[row, (2, 0.5, [], None, None)], conflict_target=["id"], copy_format="binary")
+    rows = db_session.execute(text("SELECT * FROM pg_temp.bulk_upsert_binary_test ORDER BY id")).fetchall()
+    assert rows[0] == row
+    assert rows[1] == (2, Decimal("0.5000"), [], None, None)
+
+
+@pytest.mark.parametrize("copy_format", ["csv", "binary"])
+def test_float_into_an_integer_column_is_stored_the_same_by_both_formats(db_session, copy_format):
+    db_session.execute(text("CREATE TEMP TABLE bulk_upsert_int_test (id INTEGER PRIMARY KEY, price INTEGER) ON COMMIT DROP"))
+    bulk_upsert(db_session, "pg_temp.bulk_upsert_int_test", columns=["id", "price"],
+                records=[(1, 712.6), (2, 712.5), (3, -712.5)], conflict_target=["id"], copy_format=copy_format)
+    rows = db_session.execute(text("SELECT price FROM pg_temp.bulk_upsert_int_test ORDER BY id")).fetchall()
+    # What Postgres stores for CAST(712.6 AS INTEGER) and friends
+    assert [row[0] for row in rows] == [713, 713, -713]
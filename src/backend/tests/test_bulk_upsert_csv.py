@@ -0,0 +1,47 @@
+import pytest
+from sqlalchemy import text
+from bulk_upsert import bulk_upsert, _csv_encoder
+
+TABLE = "pg_temp.bulk_upsert_csv_test"
+
+
+def test_floats_round_into_integer_columns():
+    encode = _csv_encoder("int4")
+    assert encode(3500.0) == "3500"
+    assert encode(3500.5) == "3501"
+    assert encode(-2.5) == "-3"
+    assert encode(None) == ""
+
+
+def test_array_columns_get_postgres_array_literals():
+    encode = _csv_encoder("_text")
+    assert encode(["a", "b"]) == '"{""a"",""b""}"'
+    assert encode([]) == '"{}"'
+    assert encode([None, 'say "hi"']) == '"{NULL,""say \\""hi\\""""}"'
+
+
+def test_list_into_a_scalar_column_is_a_type_error():
+    with pytest.raises(TypeError):
+        _csv_encoder("text")(["a", "b"])
+
+
+def test_csv_copy_round_trips_integer_and_array_columns(db_session):
+    db_session.execute(text("""
+        CREATE TEMP TABLE bulk_upsert_csv_test (
+            id INTEGER PRIMARY KEY, price INTEGER, tags TEXT[], scores INT4[], meta JSONB
+        ) ON COMMIT DROP
+    """))
+    tags = ['has "quotes"', "comma, inside", "{braces}", "back\\slash", "NULL", "", None]
+    bulk_upsert(
+        db_session,
+        TABLE,
+        columns=["id", "price", "tags", "scores", "meta"],
+        records=[
+            (1, 3500.5, tags, [1, None, 3], {"k": ["v"]}),
+            (2, 1999.0, [], None, None),
+        ],
+        conflict_target=["id"],
+    )
+    rows = db_session.execute(text(f"SELECT id, price, tags, scores, meta FROM {TABLE} ORDER BY id")).fetchall()
+    assert rows[0] == (1, 3501, tags, [1, None, 3], {"k": ["v"]})
+    assert rows[1] == (2, 1999, [], None, None)
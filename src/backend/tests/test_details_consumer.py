@@ -0,0 +1,66 @@
+import importlib.util
+import os
+import pytest
+import stream_writer
+from api_messages import details_message
+from aws_utils import execute_query
+from detail_work_queue import DETAIL_QUEUE_TABLE, claim_detail_ids, ensure_detail_queue_table, park_empty_detail_ids
+from conftest import BACKEND_DIR
+
+
+class FakeSession:
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def consumer(monkeypatch):
+    path = os.path.join(BACKEND_DIR, 'property_details_api_sqs_consumer', 'consumer.py')
+    spec = importlib.util.spec_from_file_location("property_details_consumer", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    monkeypatch.setattr(stream_writer, "get_db_session", FakeSession)
+    monkeypatch.setattr(module, "get_db_session", FakeSession)
+    monkeypatch.setattr(module, "prepare_change_detection", lambda: None)
+    monkeypatch.setattr(module, "DETAILS_CHUNK_ROWS", 1)
+    return module
+
+
+class Details:
+    def __init__(self, property_id):
+        self.id = property_id
+
+
+def test_write_failures_fail_every_message_with_the_id_and_empty_ids_are_parked(consumer, monkeypatch):
+    parked = []
+    monkeypatch.setattr(consumer, "park_empty_detail_ids", lambda session, ids: parked.extend(ids) or len(ids))
+    monkeypatch.setattr(consumer, "fetch_property_details",
+                        lambda http, rate_limiter, endpoint: None if endpoint.endswith("/3") else
+                        Details(endpoint.rsplit("/", 1)[-1]))
+
+    def upsert(session, listings, change_stats=None):
+        if any(listing.id == "dup" for listing in listings):
+            raise RuntimeError("write failed")
+
+    monkeypatch.setattr(consumer, "upsert_property_details_to_rds", upsert)
+
+    messages = [details_message(["1", "dup"]), details_message(["dup", "2"]), details_message(["3"])]
+    result = consumer.fetch_and_store_data(messages, fetch_mode="sync")
+
+    assert result["failed_messages"] == [0, 1]
+    assert parked == ["3"]
+
+
+def test_parked_ids_are_not_claimed_again(db_session):
+    ensure_detail_queue_table(db_session)
+    execute_query(db_session, f"""
+        INSERT INTO {DETAIL_QUEUE_TABLE} (id, first_seen) VALUES ('empty', CURRENT_DATE), ('full', CURRENT_DATE)
+    """)
+    assert park_empty_detail_ids(db_session, ["empty"]) == 1
+    assert claim_detail_ids(db_session, 10) == ["full"]
@@ -0,0 +1,86 @@
+import sys
+import threading
+import time
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+import aws_utils
+
+
+def test_concurrent_cold_calls_share_one_engine(monkeypatch):
+    created = []
+
+    def slow_init(db_name, max_retries, backoff_base):
+        time.sleep(0.05)
+        engine = create_engine("sqlite://", poolclass=QueuePool)
+        created.append((engine, max_retries, backoff_base))
+        return engine
+
+    monkeypatch.setattr(aws_utils, "init_sqlalchemy_engine", slow_init)
+    manager = aws_utils.EngineManager(max_retries=3, backoff_base=2)
+    start = threading.Barrier(8)
+    engines = []
+
+    def worker():
+        start.wait()
+        engines.append(manager.get_engine("test", max_retries=5, backoff_base=1))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == 1
+    assert all(engine is created[0][0] for engine in engines)
+    assert manager.pool_stats("test")["engines_created"] == 1
+    # Per-call retry settings reach the factory without changing the manager's defaults
+    assert created[0][1:] == (5, 1)
+    assert (manager.max_retries, manager.backoff_base) == (3, 2)
+    manager.dispose()
+
+
+def make_manager(monkeypatch):
+    monkeypatch.setattr(aws_utils, "init_sqlalchemy_engine",
+                        lambda db_name, max_retries, backoff_base: create_engine("sqlite://", poolclass=QueuePool,
+                                                                                 pool_size=8, max_overflow=0))
+    return aws_utils.EngineManager()
+
+
+def test_concurrent_checkouts_are_all_counted(monkeypatch):
+    manager = make_manager(monkeypatch)
+    engine = manager.get_engine("test")
+    before = manager.pool_stats("test")["checkouts"]
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        def worker():
+            for _ in range(200):
+                engine.connect().close()
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    assert manager.pool_stats("test")["checkouts"] - before == 1600
+    manager.dispose()
+
+
+def test_checkout_does_not_wait_for_the_manager_lock(monkeypatch):
+    manager = make_manager(monkeypatch)
+    engine = manager.get_engine("test")
+    checked_out = threading.Event()
+
+    def worker():
+        engine.connect().close()
+        checked_out.set()
+
+    # The manager lock is held while validating through the pool, so pool listeners must
+    # not need it
+    with manager._lock:
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        assert checked_out.wait(timeout=2)
+    manager.dispose()
@@ -0,0 +1,30 @@
+import datetime
+from listing_dedup import ListingDeduper
+from listing_records import SearchListing
+
+DAY = datetime.date(2030, 1, 10)
+
+
+def listing(listing_id, price=1000):
+    return SearchListing(id=listing_id, price=price, longitude=-73.9, latitude=40.7, url=f"/rental/{listing_id}")
+
+
+def write(deduper, day, listings):
+    invocation = deduper.start_invocation(day)
+    rows = deduper.prepare([((invocation, 0, 0, position), item) for position, item in enumerate(listings)])
+    deduper.commit(rows)
+    return [item.id for _, item in rows]
+
+
+def test_unchanged_repeat_is_skipped_on_the_same_snapshot_day():
+    deduper = ListingDeduper()
+    assert write(deduper, DAY, [listing("1"), listing("2")]) == ["1", "2"]
+    assert write(deduper, DAY, [listing("1"), listing("2", price=1100)]) == ["2"]
+    assert deduper.stats["skipped_unchanged"] == 1
+
+
+def test_new_snapshot_day_writes_every_listing_again():
+    deduper = ListingDeduper()
+    write(deduper, DAY, [listing("1"), listing("2")])
+    # The database date moved on, even if the Lambda clock has not
+    assert write(deduper, DAY + datetime.timedelta(days=1), [listing("1"), listing("2")]) == ["1", "2"]
@@ -0,0 +1,61 @@
+import json
+from listing_records import decode_property_details, decode_search_page
+
+
+def details_body(**fields):
+    body = {
+        "id": 4001, "status": "open", "listedAt": "2030-01-02", "daysOnMarket": 8, "price": 3500,
+        "zipcode": "11211", "sqft": 700, "bedrooms": 1, "bathrooms": 1, "builtIn": 1920,
+        "amenities": ["dishwasher", "elevator"], "agents": ["A. Agent"], "building": {"id": 77},
+        "noFee": True, "images": ["https://img/1.jpg"], "videos": [], "floorplans": None,
+    }
+    body.update(fields)
+    return json.dumps(body).encode()
+
+
+def test_well_formed_details_decode_unchanged():
+    details = decode_property_details(details_body())
+    assert details.id == "4001"
+    assert details.days_on_market == 8
+    assert details.amenities == ["dishwasher", "elevator"]
+    assert details.building.id == "77"
+    assert details.floorplans is None
+
+
+def test_malformed_field_does_not_fail_the_response():
+    details = decode_property_details(details_body(
+        agents=["A. Agent", None, {"name": "nested"}],
+        daysOnMarket="12",
+        builtIn="unknown",
+        sqft=712.6,
+        price="3,500",
+        images="https://img/only.jpg",
+        noFee="true",
+        building="not an object",
+    ))
+    assert details.agents == ["A. Agent"]
+    assert details.days_on_market == 12
+    assert details.built_in is None
+    assert details.sqft == 713
+    assert details.price == 3500
+    assert details.images == ["https://img/only.jpg"]
+    assert details.no_fee is True
+    assert details.building is None
+    assert details.amenities == ["dishwasher", "elevator"]
+
+
+def test_malformed_listing_does_not_fail_the_search_page():
+    page = decode_search_page(json.dumps({
+        "listings": [
+            {"id": 1, "price": 3000, "latitude": 40.7, "longitude": -73.9, "url": "/rental/1"},
+            None,
+            {"id": "2", "price": "N/A", "latitude": "40.71", "longitude": None, "url": 5},
+        ],
+        "pagination": {"total": "2", "nextOffset": None},
+    }).encode())
+    assert [listing.id for listing in page.listings] == ["1", "2"]
+    assert page.listings[1].price is None
+    assert page.listings[1].latitude == 40.71
+    assert page.listings[1].url == "5"
+    assert page.pagination.total == 2
+    assert page.pagination.next_offset is None
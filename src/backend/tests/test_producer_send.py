@@ -0,0 +1,86 @@
+import json
+import sys
+import types
+import pytest
+from sqlalchemy import text
+import producer
+from unsent_messages import UNSENT_MESSAGES_TABLE, ensure_unsent_messages_table, save_unsent_bodies
+
+
+class FakeSQS:
+    """send_message_batch stand-in that fails the entries whose body is in failing."""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.sent = []
+
+    def send_message_batch(self, QueueUrl, Entries):
+        successful, failed = [], []
+        for entry in Entries:
+            if entry["MessageBody"] in self.failing:
+                failed.append({"Id": entry["Id"], "SenderFault": False, "Code": "InternalError"})
+            else:
+                self.sent.append(entry["MessageBody"])
+                successful.append({"Id": entry["Id"]})
+        return {"Successful": successful, "Failed": failed}
+
+
+@pytest.fixture
+def fake_sqs(monkeypatch):
+    sqs = FakeSQS()
+    monkeypatch.setitem(sys.modules, "boto3", types.SimpleNamespace(client=lambda service: sqs))
+    monkeypatch.setattr(producer.time, "sleep", lambda seconds: None)
+    monkeypatch.setenv("PROPERTIES_API_URL", "https://sqs.test/properties")
+    return sqs
+
+
+def payloads(count):
+    return [{"areas": str(i)} for i in range(count)]
+
+
+def test_send_message_batches_returns_failed_bodies():
+    sqs = FakeSQS(failing={json.dumps({"areas": "3"})})
+    result = producer.send_message_batches(sqs, "https://sqs.test/properties", payloads(25))
+
+    assert result["sent"] == 24
+    assert result["failed"] == 1
+    assert result["failed_bodies"] == [json.dumps({"areas": "3"})]
+
+
+@pytest.fixture
+def producer_session(db_session, monkeypatch):
+    monkeypatch.setattr(producer, "get_db_session", lambda: db_session)
+    return db_session
+
+
+def test_partial_failure_resends_only_the_unsent_messages(fake_sqs, producer_session, monkeypatch):
+    builds = []
+    monkeypatch.setattr(producer, "fetch_api_payloads", lambda api_type: builds.append(api_type) or payloads(25))
+    fake_sqs.failing = {json.dumps({"areas": "3"}), json.dumps({"areas": "17"})}
+
+    with pytest.raises(Exception, match="Failed to enqueue 2 of 25 messages"):
+        producer.lambda_handler({"api_type": "properties"}, None)
+    assert len(fake_sqs.sent) == 23
+
+    # The retry sends the two saved messages without rebuilding the plan
+    fake_sqs.failing = set()
+    response = producer.lambda_handler({"api_type": "properties"}, None)
+
+    assert response["statusCode"] == 200
+    assert (json.loads(response["body"])["sent"], len(builds)) == (2, 1)
+    assert sorted(fake_sqs.sent) == sorted(json.dumps(payload) for payload in payloads(25))
+
+    # Nothing is left over, so the next run builds a fresh plan
+    producer.lambda_handler({"api_type": "properties"}, None)
+    assert len(builds) == 2
+
+
+def test_stale_unsent_messages_are_not_resent(fake_sqs, producer_session, monkeypatch):
+    monkeypatch.setattr(producer, "fetch_api_payloads", lambda api_type: payloads(3))
+    ensure_unsent_messages_table(producer_session)
+    save_unsent_bodies(producer_session, "properties", [json.dumps({"areas": "old"})])
+    producer_session.execute(text(f"UPDATE {UNSENT_MESSAGES_TABLE} SET created_at = now() - interval '2 days'"))
+
+    producer.lambda_handler({"api_type": "properties"}, None)
+
+    assert sorted(fake_sqs.sent) == sorted(json.dumps(payload) for payload in payloads(3))
@@ -0,0 +1,34 @@
+import time
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+import aws_utils
+
+
+def test_failed_statement_does_not_skew_later_latencies():
+    engine = create_engine("sqlite://")
+    aws_utils.instrument_engine(engine)
+
+    @event.listens_for(engine, "connect")
+    def _add_sleep(dbapi_connection, connection_record):
+        dbapi_connection.create_function("sleep_ms", 1, lambda ms: time.sleep(ms / 1000) or ms)
+
+    aws_utils._query_stats.reset()
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+        info = {key: list(value) if isinstance(value, list) else value for key, value in connection.info.items()}
+        # Fails after its before_cursor_execute listener ran, and leaves nothing behind on
+        # the pooled connection
+        with pytest.raises(OperationalError):
+            connection.execute(text("SELECT * FROM missing_table"))
+        assert connection.info == info
+        time.sleep(0.2)
+        connection.execute(text("SELECT sleep_ms(50)"))
+        connection.execute(text("SELECT 1"))
+
+    by_statement = {q["statement"]: q for q in aws_utils.get_query_summary()}
+    slow = next(q for statement, q in by_statement.items() if "sleep_ms" in statement)
+    fast = next(q for statement, q in by_statement.items() if "sleep_ms" not in statement)
+    assert 50 <= slow["max_ms"] < 200
+    assert fast["max_ms"] < 50
+    assert fast["calls"] == 2 and slow["calls"] == 1
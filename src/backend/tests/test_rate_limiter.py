@@ -0,0 +1,90 @@
+import os
+import threading
+import time
+import pytest
+from sqlalchemy import create_engine
+import aws_utils
+import rate_limiter
+from rate_limiter import MemoryRateLimitBackend, RateLimiter, RateLimitStats, RateLimitTimeout
+
+
+class SlowBackend(MemoryRateLimitBackend):
+    """A shared backend whose every reservation takes one round trip of latency."""
+
+    def __init__(self, latency):
+        super().__init__()
+        self.latency = latency
+
+    def reserve(self, *args, **kwargs):
+        time.sleep(self.latency)
+        return super().reserve(*args, **kwargs)
+
+
+def test_backend_round_trips_overlap_across_threads():
+    limiter = RateLimiter("test", rate=1000, burst=1000, backend=SlowBackend(0.05), stats=RateLimitStats())
+    threads = [threading.Thread(target=limiter.acquire) for _ in range(8)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Serialized behind one lock this would take 8 round trips
+    assert time.perf_counter() - start < 0.2
+
+
+def test_batched_reservations_hand_out_every_token():
+    limiter = RateLimiter("test", rate=1000, burst=1000, backend=SlowBackend(0.01), reserve_batch=4,
+                          stats=RateLimitStats())
+    threads = [threading.Thread(target=limiter.acquire) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert limiter.stats.summary()["test"]["acquires"] == 10
+
+
+@pytest.mark.parametrize("reserve_batch", [1, 4])
+def test_wait_is_capped_at_the_invocation_deadline(monkeypatch, reserve_batch):
+    # 30 seconds left in the invocation, 10 of them kept as margin
+    monkeypatch.setattr(aws_utils, "_invocation_deadline", time.time() + 30)
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_DEADLINE_MARGIN_SECONDS", 10)
+    limiter = RateLimiter("test", rate=0.01, burst=1, backend=MemoryRateLimitBackend(),
+                          reserve_batch=reserve_batch, stats=RateLimitStats())
+    limiter.acquire()
+    start = time.perf_counter()
+    # The next token is 100 s away: fail now rather than sleep past the deadline
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire()
+    assert time.perf_counter() - start < 1
+    assert limiter.stats.summary()["test"]["timeouts"] == 1
+
+
+def test_postgres_reservations_share_one_connection(monkeypatch):
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    engine = create_engine(url, pool_size=5, max_overflow=5)
+    monkeypatch.setattr(rate_limiter, "get_sqlalchemy_engine", lambda db_name: engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE SCHEMA IF NOT EXISTS real_estate")
+    backend = rate_limiter.PostgresRateLimitBackend()
+    checked_out = []
+
+    def reserve():
+        for _ in range(5):
+            backend.reserve("test", 1000, 1000, 1)
+            checked_out.append(engine.pool.checkedout())
+
+    threads = [threading.Thread(target=reserve) for _ in range(16)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(checked_out) == 80
+        assert max(checked_out) == 1
+    finally:
+        backend._close_connection()
+        with engine.begin() as connection:
+            connection.exec_driver_sql(f"DELETE FROM {rate_limiter.RATE_LIMIT_TABLE} WHERE provider = 'test'")
+        engine.dispose()
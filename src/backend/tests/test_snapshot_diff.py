@@ -0,0 +1,77 @@
+import datetime
+import pytest
+from aws_utils import execute_query
+from detail_work_queue import ensure_detail_queue_table
+import snapshot_diff
+
+TODAY = datetime.date(2030, 1, 10)
+DAY = datetime.timedelta(days=1)
+
+
+@pytest.fixture(autouse=True)
+def detail_queue(db_session):
+    ensure_detail_queue_table(db_session)
+
+
+def add_snapshot(session, day, prices):
+    for listing_id, price in prices.items():
+        execute_query(session, """
+            INSERT INTO real_estate.fct_properties (id, price, latitude, longitude, url, date)
+            VALUES (:id, :price, 40.7, -73.9, :url, :date)
+        """, {"id": listing_id, "price": price, "url": f"/rental/{listing_id}", "date": day})
+
+
+def add_details(session, ids):
+    for listing_id in ids:
+        execute_query(session, "INSERT INTO real_estate.dim_property_details (id, status, price) VALUES (:id, 'open', 1000)",
+                      {"id": listing_id})
+
+
+def statuses(session):
+    return dict(execute_query(session, "SELECT id, status FROM real_estate.dim_property_details").fetchall())
+
+
+def diffed_days(session):
+    return [row[0] for row in execute_query(session, f"SELECT day FROM {snapshot_diff.SNAPSHOT_DIFFS_TABLE}")]
+
+
+def test_latest_day_is_not_claimed_while_it_may_be_loading(db_session):
+    add_details(db_session, ["1", "2", "3"])
+    add_snapshot(db_session, TODAY - DAY, {"1": 1000, "2": 1000, "3": 1000})
+    # Today's fan-out has only written its first chunk
+    add_snapshot(db_session, TODAY, {"1": 1000})
+
+    assert snapshot_diff.diff_latest_snapshot(db_session) is None
+    assert diffed_days(db_session) == []
+    assert statuses(db_session) == {"1": "open", "2": "open", "3": "open"}
+
+
+def test_complete_day_is_diffed_once(db_session):
+    add_details(db_session, ["1", "2", "3", "4", "5", "6"])
+    add_snapshot(db_session, TODAY - 2 * DAY, {"1": 1000, "2": 1000, "3": 1000, "4": 1000, "5": 1000, "6": 1000})
+    add_snapshot(db_session, TODAY - DAY, {"1": 1100, "2": 1000, "3": 1000, "4": 1000, "5": 1000})
+    add_snapshot(db_session, TODAY, {"1": 1100})
+
+    counts = snapshot_diff.diff_latest_snapshot(db_session)
+
+    assert diffed_days(db_session) == [TODAY - DAY]
+    assert counts["price_changed"] == 1
+    assert counts["unchanged"] == 4
+    assert counts["disappeared"] == 1
+    assert counts["closed"] == 1
+    # 2-5 are missing from today's partial snapshot but stay open
+    assert statuses(db_session) == {"1": "open", "2": "open", "3": "open", "4": "open", "5": "open", "6": "closed"}
+    assert snapshot_diff.diff_latest_snapshot(db_session) is None
+
+
+def test_listing_back_in_a_later_day_is_not_closed(db_session):
+    add_details(db_session, ["1", "2", "3", "4", "5", "6"])
+    add_snapshot(db_session, TODAY - 2 * DAY, {"1": 1000, "2": 1000, "3": 1000, "4": 1000, "5": 1000, "6": 1000})
+    add_snapshot(db_session, TODAY - DAY, {"1": 1000, "2": 1000, "3": 1000, "4": 1000, "5": 1000})
+    add_snapshot(db_session, TODAY, {"6": 1000})
+
+    counts = snapshot_diff.diff_latest_snapshot(db_session)
+
+    assert counts["disappeared"] == 1
+    assert counts["closed"] == 0
+    assert statuses(db_session)["6"] == "open"
@@ -0,0 +1,61 @@
+import threading
+import pytest
+import stream_writer
+from stream_writer import StreamWriter, StreamWriterStats
+
+
+class FakeSession:
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def failing_write(session, chunk):
+    raise RuntimeError("write failed")
+
+
+def broken_tags(chunk):
+    raise ValueError("cannot tag")
+
+
+def test_a_dead_writer_thread_fails_put_instead_of_blocking(monkeypatch):
+    monkeypatch.setattr(stream_writer, "get_db_session", FakeSession)
+    writer = StreamWriter("test", failing_write, chunk_rows=1, max_pending=1, tag_records=broken_tags,
+                          stats=StreamWriterStats())
+    raised = []
+
+    def produce():
+        try:
+            for i in range(100):
+                writer.put([i])
+        except ValueError as e:
+            raised.append(e)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    producer.join(timeout=5)
+    assert not producer.is_alive()
+    assert [str(e) for e in raised] == ["cannot tag"]
+    with pytest.raises(ValueError, match="cannot tag"):
+        writer.close()
+
+
+def test_failed_chunks_are_tagged_and_later_chunks_written(monkeypatch):
+    monkeypatch.setattr(stream_writer, "get_db_session", FakeSession)
+    written = []
+
+    def write(session, chunk):
+        if 2 in chunk:
+            raise RuntimeError("write failed")
+        written.extend(chunk)
+
+    with StreamWriter("test", write, chunk_rows=1, tag_records=list, stats=StreamWriterStats()) as writer:
+        for i in range(4):
+            writer.put([i])
+    assert written == [0, 1, 3]
+    assert writer.result["failed_tags"] == [2]